@@ -0,0 +1,51 @@
+# ############################################################################################################ #
+# AdaptiveTimeout derives a per-target probe timeout from smoothed RTT and RTT variance, the way TCP computes  #
+# its retransmission timeout (RFC 6298), clamped to a configurable floor and ceiling.                          #
+# ############################################################################################################ #
+
+from constants import RTO_INITIAL, RTO_MIN, RTO_MAX
+
+ALPHA = 1 / 8       # Gain of the smoothed RTT
+BETA = 1 / 4        # Gain of the RTT variance
+K = 4               # Variance multiplier
+GRANULARITY = 0.001 # Clock granularity G, in seconds
+
+class AdaptiveTimeout:
+    def __init__(self, floor: float = RTO_MIN, ceiling: float = RTO_MAX, initial: float = RTO_INITIAL):
+        self.__floor: float = floor                        # Lowest timeout ever returned, in seconds
+        self.__ceiling: float = ceiling                    # Highest timeout ever returned, in seconds
+        self.__srtt: float = None                          # Smoothed RTT, None until the first sample
+        self.__rttvar: float = 0.0                         # RTT variation
+        self.__rto: float = self.__clamp(initial)          # Current timeout
+
+    # ############################################################
+    # Getters                                                    #
+    # ############################################################
+    def get_timeout(self) -> float:
+        return self.__rto
+
+    def get_srtt(self) -> float:
+        return self.__srtt
+
+    # ############################################################
+    # Public Functions                                           #
+    # ############################################################
+    def update(self, rtt: float):
+        """Folds in an RTT sample (seconds) from a probe that was answered (RFC 6298 section 2)."""
+        if self.__srtt is None:
+            self.__srtt = rtt
+            self.__rttvar = rtt / 2
+        else:
+            self.__rttvar = (1 - BETA) * self.__rttvar + BETA * abs(self.__srtt - rtt)
+            self.__srtt = (1 - ALPHA) * self.__srtt + ALPHA * rtt
+        self.__rto = self.__clamp(self.__srtt + max(GRANULARITY, K * self.__rttvar))
+
+    def back_off(self):
+        """Doubles the timeout after a probe was lost (RFC 6298 section 5.5)."""
+        self.__rto = self.__clamp(self.__rto * 2)
+
+    # ############################################################
+    # Private Functions                                          #
+    # ############################################################
+    def __clamp(self, timeout: float) -> float:
+        return min(max(timeout, self.__floor), self.__ceiling)
@@ -0,0 +1,180 @@
+# ############################################################################################################ #
+# MessageBatch sends and receives many datagrams per system call with sendmmsg(2) and recvmmsg(2), via ctypes. #
+# The mmsghdr arrays, socket addresses and buffers are allocated once; a send copies each packet and address   #
+# into its slot, and a receive fills every buffer the kernel has a datagram for. BATCHED_SYSCALLS is False     #
+# where libc lacks the calls (anything but Linux); callers then fall back to one sendto/recvfrom per packet.   #
+# ############################################################################################################ #
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import socket
+import struct
+import sys
+from constants import ICMP_HEADER_SIZE, TIMESTAMP_SIZE, MAX_BATCH
+
+MIN_SLOT_SIZE = 576          # Every IPv4 host accepts datagrams this large (RFC 791), ICMP errors included
+MAX_IP_HEADER_SIZE = 60
+MSG_DONTWAIT = getattr(socket, "MSG_DONTWAIT", 0x40)
+ADDRESS = struct.Struct("=I")  # An IPv4 address as the integer its network-order bytes read as, in place
+
+class IoVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+class MsgHdr(ctypes.Structure):
+    _fields_ = [("msg_name", ctypes.c_void_p), ("msg_namelen", ctypes.c_uint32), ("msg_iov", ctypes.POINTER(IoVec)),
+                ("msg_iovlen", ctypes.c_size_t), ("msg_control", ctypes.c_void_p), ("msg_controllen", ctypes.c_size_t),
+                ("msg_flags", ctypes.c_int)]
+
+class MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", MsgHdr), ("msg_len", ctypes.c_uint)]
+
+class SockaddrIn(ctypes.Structure):
+    _fields_ = [("sin_family", ctypes.c_ushort), ("sin_port", ctypes.c_uint16), ("sin_addr", ctypes.c_ubyte * 4),
+                ("sin_zero", ctypes.c_ubyte * 8)]
+
+def _load_libc():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(MMsgHdr), ctypes.c_uint, ctypes.c_int]
+        libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(MMsgHdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    except (OSError, AttributeError):
+        return None
+    libc.sendmmsg.restype = ctypes.c_int
+    libc.recvmmsg.restype = ctypes.c_int
+    return libc
+
+_libc = _load_libc()
+BATCHED_SYSCALLS = _libc is not None
+
+def slot_size_for(payload: bytes) -> int:
+    """Returns a receive buffer size that holds a reply to an echo request carrying `payload`."""
+    return max(MIN_SLOT_SIZE, MAX_IP_HEADER_SIZE + ICMP_HEADER_SIZE + TIMESTAMP_SIZE + len(payload))
+
+def _raise_errno():
+    error = ctypes.get_errno()
+    if error in (errno.EAGAIN, errno.EWOULDBLOCK):
+        raise BlockingIOError(error, os.strerror(error))
+    if error == errno.EINTR:
+        raise InterruptedError(error, os.strerror(error))
+    raise OSError(error, os.strerror(error))
+
+class MessageBatch:
+    def __init__(self, size: int, slotSize: int = MIN_SLOT_SIZE):
+        if not BATCHED_SYSCALLS:
+            raise OSError(errno.ENOSYS, "sendmmsg/recvmmsg are not available")
+        size = min(size, MAX_BATCH)
+        self.__size: int = size                               # Messages per system call
+        self.__slotSize: int = slotSize                       # Bytes of every send and receive buffer
+        self.__buffers: list = [bytearray(slotSize) for _ in range(size)]  # One received datagram each
+        self.__views: list = [memoryview(buffer) for buffer in self.__buffers]
+        # The arrays live in bytearrays, so the hot loops read and write them through integer views
+        # instead of creating a ctypes object for every field they touch
+        self.__receiveHeaderBytes = bytearray(size * ctypes.sizeof(MMsgHdr))
+        self.__receiveNameBytes = bytearray(size * ctypes.sizeof(SockaddrIn))
+        self.__receiveHeaders = (MMsgHdr * size).from_buffer(self.__receiveHeaderBytes)
+        self.__receiveNames = (SockaddrIn * size).from_buffer(self.__receiveNameBytes)
+        self.__receiveVectors = (IoVec * size)()
+        self.__receivedLengths = memoryview(self.__receiveHeaderBytes).cast("I")  # msg_len of every message
+        self.__sources = memoryview(self.__receiveNameBytes).cast("I")            # sin_addr of every message
+        self.__sendBuffer = bytearray(size * slotSize)        # Sends copy each packet into its slot
+        self.__sendVectorBytes = bytearray(size * ctypes.sizeof(IoVec))
+        self.__sendNameBytes = bytearray(size * ctypes.sizeof(SockaddrIn))
+        self.__sendVectors = (IoVec * size).from_buffer(self.__sendVectorBytes)
+        self.__sendNames = (SockaddrIn * size).from_buffer(self.__sendNameBytes)
+        self.__sendHeaders = (MMsgHdr * size)()
+        self.__sendLengths = memoryview(self.__sendVectorBytes).cast("N")         # iov_len of every message
+        self.__destinations = memoryview(self.__sendNameBytes).cast("I")          # sin_addr of every message
+        # Index of each slot's field in the integer views above
+        self.__receivedLengthIndexes: list = self.__field_indexes(MMsgHdr, MMsgHdr.msg_len, 4)
+        self.__sourceIndexes: list = self.__field_indexes(SockaddrIn, SockaddrIn.sin_addr, 4)
+        self.__sendLengthIndexes: list = self.__field_indexes(IoVec, IoVec.iov_len, ctypes.sizeof(ctypes.c_size_t))
+        self.__destinationIndexes: list = self.__sourceIndexes
+        self.__addresses: dict = {}                           # Dotted address -> ADDRESS integer
+        self.__names: dict = {}                               # ADDRESS integer -> dotted address
+        send_base = ctypes.addressof(ctypes.c_char.from_buffer(self.__sendBuffer))
+        for index in range(size):
+            vector = self.__receiveVectors[index]
+            vector.iov_base = ctypes.addressof(ctypes.c_char.from_buffer(self.__buffers[index]))
+            vector.iov_len = slotSize
+            header = self.__receiveHeaders[index].msg_hdr
+            header.msg_name = ctypes.addressof(self.__receiveNames[index])
+            header.msg_namelen = ctypes.sizeof(SockaddrIn)
+            header.msg_iov = ctypes.pointer(vector)
+            header.msg_iovlen = 1
+            self.__sendVectors[index].iov_base = send_base + index * slotSize
+            self.__sendNames[index].sin_family = socket.AF_INET
+            header = self.__sendHeaders[index].msg_hdr
+            header.msg_name = ctypes.addressof(self.__sendNames[index])
+            header.msg_namelen = ctypes.sizeof(SockaddrIn)
+            header.msg_iov = ctypes.pointer(self.__sendVectors[index])
+            header.msg_iovlen = 1
+
+    # ############################################################
+    # Getters                                                    #
+    # ############################################################
+    def get_size(self) -> int:
+        return self.__size
+
+    def get_message(self, index: int) -> tuple:
+        """Returns (buffer, view, length, (address, 0)) of the datagram the last receive() put in slot `index`.
+
+        The buffer is reused by the next receive().
+        """
+        source = self.__sources[self.__sourceIndexes[index]]
+        name = self.__names.get(source)
+        if name is None:
+            name = self.__names[source] = socket.inet_ntoa(ADDRESS.pack(source))
+        return (self.__buffers[index], self.__views[index],
+                self.__receivedLengths[self.__receivedLengthIndexes[index]], (name, 0))
+
+    # ############################################################
+    # Public Functions                                           #
+    # ############################################################
+    def send(self, fd: int, packets: list, addresses: list, offset: int = 0) -> int:
+        """Sends packets[offset:] to the matching addresses, at most get_size() of them.
+
+        Every packet must fit in a slot. Returns how many were sent; fewer than given when the next one failed,
+        which the next call raises as OSError.
+        """
+        count = min(self.__size, len(packets) - offset)
+        buffer = self.__sendBuffer
+        slot_size = self.__slotSize
+        lengths = self.__sendLengths
+        length_indexes = self.__sendLengthIndexes
+        destinations = self.__destinations
+        destination_indexes = self.__destinationIndexes
+        known = self.__addresses
+        for index in range(count):
+            packet = packets[offset + index]
+            start = index * slot_size
+            buffer[start:start + len(packet)] = packet
+            lengths[length_indexes[index]] = len(packet)
+            address = addresses[offset + index]
+            destination = known.get(address)
+            if destination is None:
+                destination = known[address] = ADDRESS.unpack(socket.inet_aton(address))[0]
+            destinations[destination_indexes[index]] = destination
+        sent = _libc.sendmmsg(fd, self.__sendHeaders, count, 0)
+        if sent < 0:
+            _raise_errno()
+        return sent
+
+    def receive(self, fd: int) -> int:
+        """Receives every datagram that is ready, up to get_size(), without blocking. Returns how many.
+
+        Raises BlockingIOError when none is ready.
+        """
+        received = _libc.recvmmsg(fd, self.__receiveHeaders, self.__size, MSG_DONTWAIT, None)
+        if received < 0:
+            _raise_errno()
+        return received
+
+    # ############################################################
+    # Private Functions                                          #
+    # ############################################################
+    def __field_indexes(self, structure, field, itemSize: int) -> list:
+        return [(index * ctypes.sizeof(structure) + field.offset) // itemSize for index in range(self.__size)]
@@ -0,0 +1,279 @@
+# ############################################################################################################ #
+# Benchmarks for the packet pipeline.                                                                          #
+# Microbenchmarks time each hot-path stage across payload sizes; the loopback harness drives a pipelined Ping  #
+# against SimulatedNetwork (no root, no network) and reports packets/sec, CPU time and memory per probe, plus  #
+# a per-stage breakdown from a profiled run.                                                                   #
+# Results can be saved as JSON and compared with an earlier run.                                               #
+#                                                                                                              #
+# Usage: python3 benchmark.py [--quick] [--probes N] [--simulate SPEC] [--output FILE] [--compare FILE]        #
+# ############################################################################################################ #
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+import tracemalloc
+from datetime import datetime, timezone
+from statistics import Statistics
+from icmp_packet import IcmpPacket
+from echo_reply import EchoReply
+from checksum import internet_checksum
+from packet_template import EchoRequestTemplate
+from reply_decoder import ReplyDecoder
+from simulated_network import SimulatedNetwork
+from stage_profiler import StageProfiler
+from ping import Ping
+from constants import RAW_DATA, ICMP_HEADER_SIZE, TIMESTAMP_SIZE
+
+PAYLOAD_SIZES = (len(RAW_DATA), 512, 1464, 8192)   # Data bytes after the timestamp
+IDENTIFIER = 0x1234
+TARGET = "198.51.100.1"                            # TEST-NET-2, never routed
+REPEAT = 5
+HARNESS_TIMEOUT = 1.0                              # Seconds before a probe lost by the simulation is given up
+
+def _payload(size: int) -> bytes:
+    return (RAW_DATA.encode("utf-8") * (size // len(RAW_DATA) + 1))[:size]
+
+def _reply(payload: bytes, sequenceNumber: int = 0) -> bytes:
+    """Returns the IPv4 datagram SimulatedNetwork answers an echo request with."""
+    with SimulatedNetwork().open() as responder:
+        responder.sendto(EchoRequestTemplate(IDENTIFIER, payload).build(sequenceNumber, time.time()), (TARGET, 0))
+        return responder.recvfrom(65535)[0]
+
+def _time(function, repeat: int) -> dict:
+    """Times `function` with timeit, calibrating the loop count so each repetition takes about 0.2 s."""
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    runs = timer.repeat(repeat=repeat, number=number)
+    per_op = sorted(run / number * 1e9 for run in runs)
+    return {"ns_per_op_best": round(per_op[0], 1), "ns_per_op_median": round(per_op[len(per_op) // 2], 1),
+            "ops_per_repeat": number}
+
+# ############################################################
+# Microbenchmarks                                            #
+# ############################################################
+def bench_build_echo_request(size: int):
+    if size != len(RAW_DATA):
+        return None  # IcmpPacket always carries RAW_DATA when built without a template
+    statistics = Statistics()
+    def build():
+        IcmpPacket(statistics).build_echo_request_packet(IDENTIFIER, 1)
+    return build
+
+def bench_build_from_template(size: int):
+    template = EchoRequestTemplate(IDENTIFIER, _payload(size))
+    return lambda: template.build(1, 1700000000.0)
+
+def bench_checksum(size: int):
+    packet = EchoRequestTemplate(IDENTIFIER, _payload(size)).build(1, 1700000000.0)
+    return lambda: internet_checksum(packet)
+
+def bench_echo_reply_parse(size: int):
+    reply = _reply(_payload(size))
+    statistics = Statistics()
+    def parse():
+        echo_reply = EchoReply(reply, statistics)
+        echo_reply.get_icmp_type()
+        echo_reply.get_icmp_identifier()
+        echo_reply.get_icmp_sequence_number()
+        echo_reply.get_icmp_data_bytes()
+    return parse
+
+def bench_validate_reply(size: int):
+    if size != len(RAW_DATA):
+        return None
+    icmp_packet = IcmpPacket(Statistics())
+    icmp_packet.build_echo_request_packet(IDENTIFIER, 0)
+    echo_reply = EchoReply(_reply(_payload(size)), Statistics())
+    validate = icmp_packet._IcmpPacket__validate_reply  # Private, but it is the stage being measured
+    return lambda: validate(echo_reply)
+
+def bench_reply_decoder(size: int):
+    payload = _payload(size)
+    responder = SimulatedNetwork().open()
+    template = EchoRequestTemplate(IDENTIFIER, payload)
+    packet = template.build(0, 1700000000.0)
+    decoder = ReplyDecoder(payload)
+    def receive_and_decode():
+        responder.sendto(packet, (TARGET, 0))
+        decoder.receive(responder)
+        decoder.decode_echo()
+        decoder.payload_is_valid()
+    return receive_and_decode
+
+def bench_update_rtt(size: int):
+    if size != len(RAW_DATA):
+        return None
+    statistics = Statistics()
+    rtts = [0.1 + (i % 997) * 0.013 for i in range(1000)]
+    state = {"i": 0}
+    def update():
+        state["i"] = (state["i"] + 1) % 1000
+        statistics.update_rtt(rtts[state["i"]])
+    return update
+
+MICROBENCHMARKS = [
+    ("build_echo_request_packet", bench_build_echo_request),
+    ("template_build", bench_build_from_template),
+    ("internet_checksum", bench_checksum),
+    ("echo_reply_parse", bench_echo_reply_parse),
+    ("validate_reply", bench_validate_reply),
+    ("simulated_receive_decode", bench_reply_decoder),
+    ("update_rtt", bench_update_rtt),
+]
+
+def run_microbenchmarks(sizes, repeat: int) -> list:
+    results = []
+    for name, factory in MICROBENCHMARKS:
+        for size in sizes:
+            function = factory(size)
+            if function is None:
+                continue
+            result = {"name": name, "payload_size": size}
+            result.update(_time(function, repeat))
+            results.append(result)
+            print(f"  {name:<28} {size:>6} B  {result['ns_per_op_best']:>12.1f} ns/op (median "
+                  f"{result['ns_per_op_median']:.1f})")
+    return results
+
+# ############################################################
+# Loopback harness                                           #
+# ############################################################
+def _run_ping(probes: int, simulation: str, profiler: StageProfiler = None) -> Statistics:
+    ping = Ping(TARGET, probes, 0, pipelined=True, timeout=HARNESS_TIMEOUT, socket_filter=False,
+                transport=SimulatedNetwork.from_spec(simulation), profiler=profiler)
+    # Per-reply output is part of the pipeline, but not worth showing
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        try:
+            ping.send_ping()
+        except SystemExit:
+            pass
+    return ping.get_statistics()
+
+def run_network(probes: int, simulation: str, burst: int = 64) -> dict:
+    """Measures the simulated network on its own: bursts of requests, each followed by draining the replies."""
+    packet = EchoRequestTemplate(IDENTIFIER).build(0, 1700000000.0)
+    buffer = bytearray(65535)
+    replies = 0
+    with SimulatedNetwork.from_spec(simulation).open() as endpoint:
+        start = time.perf_counter()
+        for sent in range(0, probes, burst):
+            for _ in range(min(burst, probes - sent)):
+                endpoint.sendto(packet, (TARGET, 0))
+            try:
+                while True:
+                    endpoint.recvfrom_into(buffer)
+                    replies += 1
+            except BlockingIOError:
+                pass
+        wall = time.perf_counter() - start
+    result = {"probes": probes, "replies_ready": replies, "packets_per_sec": round(probes / wall, 1)}
+    print(f"  simulated network alone: {result['packets_per_sec']} pps ({replies} replies ready without waiting)")
+    return result
+
+def run_loopback(probes: int, simulation: str) -> dict:
+    """Drives a pipelined Ping against SimulatedNetwork and measures throughput and cost per probe."""
+    _run_ping(min(probes, 1000), simulation)  # Warm-up
+
+    blocks_before = sys.getallocatedblocks()
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    statistics = _run_ping(probes, simulation)
+    wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+    blocks_after = sys.getallocatedblocks()
+
+    # tracemalloc slows everything down, so memory is measured in a separate run
+    traced_probes = min(probes, 5000)
+    tracemalloc.start()
+    _run_ping(traced_probes, simulation)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    summary = statistics.get_summary()
+    result = {
+        "probes": probes,
+        "replies": summary["received"],
+        "packets_per_sec": round(probes / wall, 1),
+        "wall_seconds": round(wall, 4),
+        "cpu_us_per_probe": round(cpu / probes * 1e6, 3),
+        "retained_blocks_per_probe": round((blocks_after - blocks_before) / probes, 3),
+        "peak_traced_bytes_per_probe": round(peak / traced_probes, 1),
+    }
+    print(f"  {probes} probes, {result['replies']} replies in {result['wall_seconds']} s: "
+          f"{result['packets_per_sec']} pps, {result['cpu_us_per_probe']} us CPU/probe, "
+          f"{result['retained_blocks_per_probe']} blocks retained/probe, "
+          f"{result['peak_traced_bytes_per_probe']} B peak/probe")
+
+    # Timing every stage slows the run down, so it gets a run of its own too
+    profiler = StageProfiler()
+    _run_ping(traced_probes, simulation, profiler)
+    result["profile"] = profiler.get_summary()
+    print("  " + profiler.get_report().replace("\n", "\n  "))
+    return result
+
+def compare(results: dict, baseline: dict):
+    """Prints the change of every benchmark against `baseline` (negative is faster)."""
+    print("\n--- comparison with baseline ---")
+    previous = {(r["name"], r["payload_size"]): r for r in baseline.get("microbenchmarks", [])}
+    for result in results["microbenchmarks"]:
+        old = previous.get((result["name"], result["payload_size"]))
+        if old is None:
+            continue
+        change = (result["ns_per_op_best"] / old["ns_per_op_best"] - 1) * 100
+        print(f"  {result['name']:<28} {result['payload_size']:>6} B  {old['ns_per_op_best']:>10.1f} -> "
+              f"{result['ns_per_op_best']:>10.1f} ns/op ({change:+.1f}%)")
+    old, new = baseline.get("loopback"), results.get("loopback")
+    if old and new:
+        change = (new["packets_per_sec"] / old["packets_per_sec"] - 1) * 100
+        print(f"  loopback packets/sec {old['packets_per_sec']} -> {new['packets_per_sec']} ({change:+.1f}%)")
+        print(f"  loopback CPU/probe   {old['cpu_us_per_probe']} -> {new['cpu_us_per_probe']} us")
+
+def create_parser():
+    parser = argparse.ArgumentParser(description="Benchmarks for the ICMP packet pipeline.")
+    parser.add_argument(
+        "--quick", action="store_true", help="Only the default payload size, fewer repetitions and probes."
+    )
+    parser.add_argument(
+        "--probes", type=int, default=None, help="Probes sent by the loopback harness (default: 20000)."
+    )
+    parser.add_argument(
+        "--simulate", type=str, default="", metavar="SPEC",
+        help="Simulated network of the loopback harness, as for ping.py --simulate (default: instant replies)."
+    )
+    parser.add_argument(
+        "--output", type=str, default=None, help="Save the results to this JSON file."
+    )
+    parser.add_argument(
+        "--compare", type=str, default=None, help="Compare with the results saved in this JSON file."
+    )
+    return parser
+
+if __name__ == "__main__":
+    args = create_parser().parse_args(sys.argv[1:])
+    sizes = PAYLOAD_SIZES[:1] if args.quick else PAYLOAD_SIZES
+    probes = args.probes or (2000 if args.quick else 20000)
+
+    results = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "header_bytes": ICMP_HEADER_SIZE + TIMESTAMP_SIZE,
+    }
+    print("Microbenchmarks (per operation):")
+    results["microbenchmarks"] = run_microbenchmarks(sizes, 3 if args.quick else REPEAT)
+    print(f"\nLoopback harness (pipelined Ping against {SimulatedNetwork.from_spec(args.simulate)}):")
+    results["simulation"] = args.simulate
+    results["network"] = run_network(probes, args.simulate)
+    results["loopback"] = run_loopback(probes, args.simulate)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults saved to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
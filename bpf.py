@@ -0,0 +1,134 @@
+# ############################################################################################################ #
+# Classic BPF socket filter for the raw ICMP socket (SO_ATTACH_FILTER).                                        #
+# The kernel only hands us echo replies carrying one of our identifiers, and destination-unreachable /         #
+# time-exceeded errors that quote one of our echo requests. Everything else other processes receive never      #
+# reaches user space.                                                                                          #
+# ############################################################################################################ #
+
+import ctypes
+import socket
+import struct
+import sys
+from constants import ICMPType
+
+SO_ATTACH_FILTER = getattr(socket, "SO_ATTACH_FILTER", 26 if sys.platform.startswith("linux") else None)
+SNMP_PATH = "/proc/net/snmp"
+
+# Instruction classes and modes (linux/filter.h)
+BPF_LD, BPF_LDX, BPF_ALU, BPF_JMP, BPF_RET, BPF_MISC = 0x00, 0x01, 0x04, 0x05, 0x06, 0x07
+BPF_W, BPF_H, BPF_B = 0x00, 0x08, 0x10
+BPF_ABS, BPF_IND, BPF_MSH = 0x20, 0x40, 0xA0
+BPF_AND, BPF_LSH, BPF_ADD = 0x50, 0x60, 0x00
+BPF_JA, BPF_JEQ, BPF_JGT, BPF_JGE = 0x00, 0x10, 0x20, 0x30
+BPF_K, BPF_X = 0x00, 0x08
+BPF_TAX = 0x00
+
+INSTRUCTION = struct.Struct("=HBBI")
+ACCEPT_LENGTH = 0xFFFF
+ACCEPT, REJECT = "accept", "reject"
+
+def _identifier_ranges(identifiers) -> list:
+    """Collapses identifiers into sorted, inclusive (low, high) ranges."""
+    ranges = []
+    for identifier in sorted(set(identifiers)):
+        if ranges and identifier == ranges[-1][1] + 1:
+            ranges[-1] = (ranges[-1][0], identifier)
+        else:
+            ranges.append((identifier, identifier))
+    return ranges
+
+def _match_identifier(ranges: list) -> list:
+    # Expects the identifier in A; jumps to ACCEPT on a match and to REJECT otherwise
+    program = []
+    for low, high in ranges:
+        if low == high:
+            program.append((BPF_JMP | BPF_JEQ | BPF_K, ACCEPT, 0, low))
+        else:
+            program.append((BPF_JMP | BPF_JGE | BPF_K, 0, 1, low))
+            program.append((BPF_JMP | BPF_JGT | BPF_K, 0, ACCEPT, high))
+    program.append((BPF_JMP | BPF_JA, 0, 0, REJECT))
+    return program
+
+def build_filter(identifiers) -> list:
+    """Returns the filter for `identifiers` as a list of (code, jt, jf, k) instructions."""
+    ranges = _identifier_ranges(identifiers)
+    echo = _match_identifier(ranges)
+    quoted = _match_identifier(ranges)
+    head = [
+        (BPF_LDX | BPF_B | BPF_MSH, 0, 0, 0),                                # X = IP header length
+        (BPF_LD | BPF_B | BPF_IND, 0, 0, 0),                                 # A = ICMP type
+        (BPF_JMP | BPF_JEQ | BPF_K, 0, 1, ICMPType.ECHO_REPLY),
+        (BPF_JMP | BPF_JA, 0, 0, "echo"),
+        (BPF_JMP | BPF_JEQ | BPF_K, "error", 0, ICMPType.DESTINATION_UNREACHABLE),
+        (BPF_JMP | BPF_JEQ | BPF_K, "error", REJECT, ICMPType.TIME_EXCEEDED),
+    ]
+    echo_block = [(BPF_LD | BPF_H | BPF_IND, 0, 0, 4)] + echo                # A = identifier
+    error_block = [
+        (BPF_LD | BPF_B | BPF_IND, 0, 0, 8 + 9),                             # A = quoted IP protocol
+        (BPF_JMP | BPF_JEQ | BPF_K, 0, REJECT, socket.IPPROTO_ICMP),
+        (BPF_LD | BPF_B | BPF_IND, 0, 0, 8),                                 # A = quoted version/IHL
+        (BPF_ALU | BPF_AND | BPF_K, 0, 0, 0x0F),
+        (BPF_ALU | BPF_LSH | BPF_K, 0, 0, 2),
+        (BPF_ALU | BPF_ADD | BPF_X, 0, 0, 0),
+        (BPF_MISC | BPF_TAX, 0, 0, 0),                                       # X = outer + quoted IP header
+        (BPF_LD | BPF_B | BPF_IND, 0, 0, 8),                                 # A = quoted ICMP type
+        (BPF_JMP | BPF_JEQ | BPF_K, 0, REJECT, ICMPType.ECHO_REQUEST),
+        (BPF_LD | BPF_H | BPF_IND, 0, 0, 8 + 4),                             # A = quoted identifier
+    ] + quoted
+    tail = [
+        (BPF_RET | BPF_K, 0, 0, 0),                                          # REJECT
+        (BPF_RET | BPF_K, 0, 0, ACCEPT_LENGTH),                              # ACCEPT
+    ]
+
+    program = head + echo_block + error_block + tail
+    labels = {
+        "echo": len(head),
+        "error": len(head) + len(echo_block),
+        REJECT: len(program) - 2,
+        ACCEPT: len(program) - 1,
+    }
+    return _resolve_labels(program, labels)
+
+def _resolve_labels(program: list, labels: dict) -> list:
+    # Conditional jumps are relative to the next instruction and limited to 255; BPF_JA takes a 32-bit k
+    resolved = []
+    for index, (code, jt, jf, k) in enumerate(program):
+        if isinstance(jt, str):
+            jt = labels[jt] - index - 1
+        if isinstance(jf, str):
+            jf = labels[jf] - index - 1
+        if isinstance(k, str):
+            k = labels[k] - index - 1
+        if not (0 <= jt <= 255 and 0 <= jf <= 255):
+            raise ValueError("Too many identifier ranges for a classic BPF filter.")
+        resolved.append((code, jt, jf, k))
+    return resolved
+
+def attach_filter(sock: socket.socket, identifiers) -> bool:
+    """Attaches the filter for `identifiers` to `sock`. Returns False when the platform has no socket filters."""
+    if SO_ATTACH_FILTER is None:
+        return False
+    program = build_filter(identifiers)
+    instructions = ctypes.create_string_buffer(b"".join(INSTRUCTION.pack(*instruction) for instruction in program))
+    # struct sock_fprog { unsigned short len; struct sock_filter *filter; }, copied by the kernel
+    fprog = struct.pack("HP", len(program), ctypes.addressof(instructions))
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+    except OSError:
+        return False
+    return True
+
+def read_icmp_in_messages() -> int:
+    """Returns the host-wide count of received ICMP messages (Icmp InMsgs), or None when unavailable.
+
+    Every ICMP message the host receives is delivered to every raw ICMP socket, so the growth of this
+    counter minus what our socket returned is what the filter kept out of user space.
+    """
+    try:
+        with open(SNMP_PATH) as f:
+            lines = [line.split() for line in f if line.startswith("Icmp:")]
+    except OSError:
+        return None
+    if len(lines) < 2 or "InMsgs" not in lines[0]:
+        return None
+    return int(lines[1][lines[0].index("InMsgs")])
@@ -0,0 +1,33 @@
+# ############################################################################################################ #
+# Internet checksum (RFC 1071) helpers.                                                                        #
+# Sums are computed a 16-bit word at a time with array('H') instead of byte by byte, and partial sums can be   #
+# combined so constant parts of a packet only have to be summed once (RFC 1624).                               #
+# ############################################################################################################ #
+
+import sys
+from array import array
+
+def fold(total: int) -> int:
+    """Folds the carries of an unbounded one's complement sum back into 16 bits."""
+    while total >> 16:
+        total = (total & 0xFFFF) + (total >> 16)
+    return total
+
+def ones_complement_sum(data: bytes) -> int:
+    """Returns the folded one's complement sum of `data` taken as big-endian 16-bit words."""
+    if len(data) % 2:
+        data = bytes(data) + b"\x00"
+    total = fold(sum(array("H", data)))
+    # The one's complement sum is byte order independent (RFC 1071 section 2(B)):
+    # summing native words and swapping the result equals summing network words.
+    if sys.byteorder == "little":
+        total = ((total & 0xFF) << 8) | (total >> 8)
+    return total
+
+def internet_checksum(data: bytes) -> int:
+    """Returns the checksum of `data` as a host integer, ready to be packed with "!H"."""
+    return ~ones_complement_sum(data) & 0xFFFF
+
+def update_checksum(checksum: int, oldWord: int, newWord: int) -> int:
+    """Incrementally updates `checksum` after one 16-bit word changed: HC' = ~(~HC + ~m + m') (RFC 1624 eqn. 3)."""
+    return ~fold((~checksum & 0xFFFF) + (~oldWord & 0xFFFF) + newWord) & 0xFFFF
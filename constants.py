@@ -9,9 +9,38 @@ RAW_DATA = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuv"
 IP_HEADER_SIZE = 20
 ICMP_HEADER_SIZE = 8
 TIMESTAMP_SIZE = 8
+DEFAULT_DATA_SIZE = TIMESTAMP_SIZE + len(RAW_DATA)  # ICMP data bytes of a probe: timestamp + payload
+MAX_DATA_SIZE = 65535 - IP_HEADER_SIZE - ICMP_HEADER_SIZE  # Largest ICMP data that fits in an IPv4 datagram
+MAX_PATTERN_SIZE = 16     # Bytes of a -p fill pattern
 TTL = 64
 TIMEOUT = 30
+RTO_INITIAL = 1.0   # Adaptive timeout before the first RTT sample (RFC 6298), in seconds
+RTO_MIN = 0.2       # Default floor of the adaptive timeout, in seconds
+RTO_MAX = TIMEOUT   # Default ceiling of the adaptive timeout, in seconds
 DEFAULT_COUNT = 4
+TRACEROUTE_MAX_HOPS = 30  # Highest TTL probed in traceroute mode
+TRACEROUTE_PROBES = 3     # Probes sent with each TTL
+TRACEROUTE_TIMEOUT = 3    # Seconds to wait for a hop to answer, in traceroute mode
+DNS_TTL = 300          # Seconds a resolved address is used before it is refreshed in the background
+DNS_CACHE_SIZE = 65536 # Resolved hosts kept in the LRU cache
+DNS_WORKERS = 32       # Concurrent lookups when resolving many hosts
+DAEMON_PORT = 9427           # Port of the daemon's /metrics endpoint
+DAEMON_SLOT = 10             # Seconds of probes summarized by one rolling-window slot
+DAEMON_WINDOWS = (60, 300, 900)  # Rolling windows reported by the daemon, in seconds
+OUTPUT_BUFFER_SIZE = 65536   # Bytes of machine-readable records buffered before they are written
+OUTPUT_FLUSH_INTERVAL = 1.0  # Seconds a buffered record may wait before it is written
+PROBE_LOG_SEGMENT_RECORDS = 1 << 22  # Records per probe log segment file (96 MiB)
+PROBE_LOG_CHUNK_RECORDS = 1 << 20    # Records aggregated at a time when a probe log is replayed
+PACING_SLACK = 0.05          # Seconds a paced sender may fall behind and still catch up in a burst
+FLOOD_INTERVAL = 0.01        # Flood mode sends at least this often while a probe is unanswered
+DEFAULT_BATCH = 1            # Probes per sendmmsg/recvmmsg call; 1 sends and receives one at a time
+MAX_BATCH = 1024             # Most messages one sendmmsg/recvmmsg call accepts (UIO_MAXIOV)
+PMTU_MIN = 68           # Smallest IPv4 MTU (RFC 791); every path carries it
+PMTU_MAX = 65535        # Largest IPv4 datagram
+PMTU_SIZES = 8          # Datagram sizes probed at once in each round of a path MTU search
+PMTU_PROBES = 2         # Probes of each size, so one lost probe is not taken for a size that does not fit
+PMTU_TIMEOUT = 2        # Seconds to wait for each probe in path MTU discovery
+PMTU_GUESSES = (1500,)  # Common MTUs checked in the first round (with one byte more), to finish early
 LOCALHOST = "127.0.0.1"
 
 class ICMPType(IntEnum):
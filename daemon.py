@@ -0,0 +1,234 @@
+# ############################################################################################################ #
+# PingDaemon probes a set of targets forever and serves their statistics on a local HTTP /metrics endpoint in   #
+# the Prometheus text format. Each target keeps RollingStatistics (last 1/5/15 minutes plus lifetime totals).  #
+# On SIGHUP the targets file is read again: new targets are added, removed ones dropped, and every target that #
+# stays keeps its statistics and sequence numbers. The socket stays open throughout.                           #
+# ############################################################################################################ #
+
+import asyncio
+import os
+import signal
+import time
+from probe_session import ProbeSession
+from rolling_statistics import RollingStatistics
+from multi_ping import read_targets_file
+from resolver import get_default_resolver
+from transport import DEFAULT_TRANSPORT
+from probe_output import DEFAULT_OUTPUT
+from packet_template import DEFAULT_PATTERN
+from prometheus import CONTENT_TYPE, render_metrics
+from constants import TIMEOUT, RTO_MIN, RTO_MAX, DAEMON_PORT, DEFAULT_BATCH
+
+IDLE_WAIT = 1.0  # Seconds to sleep while there is nothing to probe
+
+class PingDaemon:
+    def __init__(self, targets: list = (), targetsFile: str = None, wait: float = 1, listen: str = "127.0.0.1",
+                 port: int = DAEMON_PORT, debug: bool = False, timeout: float = TIMEOUT,
+                 kernel_timestamps: bool = False, adaptive_timeout: bool = False, min_timeout: float = RTO_MIN,
+                 max_timeout: float = RTO_MAX, identifier: int = None, socket_filter: bool = True,
+                 transport=DEFAULT_TRANSPORT, output=DEFAULT_OUTPUT, payload: bytes = DEFAULT_PATTERN, profiler=None,
+                 batch_size: int = DEFAULT_BATCH):
+        self.__fixedTargets: list = list(targets)             # Hosts given on the command line, never reloaded
+        self.__targetsFile: str = targetsFile                 # Read again on SIGHUP
+        self.__wait: float = wait                             # Seconds between two probes to the same target
+        self.__listen: str = listen                           # Address of the /metrics endpoint
+        self.__port: int = port                               # Port of the /metrics endpoint
+        self.__debug: bool = debug                            # Debug flag
+        self.__timeout: float = timeout                       # Seconds before a probe is declared lost
+        self.__kernelTimestamps: bool = kernel_timestamps     # Take receive times from SO_TIMESTAMPNS
+        self.__adaptiveTimeout: bool = adaptive_timeout       # Per-target RFC 6298 timeouts
+        self.__minTimeout: float = min_timeout                # Floor of the adaptive timeout
+        self.__maxTimeout: float = max_timeout                # Ceiling of the adaptive timeout
+        self.__identifier: int = identifier                   # ICMP identifier, defaults to the process id
+        self.__socketFilter: bool = socket_filter             # Attach a BPF filter for our identifier
+        self.__transport = transport                          # Opens the socket (raw, datagram or simulated)
+        self.__output = output                                # Reports every probe and messages
+        self.__payload: bytes = payload                       # Echo request data after the timestamp
+        self.__profiler = profiler                            # StageProfiler served on /metrics, None when off
+        self.__batchSize: int = batch_size                    # Most probes handed to one sendmmsg call
+        self.__targets: list = []                             # (host, address) probed round-robin
+        self.__statistics: dict = {}                          # Host name -> RollingStatistics
+        self.__sequenceNumbers: dict = {}                     # Host name -> next sequence number
+        self.__reloads: int = 0                               # Target sets applied after the first
+        self.__server = None                                  # asyncio server of the /metrics endpoint
+        self.__session = None                                 # ProbeSession, while run() is probing
+        self.__running: bool = True                           # Cleared by stop()
+        self.__wakeup = None                                  # asyncio.Event that interrupts the sender's sleep
+
+    # ############################################################
+    # Getters                                                    #
+    # ############################################################
+    def get_statistics(self) -> dict:
+        return self.__statistics
+
+    def get_port(self) -> int:
+        """Returns the port /metrics is served on; the actual one when the daemon was started with port 0."""
+        if self.__server is None:
+            return self.__port
+        return self.__server.sockets[0].getsockname()[1]
+
+    def get_metrics(self) -> str:
+        now = time.monotonic()
+        return render_metrics(self.__statistics, now, [
+            ("ping_targets", "gauge", "Targets currently probed.", len(self.__targets)),
+            ("ping_target_reloads_total", "counter", "Target sets applied on SIGHUP.", self.__reloads),
+        ], self.__profiler)
+
+    # ############################################################
+    # Public Functions                                           #
+    # ############################################################
+    def stop(self):
+        self.__running = False
+        if self.__wakeup is not None:
+            self.__wakeup.set()
+
+    def reload(self):
+        """Schedules the targets file to be read again; state is kept for every target that stays."""
+        asyncio.get_running_loop().create_task(self.__apply_targets(reload=True))
+
+    async def run(self):
+        """Starts the /metrics endpoint and probes the targets until stop() is called (SIGINT or SIGTERM)."""
+        loop = asyncio.get_running_loop()
+        self.__wakeup = asyncio.Event()
+        await self.__apply_targets()
+        self.__server = await asyncio.start_server(self.__serve, self.__listen, self.__port)
+        self.__output.message(f"Serving metrics on http://{self.__listen}:{self.get_port()}/metrics")
+        identifier = self.__identifier if self.__identifier is not None else os.getpid() & 0xFFFF
+        resolver = get_default_resolver()
+
+        with ProbeSession(identifier, self.__timeout, debug=self.__debug, kernelTimestamps=self.__kernelTimestamps,
+                          adaptiveTimeout=self.__adaptiveTimeout, minTimeout=self.__minTimeout,
+                          maxTimeout=self.__maxTimeout, socketFilter=self.__socketFilter,
+                          transport=self.__transport, output=self.__output, payload=self.__payload,
+                          profiler=self.__profiler, batchSize=self.__batchSize) as session:
+            self.__session = session
+            loop.add_reader(session.fileno(), session.receive_pending)
+            loop.add_signal_handler(signal.SIGINT, self.stop)
+            loop.add_signal_handler(signal.SIGTERM, self.stop)
+            loop.add_signal_handler(signal.SIGHUP, self.reload)
+            try:
+                index = 0
+                next_send = time.monotonic()
+                while self.__running:
+                    now = time.monotonic()
+                    if self.__targets and now >= next_send:
+                        # Every probe already due goes out together, up to one batch
+                        probes = []
+                        while len(probes) < self.__batchSize and now >= next_send:
+                            index %= len(self.__targets)
+                            host, target_ip = self.__targets[index]
+                            # Never blocks: a stale address is refreshed in the background
+                            target_ip = resolver.get_cached(host) or target_ip
+                            # Each outcome is recorded in the slot where the probe settles
+                            probes.append((target_ip, self.__sequenceNumbers[host], self.__statistics[host]))
+                            self.__sequenceNumbers[host] += 1
+                            index += 1
+                            # Probes to different targets are spread evenly over one interval
+                            next_send += self.__wait / len(self.__targets)
+                        session.send_probes(probes)
+                        if next_send <= now:
+                            # Behind schedule: still expire probes, and let replies and scrapes through
+                            session.expire_probes(now)
+                            self.__output.flush_if_due(now)
+                            await asyncio.sleep(0)
+                        continue
+
+                    session.expire_probes(now)
+                    self.__output.flush_if_due(now)
+                    wake_times = [next_send if self.__targets else now + IDLE_WAIT]
+                    next_deadline = session.next_deadline()
+                    if next_deadline is not None:
+                        wake_times.append(next_deadline)
+                    next_flush = self.__output.next_flush()
+                    if next_flush is not None:
+                        wake_times.append(next_flush)
+                    await self.__sleep_until(min(wake_times))
+                    if next_send < time.monotonic() - self.__wait:
+                        next_send = time.monotonic()  # Do not burst to catch up after a pause, e.g. with no targets
+            finally:
+                for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP):
+                    loop.remove_signal_handler(signum)
+                loop.remove_reader(session.fileno())
+                session.abandon_probes()
+                self.__session = None
+                self.__server.close()
+                await self.__server.wait_closed()
+                self.__output.close()
+
+    # ############################################################
+    # Private Functions                                          #
+    # ############################################################
+    async def __apply_targets(self, reload: bool = False):
+        hosts = list(self.__fixedTargets)
+        if self.__targetsFile is not None:
+            try:
+                hosts += read_targets_file(self.__targetsFile)
+            except OSError as e:
+                self.__output.message(f" [ping] Cannot read {self.__targetsFile}: {e}. Keeping the current targets.")
+                return
+        hosts = list(dict.fromkeys(hosts))
+
+        addresses_by_host = await get_default_resolver().resolve_many_async(hosts)
+        targets = []
+        addresses = set()
+        for host in hosts:
+            target_ip = addresses_by_host[host]
+            if target_ip is None:
+                self.__output.message(f" [ping] Unknown host {host}. Skipping...")
+                continue
+            # Replies are matched on their source address, so each address may only be probed once
+            if target_ip in addresses:
+                self.__output.message(f" [ping] {host} ({target_ip}) is already a target. Skipping...")
+                continue
+            addresses.add(target_ip)
+            targets.append((host, target_ip))
+
+        kept = {host for host, _ in targets}
+        for host in list(self.__statistics):
+            if host not in kept:
+                del self.__statistics[host]
+                del self.__sequenceNumbers[host]
+        if self.__session is not None:
+            # The session keeps per-address state of its own; drop it for every address no longer probed
+            resolver = get_default_resolver()
+            probed = {address for host, address in targets} | {resolver.get_cached(host) for host, _ in targets}
+            for host, address in self.__targets:
+                for dropped in {address, resolver.get_cached(host)} - probed:
+                    if dropped is not None:
+                        self.__session.forget_target(dropped)
+        for host, _ in targets:
+            if host not in self.__statistics:
+                self.__statistics[host] = RollingStatistics()
+                self.__sequenceNumbers[host] = 0
+        self.__targets = targets
+        if reload:
+            self.__reloads += 1
+            self.__output.message(f" [ping] Reloaded targets: {len(targets)} targets.")
+            self.__wakeup.set()
+
+    async def __serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), IDLE_WAIT * 10)
+            while (await asyncio.wait_for(reader.readline(), IDLE_WAIT * 10)) not in (b"\r\n", b"\n", b""):
+                pass  # Headers are not needed
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] in ("GET", "HEAD") and parts[1].split("?")[0] == "/metrics":
+                status, content_type, body = "200 OK", CONTENT_TYPE, self.get_metrics().encode()
+            else:
+                status, content_type, body = "404 Not Found", "text/plain; charset=utf-8", b"Not Found\n"
+            writer.write(f"HTTP/1.0 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+                         f"Connection: close\r\n\r\n".encode())
+            if not parts or parts[0] != "HEAD":
+                writer.write(body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def __sleep_until(self, deadline: float):
+        try:
+            await asyncio.wait_for(self.__wakeup.wait(), max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            pass
+        self.__wakeup.clear()
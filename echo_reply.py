@@ -1,14 +1,22 @@
 # ############################################################################################################ #
-# EchoReply unpacks the received packet and prints the result to the console.                                  #
+# EchoReply unpacks the received packet and reports the result.                                                #
 # ############################################################################################################ #
 
 import struct
 from statistics import Statistics
-from constants import IP_HEADER_SIZE, ICMP_HEADER_SIZE, TIMESTAMP_SIZE
+from probe_output import DEFAULT_OUTPUT
+from packet_template import describe_payload_mismatch
+from stage_profiler import OUTPUT, STATS
+from constants import ICMP_HEADER_SIZE, TIMESTAMP_SIZE
+
+UNSIGNED_CHAR = struct.Struct("!B")
+UNSIGNED_SHORT = struct.Struct("!H")
+DOUBLE = struct.Struct("!d")
 
 class EchoReply:
     def __init__(self, recvPacket: bytes, statistics: Statistics, debug: bool = False):
         self.__recvPacket: bytes = recvPacket
+        self.__ipHeaderSize: int = (recvPacket[0] & 0x0F) * 4  # IHL, options make it longer than 20 bytes
         self.__statistics: Statistics = statistics
         self.__isValidResponse: bool = False
         self.__IcmpIdentifier_isValid: bool = True
@@ -20,28 +28,29 @@ class EchoReply:
     # Getters　　　　　　　　　                                                                                       #
     # ############################################################################################################ #
     def get_icmp_type(self) -> int:
-        return self.__unpack_by_format_and_position("B", IP_HEADER_SIZE)
+        return self.__unpack_by_format_and_position(UNSIGNED_CHAR, self.__ipHeaderSize)
 
     def get_icmp_code(self) -> int:
-        return self.__unpack_by_format_and_position("B", IP_HEADER_SIZE + 1)
+        return self.__unpack_by_format_and_position(UNSIGNED_CHAR, self.__ipHeaderSize + 1)
 
     def get_icmp_header_checksum(self) -> int:
-        return self.__unpack_by_format_and_position("H", IP_HEADER_SIZE + 2)
+        return self.__unpack_by_format_and_position(UNSIGNED_SHORT, self.__ipHeaderSize + 2)
 
     def get_icmp_identifier(self) -> int:
-        return self.__unpack_by_format_and_position("H", IP_HEADER_SIZE + 4)
+        return self.__unpack_by_format_and_position(UNSIGNED_SHORT, self.__ipHeaderSize + 4)
 
     def get_icmp_sequence_number(self) -> int:
-        return self.__unpack_by_format_and_position("H", IP_HEADER_SIZE + 6)
+        return self.__unpack_by_format_and_position(UNSIGNED_SHORT, self.__ipHeaderSize + 6)
 
     def get_datetime_sent(self) -> float:
-        start = IP_HEADER_SIZE + ICMP_HEADER_SIZE
-        end = start + TIMESTAMP_SIZE
-        return struct.unpack("!d", self.__recvPacket[start:end])[0]
+        return self.__unpack_by_format_and_position(DOUBLE, self.__ipHeaderSize + ICMP_HEADER_SIZE)
+
+    def get_icmp_data_bytes(self) -> bytes:
+        start = self.__ipHeaderSize + ICMP_HEADER_SIZE + TIMESTAMP_SIZE
+        return self.__recvPacket[start:]
 
     def get_icmp_data(self) -> str:
-        start = IP_HEADER_SIZE + ICMP_HEADER_SIZE + TIMESTAMP_SIZE
-        return self.__recvPacket[start:].decode("utf-8")
+        return self.get_icmp_data_bytes().decode("utf-8", errors="replace")
 
     def is_valid_response(self) -> bool:
         return self.__isValidResponse
@@ -73,48 +82,45 @@ class EchoReply:
     # ############################################################################################################ #
     # Private Functions　　　　　　　　　                                                                             #
     # ############################################################################################################ #
-    def __unpack_by_format_and_position(self, formatCode: str, basePosition: int) -> int:
-        number_of_bytes = struct.calcsize(formatCode)
-        return struct.unpack(
-            "!" + formatCode,
-            self.__recvPacket[basePosition: basePosition + number_of_bytes]
-        )[0]
+    def __unpack_by_format_and_position(self, format: struct.Struct, basePosition: int) -> int:
+        return format.unpack_from(self.__recvPacket, basePosition)[0]
 
     # ############################################################################################################ #
     # Public Functions    　　　　　　　　　                                                                          #
     # ############################################################################################################ #
-    def print_result_to_console(self, ttl: int, time_received: float, addr: tuple, original_packet: 'IcmpPacket'):
-        time_sent = self.get_datetime_sent()
-        rtt = (time_received - time_sent) * 1000
-
-        print(f"{len(self.__recvPacket[IP_HEADER_SIZE:])} bytes from {addr[0]}: icmp_seq={self.get_icmp_sequence_number()} ttl={self.__recvPacket[8]} time={rtt:.3f} ms")
+    def print_result_to_console(self, ttl: int, rtt: float, addr: tuple, original_packet: 'IcmpPacket',
+                                output=DEFAULT_OUTPUT):
+        # rtt is measured by the caller on the monotonic clock; the wall-clock timestamp
+        # echoed in the payload (get_datetime_sent) would be corrupted by clock steps.
+        output.reply(original_packet.get_destination_ip_address(), addr[0], self.get_icmp_sequence_number(),
+                     len(self.__recvPacket) - self.__ipHeaderSize, self.__recvPacket[8], rtt,
+                     self.get_icmp_raw_data_is_valid(), original_packet.get_sent_at())
 
         # Validate Identifier
         if not self.get_icmp_identifier_is_valid():
-            print(
-                "ICMP Identifier invalid. Received: ",
-                self.get_icmp_identifier(),
-                "BUT - expected ",
-                original_packet.get_packet_identifier(),
+            output.message(
+                f"ICMP Identifier invalid. Received:  {self.get_icmp_identifier()} "
+                f"BUT - expected  {original_packet.get_packet_identifier()}"
             )
 
         # Validate Sequence Number
         if not self.get_icmp_sequence_number_is_valid():
-            print(
-                "ICMP Sequence Number invalid. Received: ",
-                self.get_icmp_sequence_number(),
-                "BUT - expected ",
-                original_packet.get_packet_sequence_number(),
+            output.message(
+                f"ICMP Sequence Number invalid. Received:  {self.get_icmp_sequence_number()} "
+                f"BUT - expected  {original_packet.get_packet_sequence_number()}"
             )
 
         # Validate Raw Data
         if not self.get_icmp_raw_data_is_valid():
-            print(
-                "ICMP Raw Data invalid. Received: ",
-                self.get_icmp_data(),
-                "BUT - expected ",
-                original_packet.get_data_raw(),
+            output.message(
+                f"ICMP Raw Data invalid. "
+                f"{describe_payload_mismatch(self.get_icmp_data_bytes(), original_packet.get_data_raw())}"
             )
 
-        # Update RTT records
-        self.__statistics.update_rtt(rtt)
\ No newline at end of file
+        profiler = original_packet.get_profiler()
+        if profiler is not None:
+            profiler.lap(OUTPUT)
+        # Update RTT records (the only place a reply is counted)
+        self.__statistics.update_rtt(rtt)
+        if profiler is not None:
+            profiler.lap(STATS)
@@ -9,25 +9,38 @@ from socket import *
 import select
 from statistics import Statistics
 from echo_reply import EchoReply
+from checksum import internet_checksum
+from packet_template import EchoRequestTemplate, DEFAULT_PATTERN, describe_payload_mismatch
+from reply_decoder import ip_header_length, RECV_BUFFER_SIZE
+from transport import DEFAULT_TRANSPORT
+from probe_output import DEFAULT_OUTPUT
+from sequence_window import SequenceWindow, DUPLICATE
+from resolver import get_default_resolver
+from timing import CLOCK_SOURCE_KERNEL, enable_kernel_timestamps, receive_with_timestamp
+from stage_profiler import SOCKET, SENDTO, WAIT, RECV, PARSE, VALIDATE
 from constants import (
     ICMPType,
     ICMPCodeDestUnreach,
     ICMPCodeTimeExceeded,
     ICMP_MESSAGES,
-    RAW_DATA,
     TTL,
     TIMEOUT,
-    IP_HEADER_SIZE,
+    ICMP_HEADER_SIZE,
     LOCALHOST
 )
 
+def get_icmp_message(icmp_type: int, icmp_code: int) -> str:
+    """Retrieves the ICMP message based on type and code."""
+    key = (ICMPType(icmp_type), icmp_code) if icmp_code is not None else (ICMPType(icmp_type), None)
+    return ICMP_MESSAGES.get(key, "Unknown ICMP Type or Code")
+
 class IcmpPacket:
     def __init__(self, statistics: Statistics, debug: bool = False):
         self.__icmpTarget: str = ""                # Remote Host
         self.__destinationIpAddress: str = ""      # Remote Host IP Address
         self.__header: bytes = b""                 # Header after byte packing
         self.__data: bytes = b""                   # Data after encoding
-        self.__dataRaw: str = ""                   # Raw string data before encoding
+        self.__dataRaw: bytes = b""                # Payload after the timestamp
         self.__icmpType: int = 0                   # 0-255 (unsigned char)
         self.__icmpCode: int = 0                   # 0-255 (unsigned char)
         self.__packetChecksum: int = 0             # 0-65535 (unsigned short)
@@ -37,77 +50,171 @@ class IcmpPacket:
         self.__ttl: int = TTL                      # Time to live
         self.__statistics: Statistics = statistics # Statistics object
         self.__debug: bool = debug                 # Debug flag
+        self.__kernelTimestamps: bool = False      # Take receive times from SO_TIMESTAMPNS
+        self.__transport = DEFAULT_TRANSPORT       # Opens the socket of each request
+        self.__socketFilter: bool = True           # Attach a BPF filter for our identifier
+        self.__sequenceWindow = None               # Replies seen so far in the run, to spot duplicates and late ones
+        self.__output = DEFAULT_OUTPUT             # Reports the outcome (text, records or summary only)
+        self.__sentAt: int = None                  # Monotonic send time in ns
+        self.__profiler = None                     # StageProfiler, None when not profiling
+
+    # ############################################################
+    # Getters                                                    #
+    # ############################################################
+    def get_destination_ip_address(self) -> str:
+        return self.__destinationIpAddress
+
+    def get_packet_identifier(self) -> int:
+        return self.__packetIdentifier
+
+    def get_packet_sequence_number(self) -> int:
+        return self.__packetSequenceNumber
+
+    def get_data_raw(self) -> bytes:
+        return self.__dataRaw
+
+    def get_packet(self) -> bytes:
+        return self.__header + self.__data
+
+    def get_sent_at(self) -> int:
+        return self.__sentAt
+
+    def get_profiler(self):
+        return self.__profiler
 
     # ############################################################
     # Setter                                                     #
     # ############################################################
+    def set_ip_timeout(self, ipTimeout: float):
+        self.__ipTimeout = ipTimeout
+
+    def set_kernel_timestamps(self, booleanValue: bool):
+        self.__kernelTimestamps = booleanValue
+
+    def set_transport(self, transport):
+        self.__transport = transport
+
+    def set_socket_filter(self, booleanValue: bool):
+        self.__socketFilter = booleanValue
+
+    def set_sequence_window(self, sequenceWindow: SequenceWindow):
+        self.__sequenceWindow = sequenceWindow
+
+    def set_output(self, output):
+        self.__output = output
+
+    def set_profiler(self, profiler):
+        self.__profiler = profiler
+
     def set_icmp_target(self, icmpTarget: str):
         self.__icmpTarget = icmpTarget.strip()
         if self.__icmpTarget:
-            self.__destinationIpAddress = gethostbyname(self.__icmpTarget)
+            self.__destinationIpAddress = get_default_resolver().resolve(self.__icmpTarget)
         else:
             self.__destinationIpAddress = LOCALHOST
 
     # ############################################################
     # Public Functions                                           #
     # ############################################################
-    def build_echo_request_packet(self, packetIdentifier: int, packetSequenceNumber: int):
+    def build_echo_request_packet(self, packetIdentifier: int, packetSequenceNumber: int,
+                                  template: EchoRequestTemplate = None):
         self.__icmpType = ICMPType.ECHO_REQUEST
         self.__icmpCode = 0
         self.__packetIdentifier = packetIdentifier
         self.__packetSequenceNumber = packetSequenceNumber
-        self.__dataRaw = RAW_DATA
-        self.__pack_and_recalculate_checksum()
+        if template is not None and template.get_identifier() == packetIdentifier:
+            self.__dataRaw = template.get_payload()
+            # Only the sequence number and timestamp are folded into the precomputed checksum
+            packet = template.build(packetSequenceNumber, time.time())
+            self.__header = packet[:ICMP_HEADER_SIZE]
+            self.__data = packet[ICMP_HEADER_SIZE:]
+            self.__packetChecksum = struct.unpack_from("!H", self.__header, 2)[0]
+        else:
+            self.__dataRaw = DEFAULT_PATTERN
+            self.__pack_and_recalculate_checksum()
 
     def send_echo_request(self):
         self.__statistics.increment_packets_sent()
+        profiler = self.__profiler
+        if profiler is not None:
+            profiler.start()
 
         try:
-            # Create a new raw socket for each request
-            with socket(AF_INET, SOCK_RAW, IPPROTO_ICMP) as s:
-                s.settimeout(self.__ipTimeout)
-                s.bind(("", 0)) # Bind to any available interface
-                s.setsockopt(IPPROTO_IP, IP_TTL, struct.pack("I", self.__ttl))
-
-                s.sendto(self.__header + self.__data, (self.__destinationIpAddress, 0)) # ICMP doesn't use port numbers
-                ping_start_time = time.time()
-
-                # Wait for the response
-                ready = select.select([s], [], [], self.__ipTimeout)
-                if not ready[0]:  # Timeout
-                    self.__statistics.increment_packet_errors()
-                    print("  *        *        *        *        *    Request timed out.")
-                    return
-
-                recv_packet, addr = s.recvfrom(1024)
-                time_received = time.time()
-
-                rtt = (time_received - ping_start_time) * 1000
-                self.__statistics.update_rtt(rtt)
-
-                icmp_type = recv_packet[IP_HEADER_SIZE]
-                icmp_code = recv_packet[IP_HEADER_SIZE + 1]
-
-                if icmp_type == ICMPType.ECHO_REPLY:
-                    echo_reply = EchoReply(recv_packet, self.__statistics, self.__debug)
-                    self.__validate_reply(echo_reply)
-                    echo_reply.print_result_to_console(self.__ttl, time_received, addr, self)
-                elif icmp_type in [ICMPType.DESTINATION_UNREACHABLE, ICMPType.TIME_EXCEEDED]:
-                    self.__statistics.increment_packet_errors()
-                    message = self.__get_icmp_message(icmp_type, icmp_code)
-                    print(f"From {addr[0]}: icmp_type={icmp_type} icmp_code={icmp_code} - {message}")
-                else:
-                    print("  Unknown ICMP Type received.")
+            # Create a new socket for each request
+            with self.__transport.open(self.__ttl, self.__ipTimeout, self.__packetIdentifier) as s:
+                if self.__socketFilter:
+                    self.__transport.attach_filter(s, [self.__packetIdentifier])
+                kernel_timestamps = self.__kernelTimestamps and enable_kernel_timestamps(s)
+                if kernel_timestamps:
+                    self.__statistics.set_clock_source(CLOCK_SOURCE_KERNEL)
+                if profiler is not None:
+                    profiler.lap(SOCKET)
+
+                ping_start_time = self.__sentAt = time.monotonic_ns()
+                s.sendto(self.get_packet(), (self.__destinationIpAddress, 0)) # ICMP doesn't use port numbers
+                if profiler is not None:
+                    profiler.lap(SENDTO)
+
+                # Wait for the response. Our own request is also delivered to the raw socket
+                # when pinging a local address; it is not a reply, so keep waiting for one.
+                deadline = time.monotonic() + self.__ipTimeout
+                while True:
+                    ready = select.select([s], [], [], max(0.0, deadline - time.monotonic()))
+                    if profiler is not None:
+                        profiler.lap(WAIT)
+                    if not ready[0]:  # Timeout
+                        self.__statistics.increment_packet_errors()
+                        self.__output.timeout(self.__destinationIpAddress, self.__packetSequenceNumber, self.__sentAt)
+                        return
+
+                    if kernel_timestamps:
+                        recv_packet, addr, time_received = receive_with_timestamp(s, RECV_BUFFER_SIZE)
+                    else:
+                        recv_packet, addr = s.recvfrom(RECV_BUFFER_SIZE)
+                        time_received = time.monotonic_ns()
+                    if profiler is not None:
+                        profiler.lap(RECV)
+                    icmp_offset = ip_header_length(recv_packet)
+                    if recv_packet[icmp_offset] == ICMPType.ECHO_REQUEST:
+                        continue
+                    if recv_packet[icmp_offset] != ICMPType.ECHO_REPLY or self.__is_reply_to_this_request(
+                            recv_packet, icmp_offset, addr):
+                        break
+
+                rtt = (time_received - ping_start_time) / 1e6
+                self.handle_response(recv_packet, addr, rtt)
 
         except PermissionError:
-            print("Permission denied: You need to run this script with root privilege.")
+            self.__output.message("Permission denied: You need to run this script with root privilege.")
             sys.exit(1)
         except timeout:
             self.__statistics.increment_packet_errors()
-            print("  *        *        *        *        *    Request timed out (By Exception).")
+            self.__output.timeout(self.__destinationIpAddress, self.__packetSequenceNumber, self.__sentAt)
         except Exception as e:
             self.__statistics.increment_packet_errors()
-            print(f"Exception occurred: {e}")
+            self.__output.message(f"Exception occurred: {e}")
+
+    def handle_response(self, recv_packet: bytes, addr: tuple, rtt: float):
+        """Validates and reports a response that belongs to this echo request. `rtt` is in ms."""
+        ip_header_size = ip_header_length(recv_packet)
+        icmp_type = recv_packet[ip_header_size]
+        icmp_code = recv_packet[ip_header_size + 1]
+
+        if icmp_type == ICMPType.ECHO_REPLY:
+            echo_reply = EchoReply(recv_packet, self.__statistics, self.__debug)
+            if self.__profiler is not None:
+                self.__profiler.lap(PARSE)
+            self.__validate_reply(echo_reply)
+            if self.__profiler is not None:
+                self.__profiler.lap(VALIDATE)
+            echo_reply.print_result_to_console(self.__ttl, rtt, addr, self, self.__output)
+        elif icmp_type in [ICMPType.DESTINATION_UNREACHABLE, ICMPType.TIME_EXCEEDED]:
+            self.__statistics.increment_packet_errors()
+            message = self.__get_icmp_message(icmp_type, icmp_code)
+            self.__output.error(self.__destinationIpAddress, self.__packetSequenceNumber, addr[0], icmp_type,
+                                icmp_code, message, self.__sentAt)
+        else:
+            self.__output.message("  Unknown ICMP Type received.")
 
     def print_icmp_packet_header_hex(self):
         header_size = len(self.__header)
@@ -141,29 +248,8 @@ class IcmpPacket:
     def __recalculate_checksum(self):
         if self.__debug:
             print("Calculating Checksum...")
-        packet_as_bytes = self.__header + self.__data
-        checksum = 0
-        count_to = (len(packet_as_bytes) // 2) * 2
-
-        count = 0
-        while count < count_to:
-            this_val = packet_as_bytes[count + 1] * 256 + packet_as_bytes[count]
-            checksum += this_val
-            checksum &= 0xFFFFFFFF
-            count += 2
-
-        if count_to < len(packet_as_bytes):
-            this_val = packet_as_bytes[-1]
-            checksum += this_val
-            checksum &= 0xFFFFFFFF
-
-        # Add carry bits
-        checksum = (checksum >> 16) + (checksum & 0xFFFF)
-        checksum += (checksum >> 16)
-        # One's complement
-        answer = ~checksum & 0xFFFF
-        # Swap bytes for little endian systems
-        answer = (answer >> 8) | (answer << 8 & 0xFF00)
+        # The checksum field is still zero here, so it does not contribute to the sum
+        answer = internet_checksum(self.__header + self.__data)
         if self.__debug:
             print("Checksum: ", hex(answer))
 
@@ -188,8 +274,7 @@ class IcmpPacket:
         # is often used as a techinque to calculate the RTT
         # since it can be extracted from the reply packet.
         timestamp = struct.pack("!d", time.time())
-        data_raw_encoded = self.__dataRaw.encode("utf-8")
-        self.__data = timestamp + data_raw_encoded
+        self.__data = timestamp + self.__dataRaw
 
     def __pack_and_recalculate_checksum(self):
         self.__encode_data()
@@ -224,24 +309,40 @@ class IcmpPacket:
         else:
             echo_reply_packet.set_icmp_identifier_is_valid(True)
 
-        # Check raw data
-        if self.__dataRaw != echo_reply_packet.get_icmp_data():
+        # Check raw data (compared as bytes, the payload does not have to be valid text)
+        if self.__dataRaw != echo_reply_packet.get_icmp_data_bytes():
             checkFlag = False
             if self.__debug:
-                print(
-                    f"Raw Data expected: {self.__dataRaw}, "
-                    f"received: {echo_reply_packet.get_icmp_data()}"
-                )
+                print(f"Raw Data invalid: "
+                      f"{describe_payload_mismatch(echo_reply_packet.get_icmp_data_bytes(), self.__dataRaw)}")
             echo_reply_packet.set_icmp_raw_data_is_valid(False)
         else:
             echo_reply_packet.set_icmp_raw_data_is_valid(True)
 
         echo_reply_packet.set_is_valid_response(checkFlag)
 
+    def __is_reply_to_this_request(self, recv_packet: bytes, icmp_offset: int, addr: tuple) -> bool:
+        """Returns False for a duplicate or a late reply to an earlier request of the run, after counting it."""
+        if self.__sequenceWindow is None or len(recv_packet) < icmp_offset + ICMP_HEADER_SIZE:
+            return True
+        identifier, sequence_number = struct.unpack_from("!HH", recv_packet, icmp_offset + 4)
+        if identifier != self.__packetIdentifier:
+            return True  # Not ours; reported as invalid by __validate_reply
+        if self.__sequenceWindow.record(sequence_number) == DUPLICATE:
+            self.__statistics.increment_duplicate_replies()
+            self.__output.duplicate(self.__destinationIpAddress, addr[0], sequence_number,
+                                    len(recv_packet) - icmp_offset, recv_packet[8])
+            return False
+        if sequence_number != self.__packetSequenceNumber:
+            self.__statistics.increment_late_replies()
+            self.__output.late(self.__destinationIpAddress, addr[0], sequence_number, len(recv_packet) - icmp_offset,
+                               recv_packet[8])
+            return False
+        return True
+
     def __get_icmp_message(self, icmp_type: int, icmp_code: int) -> str:
         """Retrieves the ICMP message based on type and code."""
-        key = (ICMPType(icmp_type), icmp_code) if icmp_code is not None else (ICMPType(icmp_type), None)
-        message = ICMP_MESSAGES.get(key, "Unknown ICMP Type or Code")
+        message = get_icmp_message(icmp_type, icmp_code)
         
         if self.__debug:
             print(f"ICMP Type: {icmp_type}, Code: {icmp_code}, Message: {message}")
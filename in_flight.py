@@ -0,0 +1,52 @@
+# ############################################################################################################ #
+# InFlightTable keeps track of echo requests that have been sent but not yet answered.                         #
+# Probes are keyed by (target, identifier, sequence number) and leave it on reply or on their own deadline.    #
+# ############################################################################################################ #
+
+import time
+from statistics import Statistics
+from timer_wheel import TimerWheel
+
+class InFlightProbe:
+    __slots__ = ("identifier", "sequenceNumber", "targetIp", "packet", "statistics", "sentAt", "deadline")
+
+    def __init__(self, identifier: int, sequenceNumber: int, targetIp: str, packet: 'IcmpPacket',
+                 statistics: Statistics, sentAt: int, deadline: float):
+        self.identifier: int = identifier
+        self.sequenceNumber: int = sequenceNumber
+        self.targetIp: str = targetIp
+        self.packet: 'IcmpPacket' = packet
+        self.statistics: Statistics = statistics
+        self.sentAt: int = sentAt           # time.monotonic_ns() when the probe left
+        self.deadline: float = deadline     # time.monotonic() after which the probe is lost
+
+
+class InFlightTable:
+    def __init__(self):
+        # Probes can have different timeouts, so deadlines are kept in a timing wheel
+        # rather than relying on insertion order.
+        self.__probes = TimerWheel(time.monotonic())
+
+    def __len__(self) -> int:
+        return len(self.__probes)
+
+    def add(self, probe: InFlightProbe) -> InFlightProbe:
+        """Registers `probe`. Returns the probe it displaced when its 16-bit sequence number has wrapped
+        onto one that is still outstanding.
+        """
+        return self.__probes.schedule((probe.targetIp, probe.identifier, probe.sequenceNumber), probe.deadline, probe)
+
+    def pop(self, targetIp: str, identifier: int, sequenceNumber: int) -> InFlightProbe:
+        return self.__probes.cancel((targetIp, identifier, sequenceNumber))
+
+    def next_deadline(self) -> float:
+        """Returns the earliest deadline of an outstanding probe, or None if nothing is in flight."""
+        return self.__probes.next_deadline()
+
+    def expire(self, now: float) -> list:
+        """Removes and returns every probe whose deadline has passed."""
+        return self.__probes.expire(now)
+
+    def drain(self) -> list:
+        """Removes and returns every outstanding probe."""
+        return self.__probes.clear()
@@ -0,0 +1,103 @@
+# ############################################################################################################ #
+# LatencyHistogram is a log-bucketed (HDR-style) histogram for percentile queries in bounded memory.           #
+# Bucket boundaries grow geometrically, so every recorded value is known to within a fixed relative error      #
+# and the number of buckets only depends on the tracked range, never on the number of samples.                 #
+# ############################################################################################################ #
+
+import math
+
+DEFAULT_PRECISION = 0.01     # 1% relative error
+DEFAULT_LOWEST = 0.001       # 1 microsecond, in ms
+DEFAULT_HIGHEST = 3600000.0  # 1 hour, in ms
+
+class LatencyHistogram:
+    def __init__(self, precision: float = DEFAULT_PRECISION, lowest: float = DEFAULT_LOWEST,
+                 highest: float = DEFAULT_HIGHEST):
+        self.__precision: float = precision                   # Relative width of a bucket
+        self.__lowest: float = lowest                         # Values at or below this share bucket 0
+        self.__logBase: float = math.log1p(precision)
+        self.__maxBucket: int = math.ceil(math.log(highest / lowest) / self.__logBase)  # Values above `highest` share it
+        self.__counts: dict = {}                              # Bucket index -> count, only non-empty buckets
+        self.__totalCount: int = 0
+
+    # ############################################################
+    # Getters                                                    #
+    # ############################################################
+    def get_total_count(self) -> int:
+        return self.__totalCount
+
+    def get_bucket_count(self) -> int:
+        return len(self.__counts)
+
+    def get_layout(self) -> tuple:
+        """Returns (lowest, log base, highest bucket), to compute bucket indexes outside, e.g. vectorized."""
+        return self.__lowest, self.__logBase, self.__maxBucket
+
+    def get_buckets(self) -> list:
+        """Returns (upper bound, count) of every non-empty bucket in ascending order."""
+        return [(self.__upper_bound_of(bucket), self.__counts[bucket]) for bucket in sorted(self.__counts)]
+
+    def get_cumulative_counts(self, bounds: tuple) -> list:
+        """Returns how many recorded values are at or below each of the ascending `bounds`, to bucket precision."""
+        counts = [0] * len(bounds)
+        for bucket, count in self.__counts.items():
+            value = self.__value_of(bucket)
+            for index in range(len(bounds)):
+                if value <= bounds[index]:
+                    counts[index] += count
+                    break
+        for index in range(1, len(bounds)):
+            counts[index] += counts[index - 1]
+        return counts
+
+    def get_percentile(self, percentile: float) -> float:
+        """Returns the value below which `percentile` percent of the recorded values fall, or 0.0 when empty."""
+        if self.__totalCount == 0:
+            return 0.0
+        rank = max(1, math.ceil(self.__totalCount * percentile / 100))
+        seen = 0
+        for bucket in sorted(self.__counts):
+            seen += self.__counts[bucket]
+            if seen >= rank:
+                return self.__value_of(bucket)
+        return self.__value_of(max(self.__counts))
+
+    # ############################################################
+    # Public Functions                                           #
+    # ############################################################
+    def record(self, value: float):
+        bucket = self.__bucket_of(value)
+        self.__counts[bucket] = self.__counts.get(bucket, 0) + 1
+        self.__totalCount += 1
+
+    def record_bucket(self, bucket: int, count: int = 1):
+        """Adds `count` values to a bucket index computed from get_layout()."""
+        bucket = min(max(bucket, 0), self.__maxBucket)
+        self.__counts[bucket] = self.__counts.get(bucket, 0) + count
+        self.__totalCount += count
+
+    def merge(self, other: 'LatencyHistogram'):
+        if (other.__precision, other.__lowest, other.__maxBucket) != (self.__precision, self.__lowest, self.__maxBucket):
+            raise ValueError("Cannot merge histograms with different bucket layouts.")
+        for bucket, count in other.__counts.items():
+            self.__counts[bucket] = self.__counts.get(bucket, 0) + count
+        self.__totalCount += other.__totalCount
+
+    # ############################################################
+    # Private Functions                                          #
+    # ############################################################
+    def __bucket_of(self, value: float) -> int:
+        # Bucket b >= 1 covers (lowest * base^(b-1), lowest * base^b]
+        if value <= self.__lowest:
+            return 0
+        bucket = math.ceil(math.log(value / self.__lowest) / self.__logBase)
+        return min(bucket, self.__maxBucket)
+
+    def __upper_bound_of(self, bucket: int) -> float:
+        return self.__lowest * math.exp(bucket * self.__logBase)
+
+    def __value_of(self, bucket: int) -> float:
+        # Geometric midpoint of the bucket, within precision/2 of any value recorded in it
+        if bucket == 0:
+            return self.__lowest
+        return self.__lowest * math.exp((bucket - 0.5) * self.__logBase)
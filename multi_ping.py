@@ -0,0 +1,190 @@
+# ############################################################################################################ #
+# MultiPing probes many targets concurrently from one asyncio event loop.                                      #
+# A single raw socket is driven through loop.add_reader; probes go out round-robin across the targets and      #
+# replies are demultiplexed by source address plus identifier/sequence number.                                 #
+# ############################################################################################################ #
+
+import asyncio
+import os
+import signal
+import time
+from statistics import Statistics
+from probe_session import ProbeSession
+from resolver import get_default_resolver
+from transport import DEFAULT_TRANSPORT
+from probe_output import DEFAULT_OUTPUT
+from pacer import Pacer
+from packet_template import DEFAULT_PATTERN
+from constants import TIMEOUT, RTO_MIN, RTO_MAX, DEFAULT_BATCH
+
+class MultiPing:
+    def __init__(self, targets: list, count: int = None, wait: float = 1, debug: bool = False,
+                 timeout: float = TIMEOUT, kernel_timestamps: bool = False, adaptive_timeout: bool = False,
+                 min_timeout: float = RTO_MIN, max_timeout: float = RTO_MAX, identifier: int = None,
+                 socket_filter: bool = True, transport=DEFAULT_TRANSPORT, output=DEFAULT_OUTPUT, rate: float = None,
+                 flood: bool = False, payload: bytes = DEFAULT_PATTERN, profiler=None, batch_size: int = DEFAULT_BATCH):
+        self.__targets: list = list(dict.fromkeys(targets))  # Host names in the order given, without duplicates
+        self.__count: int = count                             # Probes per target, None for unlimited
+        self.__wait: float = wait                             # Seconds between two probes to the same target
+        self.__debug: bool = debug                            # Debug flag
+        self.__timeout: float = timeout                       # Seconds before a probe is declared lost
+        self.__kernelTimestamps: bool = kernel_timestamps     # Take receive times from SO_TIMESTAMPNS
+        self.__adaptiveTimeout: bool = adaptive_timeout       # Per-target RFC 6298 timeouts
+        self.__minTimeout: float = min_timeout                # Floor of the adaptive timeout
+        self.__maxTimeout: float = max_timeout                # Ceiling of the adaptive timeout
+        self.__identifier: int = identifier                   # ICMP identifier, defaults to the process id
+        self.__socketFilter: bool = socket_filter             # Attach a BPF filter for our identifier
+        self.__transport = transport                          # Opens the socket (raw, datagram or simulated)
+        self.__output = output                                # Reports every probe and the summaries
+        self.__rate: float = rate                             # Probes per second over all targets, overrides wait
+        self.__flood: bool = flood                            # Send the next probe as soon as the last is answered
+        self.__payload: bytes = payload                       # Echo request data after the timestamp
+        self.__profiler = profiler                            # StageProfiler, None when not profiling
+        self.__batchSize: int = batch_size                    # Most probes handed to one sendmmsg call
+        self.__pacer: Pacer = None                            # Schedule of the last run
+        self.__filterReport: str = None                       # Socket filter counters of the last run
+        self.__statistics: dict = {}                          # Host name -> Statistics
+        self.__running: bool = True                           # Cleared by stop()
+        self.__wakeup = None                                  # asyncio.Event that interrupts the sender's sleep
+
+    # ############################################################
+    # Getters                                                    #
+    # ############################################################
+    def get_statistics(self) -> dict:
+        return self.__statistics
+
+    # ############################################################
+    # Public Functions                                           #
+    # ############################################################
+    def stop(self):
+        self.__running = False
+        if self.__wakeup is not None:
+            self.__wakeup.set()
+
+    async def run(self) -> dict:
+        """Probes every target until --count is reached or stop() is called. Returns host -> Statistics."""
+        loop = asyncio.get_running_loop()
+        self.__wakeup = asyncio.Event()
+        resolver = get_default_resolver()
+        resolved = await self.__resolve_targets(resolver)
+        if not resolved:
+            return self.__statistics
+
+        # Probes to different targets are spread evenly over one interval
+        spacing = 1 / self.__rate if self.__rate else self.__wait / len(resolved)
+        pacer = self.__pacer = Pacer(spacing, self.__flood)
+        sequence_numbers = [0] * len(resolved)
+        identifier = self.__identifier if self.__identifier is not None else os.getpid() & 0xFFFF
+
+        with ProbeSession(identifier, self.__timeout, debug=self.__debug, kernelTimestamps=self.__kernelTimestamps,
+                          adaptiveTimeout=self.__adaptiveTimeout, minTimeout=self.__minTimeout,
+                          maxTimeout=self.__maxTimeout, socketFilter=self.__socketFilter,
+                          transport=self.__transport, output=self.__output, payload=self.__payload,
+                          profiler=self.__profiler, batchSize=self.__batchSize) as session:
+            for statistics in self.__statistics.values():
+                statistics.set_clock_source(session.get_clock_source())
+            loop.add_reader(session.fileno(), self.__on_readable, session)
+            loop.add_signal_handler(signal.SIGINT, self.stop)
+            try:
+                index = 0
+                while self.__running:
+                    sending = self.__count is None or sequence_numbers[index] < self.__count
+                    if not sending and session.get_in_flight_count() == 0:
+                        break
+
+                    now = time.monotonic()
+                    if sending and pacer.is_due(now, session.get_in_flight_count()):
+                        # Every probe already due goes out together, up to one batch
+                        probes = []
+                        while (sending and len(probes) < self.__batchSize
+                               and pacer.is_due(now, session.get_in_flight_count() + len(probes))):
+                            host, target_ip = resolved[index]
+                            # Never blocks: a stale address is refreshed in the background
+                            target_ip = resolver.get_cached(host) or target_ip
+                            probes.append((target_ip, sequence_numbers[index], self.__statistics[host]))
+                            sequence_numbers[index] += 1
+                            index = (index + 1) % len(resolved)
+                            pacer.record_send(now)
+                            sending = self.__count is None or sequence_numbers[index] < self.__count
+                        session.send_probes(probes)
+                        if len(probes) == self.__batchSize > 1:
+                            # Saturated: drain the replies between batches before the receive buffer overflows
+                            self.__on_readable(session)
+                        continue
+
+                    session.expire_probes(now)
+                    self.__output.flush_if_due(now)
+                    next_send = pacer.get_next_due(session.get_in_flight_count())
+                    wake_times = [next_send] if sending and next_send is not None else []
+                    next_deadline = session.next_deadline()
+                    if next_deadline is not None:
+                        wake_times.append(next_deadline)
+                    next_flush = self.__output.next_flush()
+                    if next_flush is not None:
+                        wake_times.append(next_flush)
+                    if wake_times:
+                        await self.__sleep_until(min(wake_times))
+            finally:
+                loop.remove_signal_handler(signal.SIGINT)
+                loop.remove_reader(session.fileno())
+                session.abandon_probes()
+                self.__filterReport = session.get_filter_report()
+
+        return self.__statistics
+
+    def print_statistics(self):
+        for host, statistics in self.__statistics.items():
+            self.__output.summary(host, statistics)
+        if self.__filterReport is not None:
+            self.__output.message("")
+            self.__output.message(self.__filterReport)
+        if self.__pacer is not None and self.__pacer.get_sent() > 1:
+            self.__output.message(self.__pacer.get_report())
+        if self.__profiler is not None:
+            self.__output.message(self.__profiler.get_report())
+
+    # ############################################################
+    # Private Functions                                          #
+    # ############################################################
+    async def __resolve_targets(self, resolver) -> list:
+        # All lookups run concurrently before the first probe is sent
+        addresses_by_host = await resolver.resolve_many_async(self.__targets)
+        resolved = []
+        addresses = set()
+        for host in self.__targets:
+            target_ip = addresses_by_host[host]
+            if target_ip is None:
+                self.__output.message(f" [ping] Unknown host {host}. Skipping...")
+                continue
+            # Replies are matched on their source address, so each address may only be probed once
+            if target_ip in addresses:
+                self.__output.message(f" [ping] {host} ({target_ip}) is already a target. Skipping...")
+                continue
+            addresses.add(target_ip)
+            resolved.append((host, target_ip))
+            self.__statistics[host] = Statistics()
+        return resolved
+
+    def __on_readable(self, session: ProbeSession):
+        session.receive_pending()
+        # Once the last outstanding probe is answered the sender may be able to finish early
+        if session.get_in_flight_count() == 0:
+            self.__wakeup.set()
+
+    async def __sleep_until(self, deadline: float):
+        try:
+            await asyncio.wait_for(self.__wakeup.wait(), max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            pass
+        self.__wakeup.clear()
+
+
+def read_targets_file(path: str) -> list:
+    """Reads one host per line, ignoring blank lines and # comments."""
+    targets = []
+    with open(path) as f:
+        for line in f:
+            host = line.split("#", 1)[0].strip()
+            if host:
+                targets.append(host)
+    return targets
@@ -0,0 +1,68 @@
+# ############################################################################################################ #
+# Pacer decides when the next probe goes out: at a fixed interval, at a requested packets-per-second rate, or  #
+# in flood mode as soon as the previous probe is answered. Send times are absolute monotonic deadlines, so the #
+# time spent sending, receiving and sleeping never adds up to drift. It is a token bucket: a sender that fell  #
+# behind by up to PACING_SLACK seconds (or one interval) catches up in a burst; a longer backlog is dropped.   #
+# ############################################################################################################ #
+
+from constants import PACING_SLACK, FLOOD_INTERVAL
+
+class Pacer:
+    def __init__(self, interval: float = 1.0, flood: bool = False):
+        self.__interval: float = interval                  # Seconds between two probes, 0 for back to back
+        self.__flood: bool = flood                         # Send when nothing is in flight
+        self.__slack: float = max(interval, PACING_SLACK)  # Bucket depth, in seconds of probes
+        self.__nextDue: float = None                       # Monotonic deadline of the next probe
+        self.__firstSentAt: float = None
+        self.__lastSentAt: float = None
+        self.__sent: int = 0
+
+    # ############################################################
+    # Getters                                                    #
+    # ############################################################
+    def get_sent(self) -> int:
+        return self.__sent
+
+    def get_next_due(self, inFlight: int = 0) -> float:
+        """Returns the monotonic time the next probe may go out; None when it may go out right away."""
+        if self.__lastSentAt is None:
+            return None
+        if self.__flood:
+            # As fast as replies come back, but never stalled by a lost probe for longer than FLOOD_INTERVAL
+            return None if inFlight == 0 else self.__lastSentAt + FLOOD_INTERVAL
+        return self.__nextDue
+
+    def get_requested_rate(self) -> float:
+        """Returns the requested probes per second; None in flood mode or without pacing (interval 0)."""
+        if self.__flood or self.__interval == 0:
+            return None
+        return 1 / self.__interval
+
+    def get_achieved_rate(self) -> float:
+        if self.__sent < 2 or self.__lastSentAt == self.__firstSentAt:
+            return None
+        return (self.__sent - 1) / (self.__lastSentAt - self.__firstSentAt)
+
+    def get_report(self) -> str:
+        requested = self.get_requested_rate()
+        achieved = self.get_achieved_rate()
+        requested = f"{requested:.6g} pps" if requested is not None else ("flood" if self.__flood else "unpaced")
+        achieved = f"{achieved:.6g} pps" if achieved is not None else "n/a"
+        return f"pacing: {self.__sent} probes, achieved {achieved}, requested {requested}"
+
+    # ############################################################
+    # Public Functions                                           #
+    # ############################################################
+    def is_due(self, now: float, inFlight: int = 0) -> bool:
+        next_due = self.get_next_due(inFlight)
+        return next_due is None or now >= next_due
+
+    def record_send(self, now: float):
+        """Takes one token: schedules the next probe one interval after this one was due."""
+        if self.__firstSentAt is None:
+            self.__firstSentAt = now
+            self.__nextDue = now
+        self.__lastSentAt = now
+        self.__sent += 1
+        # Behind by more than the bucket holds: forget the backlog rather than bursting to catch up
+        self.__nextDue = max(self.__nextDue, now - self.__slack) + self.__interval
@@ -0,0 +1,78 @@
+# ############################################################################################################ #
+# EchoRequestTemplate precomputes the constant parts of an ICMP echo request.                                  #
+# Type/code, identifier and the encoded payload are summed once; every probe only folds in its sequence        #
+# number and send timestamp before packing.                                                                    #
+# ############################################################################################################ #
+
+import struct
+import time
+from checksum import fold, ones_complement_sum
+from stage_profiler import CHECKSUM
+from constants import ICMPType, RAW_DATA, TIMESTAMP_SIZE, MAX_DATA_SIZE, MAX_PATTERN_SIZE
+
+HEADER = struct.Struct("!BBHHH")
+TIMESTAMP = struct.Struct("!d")
+TIMESTAMP_WORDS = struct.Struct("!HHHH")
+DEFAULT_PATTERN = RAW_DATA.encode("utf-8")
+
+def parse_pattern(text: str) -> bytes:
+    """Parses a -p pattern: up to MAX_PATTERN_SIZE bytes in hex, e.g. "ff00" or "de:ad:be:ef"."""
+    try:
+        pattern = bytes.fromhex(text.replace(":", ""))
+    except ValueError:
+        raise ValueError(f"Invalid pattern (expected hex bytes): {text}") from None
+    if not 0 < len(pattern) <= MAX_PATTERN_SIZE:
+        raise ValueError(f"A pattern has 1 to {MAX_PATTERN_SIZE} bytes: {text}")
+    return pattern
+
+def make_payload(dataSize: int, pattern: bytes = DEFAULT_PATTERN) -> bytes:
+    """Returns the payload that follows the timestamp in `dataSize` ICMP data bytes, `pattern` repeated.
+
+    Raises ValueError when `dataSize` can not hold the timestamp or does not fit in an IPv4 datagram.
+    """
+    if not TIMESTAMP_SIZE <= dataSize <= MAX_DATA_SIZE:
+        raise ValueError(f"The data size must be between {TIMESTAMP_SIZE} and {MAX_DATA_SIZE} bytes: {dataSize}")
+    size = dataSize - TIMESTAMP_SIZE
+    return (pattern * (size // len(pattern) + 1))[:size]
+
+def describe_payload_mismatch(received: bytes, expected: bytes) -> str:
+    """Says where a reply's payload differs from ours, without printing either (they may be 64 KB)."""
+    if len(received) != len(expected):
+        return f"received {len(received)} bytes BUT - expected {len(expected)}"
+    offset = next(index for index in range(len(expected)) if received[index] != expected[index])
+    return (f"byte {offset} is 0x{received[offset]:02x} BUT - expected 0x{expected[offset]:02x} "
+            f"({sum(a != b for a, b in zip(received, expected))} of {len(expected)} bytes differ)")
+
+class EchoRequestTemplate:
+    def __init__(self, identifier: int, payload: bytes = DEFAULT_PATTERN, profiler=None):
+        self.__identifier: int = identifier        # 0-65535 (unsigned short)
+        self.__payload: bytes = payload            # Encoded data that follows the timestamp
+        self.__profiler = profiler                 # StageProfiler timing the checksum, None when not profiling
+        # Partial one's complement sum of everything that does not change between probes
+        self.__baseSum: int = (ICMPType.ECHO_REQUEST << 8) + identifier + ones_complement_sum(payload)
+
+    # ############################################################
+    # Getters                                                    #
+    # ############################################################
+    def get_identifier(self) -> int:
+        return self.__identifier
+
+    def get_payload(self) -> bytes:
+        return self.__payload
+
+    # ############################################################
+    # Public Functions                                           #
+    # ############################################################
+    def build(self, sequenceNumber: int, timestamp: float) -> bytes:
+        """Returns a complete echo request (header + timestamp + payload) with a valid checksum."""
+        timestamp_bytes = TIMESTAMP.pack(timestamp)
+        profiler = self.__profiler
+        if profiler is not None:
+            started = time.perf_counter_ns()
+        total = self.__baseSum + sequenceNumber + sum(TIMESTAMP_WORDS.unpack(timestamp_bytes))
+        checksum = ~fold(total) & 0xFFFF
+        if profiler is not None:
+            profiler.record_nested(CHECKSUM, time.perf_counter_ns() - started)
+        return HEADER.pack(
+            ICMPType.ECHO_REQUEST, 0, checksum, self.__identifier, sequenceNumber
+        ) + timestamp_bytes + self.__payload
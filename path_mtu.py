@@ -0,0 +1,323 @@
+# ############################################################################################################ #
+# PathMtuDiscovery finds the largest datagram that reaches each destination without fragmentation.             #
+# Echo requests go out with the don't-fragment bit set, several sizes at once, so every round narrows the      #
+# range between the largest size that was answered and the smallest that was not to a fraction of it. A size   #
+# is too big when a router answers with fragmentation needed (its next-hop MTU is tried in the next round),    #
+# when the kernel already knows it does not fit (EMSGSIZE), or when every probe of it goes unanswered while    #
+# smaller ones get through: the sign of an ICMP black hole.                                                    #
+# ############################################################################################################ #
+
+import errno
+import os
+import select
+import time
+from socket import SOL_SOCKET, SO_RCVBUF
+from icmp_packet import get_icmp_message
+from in_flight import InFlightProbe, InFlightTable
+from packet_template import EchoRequestTemplate, DEFAULT_PATTERN, make_payload
+from reply_decoder import ReplyDecoder
+from resolver import get_default_resolver
+from transport import DEFAULT_TRANSPORT
+from constants import (
+    ICMPType,
+    ICMPCodeDestUnreach,
+    IP_HEADER_SIZE,
+    ICMP_HEADER_SIZE,
+    PMTU_MIN,
+    PMTU_MAX,
+    PMTU_SIZES,
+    PMTU_PROBES,
+    PMTU_TIMEOUT,
+    PMTU_GUESSES
+)
+
+FITS = "fits"
+TOO_BIG = "too big"
+UNANSWERED = "unanswered"
+NOT_SENT = "not sent"
+
+class MtuSearch:
+    __slots__ = ("low", "high", "limitedBy", "reportedMtu", "blackHole", "message", "rounds", "probes", "pending",
+                 "stopped")
+
+    def __init__(self):
+        self.low: int = 0                       # Largest datagram size answered so far, 0 before any
+        self.high: int = PMTU_MAX + 1           # Smallest datagram size known not to fit
+        self.limitedBy: str = None              # What set `high`
+        self.reportedMtu: int = None            # Next-hop MTU of the last fragmentation-needed error
+        self.blackHole: bool = False            # Some size was dropped without an error
+        self.message: str = None                # Last ICMP error that was not fragmentation needed
+        self.rounds: int = 0
+        self.probes: int = 0
+        self.pending: dict = {}                 # Datagram size -> [probes outstanding, outcome] of this round
+        self.stopped: bool = False              # A round could not send anything
+
+    def is_complete(self) -> bool:
+        if self.stopped or self.high - max(self.low, PMTU_MIN) <= 1:
+            return True
+        return self.rounds > 0 and self.low == 0 and not self.pending
+
+
+class PathMtuDiscovery:
+    def __init__(self, targets: list, timeout: float = PMTU_TIMEOUT, probesPerSize: int = PMTU_PROBES,
+                 identifier: int = None, debug: bool = False, socketFilter: bool = True, transport=DEFAULT_TRANSPORT,
+                 pattern: bytes = DEFAULT_PATTERN):
+        self.__targets: list = list(dict.fromkeys(targets)) # Host names in the order given
+        self.__timeout: float = timeout                      # Seconds before a probe is declared unanswered
+        self.__probesPerSize: int = probesPerSize            # Probes of each size in a round
+        self.__identifier: int = os.getpid() & 0xFFFF if identifier is None else identifier
+        self.__debug: bool = debug                           # Debug flag
+        self.__socketFilter: bool = socketFilter             # Attach a BPF filter for our identifier
+        self.__transport = transport                         # Opens the socket (raw, datagram or simulated)
+        self.__pattern: bytes = pattern                      # Fills the payload of every probe
+        self.__templates: dict = {}                          # Datagram size -> EchoRequestTemplate
+        self.__decoder = ReplyDecoder()                      # Reusable receive buffer; payloads are not checked
+        self.__inFlight = InFlightTable()                    # Probes waiting for an answer
+        self.__sizes: dict = {}                              # Sequence number -> datagram size of the probe
+        self.__sequenceNumber: int = 0                       # Of the next probe, shared by every destination
+        self.__hosts: dict = {}                              # Destination IP -> host name
+        self.__searches: dict = {}                           # Destination IP -> MtuSearch
+        self.__dontFragment: bool = False                    # The socket sets DF; otherwise results are meaningless
+        self.__elapsed: float = 0.0                          # Seconds from the first send to the last answer
+
+    # ############################################################
+    # Getters                                                    #
+    # ############################################################
+    def get_path_mtus(self) -> dict:
+        """Returns host name -> path MTU in bytes, or None when the destination never answered."""
+        return {self.__hosts[target_ip]: search.low or None for target_ip, search in self.__searches.items()}
+
+    def get_elapsed(self) -> float:
+        return self.__elapsed
+
+    # ############################################################
+    # Public Functions                                           #
+    # ############################################################
+    def run(self) -> dict:
+        """Searches the path MTU of every destination at once. Returns get_path_mtus()."""
+        self.__resolve_targets()
+        if not self.__searches:
+            return {}
+
+        with self.__transport.open(timeout=self.__timeout, identifier=self.__identifier) as s:
+            s.setblocking(False)
+            if self.__socketFilter:
+                self.__transport.attach_filter(s, [self.__identifier])
+            try:
+                # Room for a whole round of the largest replies, as far as net.core.rmem_max allows
+                s.setsockopt(SOL_SOCKET, SO_RCVBUF, PMTU_SIZES * self.__probesPerSize * (PMTU_MAX + 1))
+            except OSError:
+                pass
+            self.__dontFragment = self.__transport.set_dont_fragment(s)
+            if not self.__dontFragment:
+                print(" [pmtu] Cannot set the don't-fragment bit on this transport; sizes are not limited by the path.")
+            started = time.monotonic()
+            while True:
+                narrowed = False
+                for target_ip, search in self.__searches.items():
+                    if not search.pending and not search.is_complete():
+                        narrowed = self.__send_round(s, target_ip, search) or narrowed
+                next_deadline = self.__inFlight.next_deadline()
+                if next_deadline is None:
+                    # Sends refused with EMSGSIZE settle a round at once; anything else would only repeat it
+                    if narrowed:
+                        continue
+                    break
+                ready = select.select([s], [], [], max(0.0, next_deadline - time.monotonic()))
+                if ready[0]:
+                    self.__receive_pending(s)
+                self.__expire_probes(time.monotonic())
+            self.__elapsed = time.monotonic() - started
+        return self.get_path_mtus()
+
+    def print_results(self):
+        for target_ip, search in self.__searches.items():
+            host = self.__hosts[target_ip]
+            print(f"\npath MTU to {host} ({target_ip}), {search.rounds} rounds, {search.probes} probes")
+            if search.low == 0:
+                reason = f": {search.message}" if search.message else ""
+                print(f"    no answer to {PMTU_MIN} byte probes{reason}")
+                continue
+            print(f"    {search.low} bytes ({search.low - IP_HEADER_SIZE - ICMP_HEADER_SIZE} data bytes)")
+            print(f"    limited by {search.limitedBy or 'the largest IPv4 datagram'}")
+            if search.blackHole:
+                print(f"    Larger probes were dropped without a fragmentation-needed error: "
+                      f"possible ICMP black hole on the path")
+        print(f"\n--- {len(self.__searches)} path MTUs found in {round(self.__elapsed * 1000, 3)} ms ---")
+
+    # ############################################################
+    # Private Functions                                          #
+    # ############################################################
+    def __resolve_targets(self):
+        addresses_by_host = get_default_resolver().resolve_many(self.__targets)
+        for host in self.__targets:
+            target_ip = addresses_by_host[host]
+            if target_ip is None:
+                print(f" [pmtu] Unknown host {host}. Skipping...")
+                continue
+            # Answers are matched on the quoted destination, so each address may only be searched once
+            if target_ip in self.__searches:
+                print(f" [pmtu] {host} ({target_ip}) is already a target. Skipping...")
+                continue
+            self.__hosts[target_ip] = host
+            self.__searches[target_ip] = MtuSearch()
+
+    def __candidate_sizes(self, search: MtuSearch) -> list:
+        """Returns up to PMTU_SIZES datagram sizes strictly between what is known to fit and what is not."""
+        low = max(search.low, PMTU_MIN)
+        sizes = set()
+        if search.rounds == 0:
+            # The smallest size tells whether the destination answers at all; common MTUs often end the search
+            sizes.add(PMTU_MIN)
+            sizes.update(size for guess in PMTU_GUESSES for size in (guess, guess + 1) if low < size < search.high)
+        if search.reportedMtu is not None and low < search.reportedMtu < search.high:
+            sizes.add(search.reportedMtu)
+        slots = min(PMTU_SIZES - len(sizes), search.high - low - 1)
+        # The rest split the open range evenly, so a round narrows it by a factor of about PMTU_SIZES
+        for index in range(1, slots + 1):
+            sizes.add(low + (search.high - low) * index // (slots + 1))
+        return sorted(size for size in sizes if size == PMTU_MIN or low < size < search.high)
+
+    def __send_round(self, s, targetIp: str, search: MtuSearch) -> bool:
+        """Sends the probes of the next round. Returns True when refused sends already narrowed the range."""
+        bounds = search.low, search.high
+        probes = search.probes
+        sizes = self.__candidate_sizes(search)
+        search.rounds += 1
+        if self.__debug:
+            print(f"Round {search.rounds} to {targetIp}: {sizes}")
+        for size in sizes:
+            search.pending[size] = [0, UNANSWERED]
+            for _ in range(self.__probesPerSize):
+                if not self.__send_probe(s, targetIp, search, size):
+                    break
+            if search.pending[size][0] == 0:
+                self.__settle(targetIp, search, size)
+            # Nearby destinations answer while the round is still going out; a full buffer would drop large replies
+            self.__receive_pending(s)
+        narrowed = (search.low, search.high) != bounds
+        search.stopped = search.probes == probes and not narrowed
+        return narrowed
+
+    def __send_probe(self, s, targetIp: str, search: MtuSearch, size: int) -> bool:
+        """Sends one probe of `size` bytes; False when no probe of this size can be sent."""
+        template = self.__templates.get(size)
+        if template is None:
+            payload = make_payload(size - IP_HEADER_SIZE - ICMP_HEADER_SIZE, self.__pattern)
+            template = self.__templates[size] = EchoRequestTemplate(self.__identifier, payload)
+        sequence_number = self.__sequenceNumber
+        self.__sequenceNumber = (sequence_number + 1) & 0xFFFF
+        packet = template.build(sequence_number, time.time())
+        try:
+            try:
+                s.sendto(packet, (targetIp, 0))
+            except BlockingIOError:
+                # The send buffer is full; wait for room once rather than dropping the probe
+                select.select([], [s], [], self.__timeout)
+                s.sendto(packet, (targetIp, 0))
+        except OSError as e:
+            if e.errno != errno.EMSGSIZE:
+                print(f"Exception occurred: {e}")
+                if search.pending[size][0] == 0:
+                    search.pending[size][1] = NOT_SENT
+                return False
+            # The route already has a smaller MTU, e.g. the interface's or one learned from an earlier error
+            search.pending[size][1] = TOO_BIG
+            self.__lower_high(search, size, "the MTU of the local route (message too long)")
+            return False
+
+        sent_at = time.monotonic_ns()
+        search.probes += 1
+        search.pending[size][0] += 1
+        self.__sizes[sequence_number] = size
+        self.__inFlight.add(InFlightProbe(
+            self.__identifier, sequence_number, targetIp, None, None, sent_at, sent_at / 1e9 + self.__timeout
+        ))
+        return True
+
+    def __receive_pending(self, s):
+        while True:
+            try:
+                addr = self.__decoder.receive(s)
+            except (BlockingIOError, InterruptedError):
+                return
+            if addr is not None:
+                self.__handle_packet(addr)
+
+    def __handle_packet(self, addr: tuple):
+        decoder = self.__decoder
+        icmp_type = decoder.get_icmp_type()
+
+        if icmp_type == ICMPType.ECHO_REPLY:
+            echo = decoder.decode_echo()
+            if echo is None:
+                return
+            target_ip = addr[0]
+            _, _, _, identifier, sequence_number, _ = echo
+        elif icmp_type in [ICMPType.DESTINATION_UNREACHABLE, ICMPType.TIME_EXCEEDED]:
+            # The quoted header is the echo request the router dropped
+            quoted = decoder.decode_quoted()
+            if quoted is None:
+                return
+            target_ip, identifier, sequence_number = quoted
+        else:
+            return
+
+        if identifier != self.__identifier:
+            return
+        probe = self.__inFlight.pop(target_ip, identifier, sequence_number)
+        if probe is None:
+            if self.__debug:
+                print(f"Ignoring answer from {addr[0]} for {target_ip} icmp_seq={sequence_number}: not in flight.")
+            return
+
+        search = self.__searches[target_ip]
+        size = self.__sizes.pop(sequence_number)
+        outcome = search.pending[size]
+        outcome[0] -= 1
+        if icmp_type == ICMPType.ECHO_REPLY:
+            # A reply of a different length was cut short somewhere and does not prove the size fits
+            if decoder.get_length() - decoder.get_ip_header_length() == size - IP_HEADER_SIZE:
+                outcome[1] = FITS
+        elif icmp_type == ICMPType.DESTINATION_UNREACHABLE and decoder.get_icmp_code() == ICMPCodeDestUnreach.FRAG_NEEDED:
+            next_hop_mtu = decoder.get_next_hop_mtu()
+            if outcome[1] != FITS:
+                outcome[1] = TOO_BIG
+            if PMTU_MIN <= next_hop_mtu < size:
+                search.reportedMtu = next_hop_mtu
+                self.__lower_high(search, next_hop_mtu + 1,
+                                  f"fragmentation needed at {addr[0]} (next-hop MTU {next_hop_mtu})")
+            self.__lower_high(search, size, f"fragmentation needed at {addr[0]}")
+        else:
+            search.message = get_icmp_message(icmp_type, decoder.get_icmp_code())
+        if outcome[0] == 0:
+            self.__settle(target_ip, search, size)
+
+    def __expire_probes(self, now: float):
+        for probe in self.__inFlight.expire(now):
+            search = self.__searches[probe.targetIp]
+            size = self.__sizes.pop(probe.sequenceNumber)
+            search.pending[size][0] -= 1
+            if search.pending[size][0] == 0:
+                self.__settle(probe.targetIp, search, size)
+
+    def __settle(self, targetIp: str, search: MtuSearch, size: int):
+        """Applies the outcome of `size` once none of its probes is outstanding."""
+        _, outcome = search.pending.pop(size)
+        if self.__debug:
+            print(f"{targetIp}: {size} bytes {outcome}")
+        if outcome == FITS:
+            search.low = max(search.low, size)
+            if search.high <= search.low:
+                # A larger size was taken for too big after its probes were lost; the answer overrules it
+                search.high, search.limitedBy, search.blackHole = PMTU_MAX + 1, None, False
+        elif outcome == UNANSWERED and size > max(search.low, PMTU_MIN) and size < search.high:
+            search.blackHole = True
+            self.__lower_high(search, size, "larger probes going unanswered")
+        if not search.pending and self.__debug:
+            print(f"{targetIp}: between {search.low} and {search.high} bytes")
+
+    def __lower_high(self, search: MtuSearch, size: int, limitedBy: str):
+        if search.low < size < search.high:
+            search.high = size
+            search.limitedBy = limitedBy
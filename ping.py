@@ -1,83 +1,536 @@
 import argparse
+import asyncio
 import os
 import sys
 import signal
 import time
-from socket import gethostbyname, gaierror
+from socket import gaierror
 from icmp_packet import IcmpPacket
+from probe_session import ProbeSession
+from multi_ping import MultiPing, read_targets_file
+from sweep import Sweep
+from traceroute import Traceroute
+from path_mtu import PathMtuDiscovery
+from daemon import PingDaemon
+from resolver import get_default_resolver
+from sequence_window import SequenceWindow
+from transport import DEFAULT_TRANSPORT, TRANSPORTS, IdentifierInUseError, get_transport
+from probe_output import DEFAULT_OUTPUT, FORMATS, create_output
+from probe_log import ProbeLog, RecordingOutput, replay
+from packet_template import EchoRequestTemplate, DEFAULT_PATTERN, parse_pattern, make_payload
+from pacer import Pacer
+from stage_profiler import StageProfiler, BUILD
 from statistics import Statistics
-from constants import RAW_DATA, ICMP_HEADER_SIZE
+from constants import (
+    TIMESTAMP_SIZE,
+    DEFAULT_DATA_SIZE,
+    MAX_DATA_SIZE,
+    MAX_PATTERN_SIZE,
+    TIMEOUT,
+    RTO_MIN,
+    RTO_MAX,
+    TRACEROUTE_MAX_HOPS,
+    TRACEROUTE_PROBES,
+    TRACEROUTE_TIMEOUT,
+    PMTU_TIMEOUT,
+    DAEMON_PORT,
+    DEFAULT_BATCH,
+    MAX_BATCH
+)
 
 class Ping:
-    def __init__(self, target_host: str, count: int = None, wait: int = 1, debug: bool = False):
+    def __init__(self, target_host: str, count: int = None, wait: int = 1, debug: bool = False,
+                 pipelined: bool = False, kernel_timestamps: bool = False, timeout: float = TIMEOUT,
+                 adaptive_timeout: bool = False, min_timeout: float = RTO_MIN, max_timeout: float = RTO_MAX,
+                 socket_filter: bool = True, transport=DEFAULT_TRANSPORT, output=DEFAULT_OUTPUT,
+                 flood: bool = False, payload: bytes = DEFAULT_PATTERN, profiler: StageProfiler = None,
+                 batch_size: int = DEFAULT_BATCH):
         self.__target_host = target_host
         self.__count = count
         self.__wait = wait
         self.__debug = debug
+        self.__pipelined = pipelined
+        self.__kernel_timestamps = kernel_timestamps
+        self.__timeout = timeout
+        self.__adaptive_timeout = adaptive_timeout
+        self.__min_timeout = min_timeout
+        self.__max_timeout = max_timeout
+        self.__socket_filter = socket_filter
+        self.__transport = transport
+        self.__output = output
+        self.__payload = payload
+        self.__profiler = profiler
+        self.__batch_size = batch_size
+        self.__pacer = Pacer(wait, flood)
+        self.__filter_report = None
         self.__statistics = Statistics()
         self.__running = True
         signal.signal(signal.SIGINT, self.__signal_handler)
 
+    def get_statistics(self) -> Statistics:
+        return self.__statistics
+
     def __signal_handler(self, signum, frame):
         self.__running = False
 
+    def __send_ping_pipelined(self, target_ip: str):
+        # One socket for the whole run: probes go out on schedule regardless of
+        # outstanding replies, and the time in between is spent receiving.
+        identifier = os.getpid() & 0xFFFF
+        resolver = get_default_resolver()
+        with ProbeSession(identifier, self.__timeout, debug=self.__debug, kernelTimestamps=self.__kernel_timestamps,
+                          adaptiveTimeout=self.__adaptive_timeout, minTimeout=self.__min_timeout,
+                          maxTimeout=self.__max_timeout, socketFilter=self.__socket_filter,
+                          transport=self.__transport, output=self.__output, payload=self.__payload,
+                          profiler=self.__profiler, batchSize=self.__batch_size) as session:
+            self.__statistics.set_clock_source(session.get_clock_source())
+            i = 0
+            try:
+                while self.__running:
+                    sending = self.__count is None or i < self.__count
+                    if not sending and session.get_in_flight_count() == 0:
+                        break
+
+                    now = time.monotonic()
+                    if sending and self.__pacer.is_due(now, session.get_in_flight_count()):
+                        # Never blocks: a stale address is refreshed in the background
+                        target_ip = resolver.get_cached(self.__target_host) or target_ip
+                        # Every probe already due goes out together, up to one batch
+                        probes = []
+                        while (sending and len(probes) < self.__batch_size
+                               and self.__pacer.is_due(now, session.get_in_flight_count() + len(probes))):
+                            probes.append((target_ip, i, self.__statistics))
+                            self.__pacer.record_send(now)
+                            i += 1
+                            sending = self.__count is None or i < self.__count
+                        for icmp_packet in session.send_probes(probes):
+                            if self.__debug:
+                                icmp_packet.print_icmp_packet_hex()
+                        if len(probes) == self.__batch_size > 1:
+                            # Saturated: drain the replies between batches before the receive buffer overflows
+                            session.receive_pending()
+                        continue
+
+                    next_send = self.__pacer.get_next_due(session.get_in_flight_count())
+                    wake_times = [next_send] if sending and next_send is not None else []
+                    next_deadline = session.next_deadline()
+                    if next_deadline is not None:
+                        wake_times.append(next_deadline)
+                    next_flush = self.__output.next_flush()
+                    if next_flush is not None:
+                        wake_times.append(next_flush)
+                    session.wait_for_replies(max(0.0, min(wake_times) - time.monotonic()) if wake_times else 0.0)
+                    now = time.monotonic()
+                    session.expire_probes(now)
+                    self.__output.flush_if_due(now)
+            finally:
+                session.abandon_probes()
+                self.__filter_report = session.get_filter_report()
+
+    def __send_ping_sequential(self):
+        i = 0
+        identifier = os.getpid() & 0xFFFF
+        template = EchoRequestTemplate(identifier, self.__payload, self.__profiler)
+        profiler = self.__profiler
+        sequence_window = SequenceWindow()
+        while self.__running:
+            if self.__count is not None and i >= self.__count:
+                break
+            # Create new IcmpPacket instance for each probe to avoid stale internal state
+            # Since a new socket is created for each send/receive operation, 
+            # there's no benefit in reusing the IcmpPacket instance
+            if profiler is not None:
+                profiler.start()
+            icmp_packet = IcmpPacket(self.__statistics, self.__debug)
+            sequence_number = i & 0xFFFF  # 16-bit field; wraps around on long runs
+            icmp_packet.build_echo_request_packet(identifier, sequence_number, template)
+            if profiler is not None:
+                profiler.lap(BUILD)
+            icmp_packet.set_icmp_target(self.__target_host)
+            icmp_packet.set_kernel_timestamps(self.__kernel_timestamps)
+            icmp_packet.set_ip_timeout(self.__timeout)
+            icmp_packet.set_transport(self.__transport)
+            icmp_packet.set_socket_filter(self.__socket_filter)
+            icmp_packet.set_sequence_window(sequence_window)
+            icmp_packet.set_output(self.__output)
+            icmp_packet.set_profiler(profiler)
+            # The probe is due now; the next one is scheduled from this deadline, not from when the reply came
+            self.__pacer.record_send(time.monotonic())
+            icmp_packet.send_echo_request()
+            self.__output.flush_if_due(time.monotonic())
+
+            if self.__debug:
+                icmp_packet.print_icmp_packet_hex()
+
+            i += 1
+            next_send = self.__pacer.get_next_due()
+            if next_send is not None and (self.__count is None or i < self.__count):
+                time.sleep(max(0.0, next_send - time.monotonic()))
+
     def send_ping(self):
         try:
-            i = 0
-            target_ip = gethostbyname(self.__target_host)
-            print(f"\nPING {self.__target_host} ({target_ip}): {ICMP_HEADER_SIZE + len(RAW_DATA)} data bytes")
-
-            while self.__running:
-                if self.__count is not None and i >= self.__count:
-                    break
-                # Create new IcmpPacket instance for each probe to avoid stale internal state
-                # Since a new socket is created for each send/receive operation, 
-                # there's no benefit in reusing the IcmpPacket instance
-                icmp_packet = IcmpPacket(self.__statistics, self.__debug)
-                identifier = os.getpid() & 0xFFFF
-                sequence_number = i
-                icmp_packet.build_echo_request_packet(identifier, sequence_number)
-                icmp_packet.set_icmp_target(self.__target_host)
-                icmp_packet.send_echo_request()
-
-                if self.__debug:
-                    icmp_packet.print_icmp_packet_hex()
-
-                time.sleep(self.__wait)
-                i += 1
+            target_ip = get_default_resolver().resolve(self.__target_host)
+            self.__output.message(
+                f"\nPING {self.__target_host} ({target_ip}): {TIMESTAMP_SIZE + len(self.__payload)} data bytes"
+            )
+
+            if self.__pipelined:
+                self.__send_ping_pipelined(target_ip)
+            else:
+                self.__send_ping_sequential()
 
         except KeyboardInterrupt:
             pass
         except gaierror:
-            print(f" [ping] Unknown host {self.__target_host}. Exiting...")
+            self.__output.message(f" [ping] Unknown host {self.__target_host}. Exiting...")
+            sys.exit(1)
+        except IdentifierInUseError as e:
+            self.__output.message(f" [ping] {e.strerror}. Exiting...")
             sys.exit(1)
         finally:
-            print()
-            print(f"--- {self.__target_host} ping statistics ---")
-            self.__statistics.print_statistics()
+            self.__output.summary(self.__target_host, self.__statistics)
+            if self.__filter_report is not None:
+                self.__output.message(self.__filter_report)
+            if self.__pacer.get_sent() > 1:
+                self.__output.message(self.__pacer.get_report())
+            if self.__profiler is not None:
+                self.__output.message(self.__profiler.get_report())
+            self.__output.close()
             sys.exit(0)
 
 def create_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument(
-        "host", type=str, help="Target host to ping."
+        "host", type=str, nargs="*", help="Target host(s) to ping."
     )
     parser.add_argument(
-        "-c", "--count", type=int, default=None, help="Number of ping requests to send."
+        "-f", "--file", type=str, default=None, help="Read additional target hosts from a file, one per line."
     )
     parser.add_argument(
-        "-i", "--interval", type=int, default=1, help="Time interval in seconds between each ping request (default: 1)."
+        "-c", "--count", type=int, default=None, help="Number of ping requests to send."
+    )
+    pacing = parser.add_mutually_exclusive_group()
+    pacing.add_argument(
+        "-i", "--interval", type=float, default=1.0,
+        help="Seconds between two probes to each target, fractions allowed; 0 sends back to back (default: 1)."
+    )
+    pacing.add_argument(
+        "--rate", type=float, default=None, metavar="PPS",
+        help="Send this many probes per second in total, spread evenly over the targets."
+    )
+    pacing.add_argument(
+        "--flood", action="store_true",
+        help="Send the next probe as soon as the last one is answered, or after 10 ms at the latest."
     )
     parser.add_argument(
         "-d", "--debug", action="store_true", help="Enable debug mode for detailed output."
     )
+    parser.add_argument(
+        "-P", "--pipelined", action="store_true",
+        help="Keep one socket open and send on schedule without waiting for each reply."
+    )
+    parser.add_argument(
+        "-k", "--kernel-timestamps", action="store_true",
+        help="Measure receive times with kernel timestamps (SO_TIMESTAMPNS) where supported."
+    )
+    parser.add_argument(
+        "-W", "--timeout", type=float, default=None,
+        help=f"Seconds to wait for each reply (default: {TIMEOUT}, {TRACEROUTE_TIMEOUT} with --traceroute)."
+    )
+    parser.add_argument(
+        "-A", "--adaptive-timeout", action="store_true",
+        help="Derive each target's timeout from its smoothed RTT and RTT variance (RFC 6298). "
+             "Applies to pipelined and multi-target runs."
+    )
+    parser.add_argument(
+        "--min-timeout", type=float, default=RTO_MIN,
+        help=f"Floor of the adaptive timeout in seconds (default: {RTO_MIN})."
+    )
+    parser.add_argument(
+        "--max-timeout", type=float, default=RTO_MAX,
+        help=f"Ceiling of the adaptive timeout in seconds (default: {RTO_MAX})."
+    )
+    parser.add_argument(
+        "--no-filter", dest="socket_filter", action="store_false",
+        help="Do not attach a BPF filter to the socket; receive every ICMP packet the host gets."
+    )
+    parser.add_argument(
+        "-q", "--quiet", action="store_true",
+        help="Only report the summary at the end, not every probe."
+    )
+    parser.add_argument(
+        "--format", choices=FORMATS, default="text",
+        help="text: human-readable lines; jsonl, csv: one record per probe and a summary record per target; "
+             "binary: compact fixed-size records (default: text). Records are buffered and written in batches."
+    )
+    parser.add_argument(
+        "--record", type=str, default=None, metavar="DIR",
+        help="Also append every probe to a binary probe log in DIR; query it with `ping.py replay DIR`."
+    )
+    parser.add_argument(
+        "--profile", action="store_true",
+        help="Time every stage of each probe (build, checksum, sendto, wait, recv, parse, validate, output, stats) "
+             "and print the breakdown at the end; the daemon serves it on /metrics."
+    )
+    parser.add_argument(
+        "--batch", type=int, default=DEFAULT_BATCH, metavar="N",
+        help=f"Send up to N due probes with one sendmmsg call and read up to N replies with one recvmmsg call, "
+             f"1 to {MAX_BATCH}, for pipelined, multi-target and daemon runs (default: {DEFAULT_BATCH}). Falls back "
+             "to one call per packet where the calls are missing, with -k and with the simulated transport."
+    )
+    parser.add_argument(
+        "-s", "--size", type=int, default=None,
+        help=f"ICMP data bytes of every probe, the 8-byte send timestamp included, up to {MAX_DATA_SIZE} "
+             f"(default: {DEFAULT_DATA_SIZE})."
+    )
+    parser.add_argument(
+        "-p", "--pattern", type=str, default=None,
+        help=f"Fill the payload with up to {MAX_PATTERN_SIZE} bytes given in hex, e.g. ff00 or de:ad:be:ef, repeated "
+             "(default: ASCII letters). Replies are checked byte for byte."
+    )
+    parser.add_argument(
+        "--pmtu", action="store_true",
+        help="Find the path MTU to each host: probe several sizes at once with the don't-fragment bit set."
+    )
+    parser.add_argument(
+        "-T", "--traceroute", action="store_true",
+        help="Map the path to each host, probing every TTL at once."
+    )
+    parser.add_argument(
+        "-m", "--max-hops", type=int, default=TRACEROUTE_MAX_HOPS,
+        help=f"Highest TTL probed with --traceroute, 1 to 255 (default: {TRACEROUTE_MAX_HOPS})."
+    )
+    parser.add_argument(
+        "--hop-probes", type=int, default=TRACEROUTE_PROBES,
+        help=f"Probes sent with each TTL with --traceroute (default: {TRACEROUTE_PROBES})."
+    )
+    parser.add_argument(
+        "--transport", choices=TRANSPORTS, default=None,
+        help="raw: raw ICMP socket (root); datagram: unprivileged ICMP socket (replies only, no ICMP errors); "
+             "simulated: in-process network, see --simulate (default: raw)."
+    )
+    parser.add_argument(
+        "--simulate", type=str, default=None, metavar="SPEC",
+        help="Probe a simulated network instead, e.g. \"latency=normal:20:5,loss=0.01,duplicate=0.001,"
+             "reorder=0.05,error=0.001,hops=8,mtu=1400,blackhole=0,seed=1\". Implies --transport simulated."
+    )
+    parser.add_argument(
+        "--daemon", action="store_true",
+        help="Probe the targets forever and serve rolling 1/5/15-minute statistics on /metrics (Prometheus). "
+             "SIGHUP reads -f FILE again."
+    )
+    parser.add_argument(
+        "--listen", type=str, default=f"127.0.0.1:{DAEMON_PORT}", metavar="ADDRESS:PORT",
+        help=f"Where the daemon serves /metrics (default: 127.0.0.1:{DAEMON_PORT})."
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="Shard multi-target runs across this many processes, each with its own socket (default: 1)."
+    )
+    return parser
+
+def create_replay_parser():
+    parser = argparse.ArgumentParser(prog="ping.py replay", description="Summarize a probe log written with --record.")
+    parser.add_argument(
+        "directory", type=str, help="Probe log directory."
+    )
+    parser.add_argument(
+        "-t", "--target", type=str, action="append", default=None, help="Only this target address (repeatable)."
+    )
+    parser.add_argument(
+        "--since", type=str, default=None, help="Start time, UNIX seconds or ISO 8601 (e.g. 2024-05-01T12:00)."
+    )
+    parser.add_argument(
+        "--until", type=str, default=None, help="End time (exclusive), UNIX seconds or ISO 8601."
+    )
+    parser.add_argument(
+        "--window", type=float, default=None, metavar="SECONDS",
+        help="Report loss and RTT per target and time window of this length instead of one summary per target."
+    )
     return parser
 
-def ping(target_host: str, count: int = None, wait: int = 1, debug: bool = False):
-    ping = Ping(target_host, count, wait, debug)
+def open_output(output_format: str = "text", quiet: bool = False, record: str = None):
+    output = create_output(output_format, quiet)
+    return RecordingOutput(output, ProbeLog(record)) if record is not None else output
+
+def ping(target_host: str, count: int = None, wait: float = 1, debug: bool = False, pipelined: bool = False,
+         kernel_timestamps: bool = False, timeout: float = TIMEOUT, adaptive_timeout: bool = False,
+         min_timeout: float = RTO_MIN, max_timeout: float = RTO_MAX, socket_filter: bool = True,
+         transport=DEFAULT_TRANSPORT, output_format: str = "text", quiet: bool = False, record: str = None,
+         rate: float = None, flood: bool = False, payload: bytes = DEFAULT_PATTERN, profile: bool = False,
+         batch_size: int = DEFAULT_BATCH):
+    ping = Ping(target_host, count, 1 / rate if rate else wait, debug, pipelined, kernel_timestamps, timeout,
+                adaptive_timeout, min_timeout, max_timeout, socket_filter, transport,
+                open_output(output_format, quiet, record), flood, payload, StageProfiler() if profile else None,
+                batch_size)
     ping.send_ping()
 
+def multi_ping(target_hosts: list, count: int = None, wait: float = 1, debug: bool = False,
+               kernel_timestamps: bool = False, timeout: float = TIMEOUT, adaptive_timeout: bool = False,
+               min_timeout: float = RTO_MIN, max_timeout: float = RTO_MAX, workers: int = 1,
+               socket_filter: bool = True, transport=DEFAULT_TRANSPORT, output_format: str = "text",
+               quiet: bool = False, record: str = None, rate: float = None, flood: bool = False,
+               payload: bytes = DEFAULT_PATTERN, profile: bool = False, batch_size: int = DEFAULT_BATCH):
+    output = open_output(output_format, quiet, record)
+    output.message(f"\nPING {len(target_hosts)} targets: {TIMESTAMP_SIZE + len(payload)} data bytes")
+    if workers > 1:
+        multi_ping = Sweep(target_hosts, workers, output, count=count, wait=wait, debug=debug, timeout=timeout,
+                           kernel_timestamps=kernel_timestamps, adaptive_timeout=adaptive_timeout,
+                           min_timeout=min_timeout, max_timeout=max_timeout, socket_filter=socket_filter,
+                           transport=transport, rate=rate, flood=flood, payload=payload, batch_size=batch_size)
+    else:
+        multi_ping = MultiPing(target_hosts, count, wait, debug, timeout, kernel_timestamps, adaptive_timeout,
+                               min_timeout, max_timeout, socket_filter=socket_filter, transport=transport,
+                               output=output, rate=rate, flood=flood, payload=payload,
+                               profiler=StageProfiler() if profile else None, batch_size=batch_size)
+    try:
+        if workers > 1:
+            multi_ping.run()
+        else:
+            asyncio.run(multi_ping.run())
+    except PermissionError:
+        output.message("Permission denied: You need to run this script with root privilege.")
+        sys.exit(1)
+    except IdentifierInUseError as e:
+        output.message(f" [ping] {e.strerror}.")
+        sys.exit(1)
+    finally:
+        multi_ping.print_statistics()
+        output.close()
+    sys.exit(0)
+
+def traceroute(target_hosts: list, max_hops: int = TRACEROUTE_MAX_HOPS, probes_per_hop: int = TRACEROUTE_PROBES,
+               timeout: float = TRACEROUTE_TIMEOUT, debug: bool = False, socket_filter: bool = True,
+               transport=DEFAULT_TRANSPORT):
+    traceroute = Traceroute(target_hosts, max_hops, probes_per_hop, timeout, debug=debug, socketFilter=socket_filter,
+                            transport=transport)
+    try:
+        traceroute.run()
+    except PermissionError:
+        print("Permission denied: You need to run this script with root privilege.")
+        sys.exit(1)
+    except IdentifierInUseError as e:
+        print(f" [ping] {e.strerror}.")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+    traceroute.print_results()
+    sys.exit(0)
+
+def path_mtu(target_hosts: list, timeout: float = PMTU_TIMEOUT, debug: bool = False, socket_filter: bool = True,
+             transport=DEFAULT_TRANSPORT, pattern: bytes = DEFAULT_PATTERN):
+    discovery = PathMtuDiscovery(target_hosts, timeout, debug=debug, socketFilter=socket_filter, transport=transport,
+                                 pattern=pattern)
+    try:
+        discovery.run()
+    except PermissionError:
+        print("Permission denied: You need to run this script with root privilege.")
+        sys.exit(1)
+    except IdentifierInUseError as e:
+        print(f" [ping] {e.strerror}.")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+    discovery.print_results()
+    sys.exit(0)
+
+def daemon(target_hosts: list, targets_file: str = None, wait: float = 1, listen: str = f"127.0.0.1:{DAEMON_PORT}",
+           debug: bool = False, kernel_timestamps: bool = False, timeout: float = TIMEOUT,
+           adaptive_timeout: bool = False, min_timeout: float = RTO_MIN, max_timeout: float = RTO_MAX,
+           socket_filter: bool = True, transport=DEFAULT_TRANSPORT, output_format: str = "text", quiet: bool = True,
+           record: str = None, payload: bytes = DEFAULT_PATTERN, profile: bool = False,
+           batch_size: int = DEFAULT_BATCH):
+    address, _, port = listen.rpartition(":")
+    ping_daemon = PingDaemon(target_hosts, targets_file, wait, address or "127.0.0.1", int(port), debug, timeout,
+                             kernel_timestamps, adaptive_timeout, min_timeout, max_timeout,
+                             socket_filter=socket_filter, transport=transport,
+                             output=open_output(output_format, quiet, record), payload=payload,
+                             profiler=StageProfiler() if profile else None, batch_size=batch_size)
+    try:
+        asyncio.run(ping_daemon.run())
+    except PermissionError:
+        print("Permission denied: You need to run this script with root privilege.")
+        sys.exit(1)
+    except IdentifierInUseError as e:
+        print(f" [ping] {e.strerror}.")
+        sys.exit(1)
+    except OSError as e:
+        print(f" [ping] Cannot serve metrics on {listen}: {e.strerror}")
+        sys.exit(1)
+    sys.exit(0)
+
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["replay"]:
+        replay_parser = create_replay_parser()
+        replay_args = replay_parser.parse_args(sys.argv[2:])
+        try:
+            replay(replay_args.directory, replay_args.target, replay_args.since, replay_args.until, replay_args.window)
+        except (OSError, ValueError) as e:
+            replay_parser.error(str(e))
+        sys.exit(0)
     parser = create_parser()
     args = parser.parse_args(sys.argv[1:])
-    ping(args.host, args.count, args.interval, args.debug)
\ No newline at end of file
+    hosts = args.host + (read_targets_file(args.file) if args.file else [])
+    if not hosts and not (args.daemon and args.file):
+        parser.error("at least one host (or -f FILE) is required")
+    try:
+        transport_name = args.transport or ("simulated" if args.simulate is not None else "raw")
+        transport = get_transport(transport_name, args.simulate)
+    except ValueError as e:
+        parser.error(str(e))
+    if (args.traceroute or args.pmtu) and (args.quiet or args.format != "text"):
+        parser.error("-q and --format apply to ping runs, not --traceroute or --pmtu")
+    if args.traceroute and args.pmtu:
+        parser.error("--traceroute and --pmtu are separate modes")
+    if not 1 <= args.max_hops <= 255 or args.hop_probes < 1:
+        parser.error("-m must be between 1 and 255 and --hop-probes at least 1")
+    if args.max_hops * args.hop_probes > 65536:
+        # Each probe's sequence number encodes its TTL and round, and must fit in 16 bits
+        parser.error("-m times --hop-probes must be at most 65536")
+    try:
+        pattern = parse_pattern(args.pattern) if args.pattern is not None else DEFAULT_PATTERN
+        payload = make_payload(args.size if args.size is not None else DEFAULT_DATA_SIZE, pattern)
+    except ValueError as e:
+        parser.error(str(e))
+    if (args.size is not None or args.pattern is not None) and args.traceroute:
+        parser.error("-s and -p apply to ping runs and --pmtu, not --traceroute")
+    if args.pmtu and (args.size is not None or args.daemon or args.workers > 1 or args.record is not None):
+        parser.error("--pmtu picks the sizes itself and runs once, without -s, --daemon, --workers or --record")
+    if args.interval < 0 or (args.rate is not None and args.rate <= 0):
+        parser.error("-i must be at least 0 and --rate greater than 0")
+    if (args.rate is not None or args.flood) and (args.traceroute or args.pmtu or args.daemon):
+        parser.error("--rate and --flood apply to ping runs, not --traceroute, --pmtu or --daemon")
+    if args.profile and (args.traceroute or args.pmtu or args.workers > 1):
+        parser.error("--profile applies to ping runs in one process, not --traceroute, --pmtu or --workers")
+    if not 1 <= args.batch <= MAX_BATCH:
+        parser.error(f"--batch must be between 1 and {MAX_BATCH}")
+    if args.batch > 1 and (args.traceroute or args.pmtu or (len(hosts) == 1 and not args.file and not args.pipelined
+                                                            and not args.daemon)):
+        parser.error("--batch applies to pipelined (-P), multi-target and daemon runs, not --traceroute or --pmtu")
+    if args.record is not None and (args.traceroute or args.workers > 1):
+        parser.error("--record needs a single process and applies to ping runs, not --traceroute or --workers")
+    if args.traceroute:
+        traceroute(hosts, args.max_hops, args.hop_probes,
+                   args.timeout if args.timeout is not None else TRACEROUTE_TIMEOUT, args.debug, args.socket_filter,
+                   transport)
+    if args.pmtu:
+        path_mtu(hosts, args.timeout if args.timeout is not None else PMTU_TIMEOUT, args.debug, args.socket_filter,
+                 transport, pattern)
+    if args.timeout is None:
+        args.timeout = TIMEOUT
+    if args.daemon:
+        if not args.listen.rpartition(":")[2].isdigit():
+            parser.error("--listen must be ADDRESS:PORT")
+        # Probes are only printed one by one when asked for records; text lines would pile up forever
+        daemon(args.host, args.file, args.interval, args.listen, args.debug, args.kernel_timestamps, args.timeout,
+               args.adaptive_timeout, args.min_timeout, args.max_timeout, args.socket_filter, transport, args.format,
+               args.quiet or args.format == "text", args.record, payload, args.profile, args.batch)
+    if len(hosts) > 1 or args.file:
+        multi_ping(hosts, args.count, args.interval, args.debug, args.kernel_timestamps, args.timeout,
+                   args.adaptive_timeout, args.min_timeout, args.max_timeout, args.workers, args.socket_filter,
+                   transport, args.format, args.quiet, args.record, args.rate, args.flood, payload, args.profile,
+                   args.batch)
+    else:
+        ping(hosts[0], args.count, args.interval, args.debug, args.pipelined, args.kernel_timestamps, args.timeout,
+             args.adaptive_timeout, args.min_timeout, args.max_timeout, args.socket_filter, transport, args.format,
+             args.quiet, args.record, args.rate, args.flood, payload, args.profile, args.batch)
\ No newline at end of file
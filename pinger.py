@@ -0,0 +1,384 @@
+# ############################################################################################################ #
+# Pinger is the library interface: one long-lived socket shared by any number of checks, results streamed as   #
+# they happen. It never prints, exits or installs signal handlers; everything is reported through ProbeResult  #
+# objects and Statistics snapshots. Runs started from several generators or coroutines share the socket and    #
+# each only sees the results of its own probes.                                                                #
+#                                                                                                              #
+#   with Pinger(timeout=1) as pinger:                  async with Pinger(timeout=1) as pinger:                 #
+#       for result in pinger.ping("example.com", 3):       async for result in pinger.ping_async(hosts):       #
+#           print(result)                                      ...                                             #
+#       statistics = pinger.check(hosts)               statistics = await pinger.check_async("example.com")    #
+# ############################################################################################################ #
+
+import asyncio
+import itertools
+import os
+import time
+from collections import deque
+from socket import gaierror
+from statistics import Statistics
+from probe_session import ProbeSession
+from resolver import get_default_resolver
+from transport import DEFAULT_TRANSPORT
+from probe_output import REPLY, TIMEOUT, ERROR, DUPLICATE, LATE
+from packet_template import DEFAULT_PATTERN
+from constants import TIMEOUT as DEFAULT_TIMEOUT, RTO_MIN, RTO_MAX, DEFAULT_BATCH
+
+_instances = itertools.count()  # Gives every Pinger of a process its own default ICMP identifier
+MAX_BURST = 64                  # Probes sent per wake-up before settled results are handed out
+
+class ProbeResult:
+    """What became of one probe: kind is "reply", "timeout", "error", "duplicate" or "late" (probe_output)."""
+    __slots__ = ("kind", "target", "address", "sequenceNumber", "rtt", "source", "size", "ttl", "icmpType",
+                 "icmpCode", "valid", "message")
+
+    def __init__(self, kind: str, target: str, address: str, sequenceNumber: int, rtt: float = None,
+                 source: str = None, size: int = 0, ttl: int = 0, icmpType: int = None, icmpCode: int = None,
+                 valid: bool = True, message: str = None):
+        self.kind: str = kind
+        self.target: str = target                 # Host as passed to the Pinger
+        self.address: str = address               # IPv4 address it was probed at
+        self.sequenceNumber: int = sequenceNumber
+        self.rtt: float = rtt                     # ms, replies only
+        self.source: str = source                 # Address the reply or ICMP error came from
+        self.size: int = size                     # ICMP bytes received
+        self.ttl: int = ttl                       # IP TTL of the reply
+        self.icmpType: int = icmpType             # ICMP errors only
+        self.icmpCode: int = icmpCode
+        self.valid: bool = valid                  # The reply echoed our payload unchanged
+        self.message: str = message               # Description of an error
+
+    def __repr__(self) -> str:
+        details = f", rtt={self.rtt:.3f}" if self.rtt is not None else ""
+        if self.message is not None:
+            details += f", message={self.message!r}"
+        return f"ProbeResult({self.kind}, {self.target} ({self.address}), seq={self.sequenceNumber}{details})"
+
+
+class PingRun:
+    """Bookkeeping of one ping()/ping_async() call."""
+    __slots__ = ("targets", "hosts", "statistics", "results", "total", "sent", "pending", "spacing", "startedAt",
+                 "event")
+
+    def __init__(self, targets: list, count: int, interval: float):
+        self.targets: list = targets                                  # (host, address) in sending order
+        self.hosts: dict = {address: host for host, address in targets}
+        self.statistics: dict = {host: Statistics() for host, _ in targets}
+        self.results: deque = deque()                                 # Settled, not yet yielded
+        self.total: int = count * len(targets) if count is not None else None  # None for unlimited
+        self.sent: int = 0
+        self.pending: int = 0                                         # Probes in flight
+        self.spacing: float = interval / len(targets)                 # Probes spread evenly over one interval
+        self.startedAt: float = time.monotonic()
+        self.event = None                                             # asyncio.Event set on new results
+
+    def is_done(self) -> bool:
+        return self.sent == self.total and self.pending == 0 and not self.results
+
+    def add_result(self, result: ProbeResult):
+        self.results.append(result)
+        if self.event is not None:
+            self.event.set()
+
+
+class ResultRouter:
+    """A probe output that turns the session's reports into ProbeResults for the run that sent each probe."""
+    name = "results"
+    quiet = True
+
+    def __init__(self):
+        self.routes: dict = {}        # (address, sequence number) -> PingRun, while the probe is in flight
+        self.lastRuns: dict = {}      # Address -> PingRun that probed it last, for duplicate and late replies
+        self.lastMessage: str = None  # The session's last message, e.g. why a send failed
+
+    def reply(self, target: str, source: str, sequenceNumber: int, size: int, ttl: int, rtt: float,
+              valid: bool = True, sentAt: int = None):
+        run = self.__settle(target, sequenceNumber)
+        if run is not None:
+            run.add_result(ProbeResult(REPLY, run.hosts[target], target, sequenceNumber, rtt, source, size, ttl,
+                                       valid=valid))
+
+    def timeout(self, target: str, sequenceNumber: int, sentAt: int = None):
+        run = self.__settle(target, sequenceNumber)
+        if run is not None:
+            run.add_result(ProbeResult(TIMEOUT, run.hosts[target], target, sequenceNumber))
+
+    def error(self, target: str, sequenceNumber: int, source: str, icmpType: int, icmpCode: int, message: str,
+              sentAt: int = None):
+        run = self.__settle(target, sequenceNumber)
+        if run is not None:
+            run.add_result(ProbeResult(ERROR, run.hosts[target], target, sequenceNumber, source=source,
+                                       icmpType=icmpType, icmpCode=icmpCode, message=message))
+
+    def duplicate(self, target: str, source: str, sequenceNumber: int, size: int, ttl: int):
+        self.__unsolicited(DUPLICATE, target, source, sequenceNumber, size, ttl)
+
+    def late(self, target: str, source: str, sequenceNumber: int, size: int, ttl: int):
+        self.__unsolicited(LATE, target, source, sequenceNumber, size, ttl)
+
+    def message(self, text: str):
+        self.lastMessage = text
+
+    def summary(self, host: str, statistics, heading: str = None):
+        pass
+
+    def next_flush(self) -> float:
+        return None
+
+    def flush_if_due(self, now: float):
+        pass
+
+    def close(self):
+        pass
+
+    def __settle(self, target: str, sequenceNumber: int) -> PingRun:
+        run = self.routes.pop((target, sequenceNumber), None)
+        if run is not None:
+            run.pending -= 1
+        return run
+
+    def __unsolicited(self, kind: str, target: str, source: str, sequenceNumber: int, size: int, ttl: int):
+        # Only reported while the run that probed the target is still going
+        run = self.lastRuns.get(target)
+        if run is not None:
+            run.add_result(ProbeResult(kind, run.hosts[target], target, sequenceNumber, source=source, size=size,
+                                       ttl=ttl))
+
+
+class Pinger:
+    """Keeps one socket open between open() and close() (or a with/async with block) for any number of runs.
+
+    By default every Pinger gets its own ICMP identifier, so several can coexist in one process.
+    With batchSize > 1 replies are drained with recvmmsg; probes still go out one by one, so every send error
+    reaches its own run.
+    """
+    def __init__(self, timeout: float = DEFAULT_TIMEOUT, identifier: int = None, kernelTimestamps: bool = False,
+                 adaptiveTimeout: bool = False, minTimeout: float = RTO_MIN, maxTimeout: float = RTO_MAX,
+                 socketFilter: bool = True, transport=DEFAULT_TRANSPORT, payload: bytes = DEFAULT_PATTERN,
+                 profiler=None, batchSize: int = DEFAULT_BATCH):
+        if identifier is None:
+            identifier = (os.getpid() + next(_instances)) & 0xFFFF
+        self.__router: ResultRouter = ResultRouter()
+        self.__session: ProbeSession = ProbeSession(
+            identifier, timeout, kernelTimestamps=kernelTimestamps, adaptiveTimeout=adaptiveTimeout,
+            minTimeout=minTimeout, maxTimeout=maxTimeout, socketFilter=socketFilter, transport=transport,
+            output=self.__router, payload=payload, profiler=profiler, batchSize=batchSize
+        )
+        self.__open: bool = False
+        self.__sequenceNumbers: dict = {}    # Address -> next sequence number
+        self.__statistics: dict = {}         # Host -> Statistics of every finished run
+        self.__readers: int = 0              # Async runs using the event loop's reader on the socket
+
+    def __enter__(self) -> 'Pinger':
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    async def __aenter__(self) -> 'Pinger':
+        self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # ############################################################
+    # Getters                                                    #
+    # ############################################################
+    def get_identifier(self) -> int:
+        return self.__session.get_identifier()
+
+    def get_statistics(self, target: str = None):
+        """Returns a snapshot of the Statistics of every finished run to `target`, or host -> Statistics."""
+        if target is None:
+            return {host: self.__snapshot(statistics) for host, statistics in self.__statistics.items()}
+        return self.__snapshot(self.__statistics.get(target, Statistics()))
+
+    # ############################################################
+    # Public Functions                                           #
+    # ############################################################
+    def open(self):
+        """Opens the socket. Raises PermissionError when the transport needs privileges the process lacks."""
+        if not self.__open:
+            self.__session.open()
+            self.__open = True
+
+    def close(self):
+        if self.__open:
+            self.__session.abandon_probes()
+            self.__session.close()
+            self.__open = False
+
+    def ping(self, targets, count: int = 1, interval: float = 0.0):
+        """Probes `targets` (a host or a list of hosts) `count` times each, None for unlimited, and returns an
+        iterator that yields a ProbeResult as each probe settles. Probes go out `interval` seconds apart per target.
+
+        Raises socket.gaierror when a host can not be resolved, ValueError when two hosts share an address.
+        """
+        return self.__results(self.__start_run(self.__resolve(targets), count, interval))
+
+    async def ping_async(self, targets, count: int = 1, interval: float = 0.0):
+        """Asyncio version of ping(); any number of them can run concurrently on the same Pinger."""
+        run = await self.__start_run_async(targets, count, interval)
+        async for result in self.__results_async(run):
+            yield result
+
+    def check(self, targets, count: int = 1, interval: float = 0.0):
+        """Runs ping() to the end. Returns its Statistics for one host, or host -> Statistics for a list."""
+        run = self.__start_run(self.__resolve(targets), count, interval)
+        for _ in self.__results(run):
+            pass
+        return self.__run_statistics(run, targets)
+
+    async def check_async(self, targets, count: int = 1, interval: float = 0.0):
+        """Asyncio version of check()."""
+        run = await self.__start_run_async(targets, count, interval)
+        async for _ in self.__results_async(run):
+            pass
+        return self.__run_statistics(run, targets)
+
+    # ############################################################
+    # Private Functions                                          #
+    # ############################################################
+    def __resolve(self, targets) -> list:
+        hosts = [targets] if isinstance(targets, str) else list(targets)
+        resolver = get_default_resolver()
+        # Cached addresses never block; the rest are looked up concurrently
+        addresses = {host: resolver.get_cached(host) for host in hosts}
+        missing = [host for host, address in addresses.items() if address is None]
+        if missing:
+            addresses.update(resolver.resolve_many(missing))
+        return self.__targets_of(hosts, addresses)
+
+    def __targets_of(self, hosts: list, addresses: dict) -> list:
+        targets = []
+        for host in dict.fromkeys(hosts):
+            address = addresses.get(host)
+            if address is None:
+                raise gaierror(f"Unknown host {host}")
+            # Replies are matched on their source address, so each address may only be probed once per run
+            if any(address == other for _, other in targets):
+                raise ValueError(f"{host} ({address}) is already a target of this run")
+            targets.append((host, address))
+        if not targets:
+            raise ValueError("No targets given")
+        return targets
+
+    async def __start_run_async(self, targets, count: int, interval: float) -> PingRun:
+        hosts = [targets] if isinstance(targets, str) else list(targets)
+        resolver = get_default_resolver()
+        addresses = {host: resolver.get_cached(host) for host in hosts}
+        missing = [host for host, address in addresses.items() if address is None]
+        if missing:
+            addresses.update(await resolver.resolve_many_async(missing))
+        run = self.__start_run(self.__targets_of(hosts, addresses), count, interval)
+        run.event = asyncio.Event()
+        return run
+
+    def __start_run(self, targets: list, count: int, interval: float) -> PingRun:
+        if not self.__open:
+            raise RuntimeError("The Pinger is not open; use it in a with block or call open() first")
+        run = PingRun(targets, count, interval)
+        clock_source = self.__session.get_clock_source()
+        for statistics in run.statistics.values():
+            statistics.set_clock_source(clock_source)
+        return run
+
+    def __results(self, run: PingRun):
+        session = self.__session
+        try:
+            while True:
+                now = time.monotonic()
+                next_send = self.__send_due(run, now)
+                session.expire_probes(now)
+                while run.results:
+                    yield run.results.popleft()
+                if run.is_done():
+                    return
+                session.wait_for_replies(self.__wait_time(next_send))
+        finally:
+            self.__finish_run(run)
+
+    async def __results_async(self, run: PingRun):
+        loop = asyncio.get_running_loop()
+        session = self.__session
+        # One reader for every concurrent run: each packet is handed to the run that sent its probe
+        if self.__readers == 0:
+            loop.add_reader(session.fileno(), session.receive_pending)
+        self.__readers += 1
+        try:
+            while True:
+                run.event.clear()
+                now = time.monotonic()
+                next_send = self.__send_due(run, now)
+                session.expire_probes(now)
+                while run.results:
+                    yield run.results.popleft()
+                if run.is_done():
+                    return
+                try:
+                    await asyncio.wait_for(run.event.wait(), self.__wait_time(next_send))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.__readers -= 1
+            if self.__readers == 0 and self.__open:
+                loop.remove_reader(session.fileno())
+            self.__finish_run(run)
+
+    def __send_due(self, run: PingRun, now: float) -> float:
+        """Sends the probes of `run` whose time has come, at most MAX_BURST of them. Returns when the next one is
+        due (`now` when the burst ran out first), None when all are sent.
+        """
+        router = self.__router
+        session = self.__session
+        burst = MAX_BURST
+        while run.sent != run.total:
+            due = run.startedAt + run.sent * run.spacing
+            if due > now:
+                return due
+            if burst == 0:
+                # Without an interval an unlimited run is always due; let its results through in between
+                return now
+            burst -= 1
+            host, address = run.targets[run.sent % len(run.targets)]
+            run.sent += 1
+            sequence_number = self.__sequenceNumbers.get(address, 0)
+            self.__sequenceNumbers[address] = (sequence_number + 1) & 0xFFFF
+            send_errors = session.get_send_errors()
+            router.routes[(address, sequence_number)] = run
+            router.lastRuns[address] = run
+            run.pending += 1
+            session.send_probe(address, sequence_number, run.statistics[host])
+            if session.get_send_errors() != send_errors:
+                del router.routes[(address, sequence_number)]
+                run.pending -= 1
+                run.add_result(ProbeResult(ERROR, host, address, sequence_number, message=router.lastMessage))
+        return None
+
+    def __wait_time(self, nextSend: float) -> float:
+        wake_times = [deadline for deadline in (nextSend, self.__session.next_deadline()) if deadline is not None]
+        return max(0.0, min(wake_times) - time.monotonic()) if wake_times else 0.0
+
+    def __finish_run(self, run: PingRun):
+        router = self.__router
+        if run.pending:
+            # Left early: its probes still settle in the session, but are reported to nobody
+            for key in [key for key, owner in router.routes.items() if owner is run]:
+                del router.routes[key]
+        for address, owner in list(router.lastRuns.items()):
+            if owner is run:
+                del router.lastRuns[address]
+        for host, statistics in run.statistics.items():
+            self.__statistics.setdefault(host, Statistics()).merge(statistics)
+
+    def __run_statistics(self, run: PingRun, targets):
+        statistics = {host: self.__snapshot(statistics) for host, statistics in run.statistics.items()}
+        return statistics[targets] if isinstance(targets, str) else statistics
+
+    def __snapshot(self, statistics: Statistics) -> Statistics:
+        snapshot = Statistics()
+        snapshot.merge(statistics)
+        snapshot.set_clock_source(self.__session.get_clock_source())
+        return snapshot
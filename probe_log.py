@@ -0,0 +1,437 @@
+# ############################################################################################################ #
+# ProbeLog appends one fixed-width binary record per settled probe to a segmented, append-only log directory,  #
+# so loss bursts can be examined after the run. ProbeLogReader memory-maps the segments and aggregates any     #
+# time range and set of targets in chunks: vectorized with NumPy when it is installed, with a struct loop      #
+# otherwise. Memory use depends on the chunk size, not on the size of the log.                                 #
+#                                                                                                              #
+# Layout: DIRECTORY/targets holds one target address per line (line n is target id n); every segment-N.plog    #
+# starts with SEGMENT_HEADER, followed by RECORDs. A record cut short by a crash is ignored.                   #
+# ############################################################################################################ #
+
+import math
+import mmap
+import os
+import struct
+import time
+from datetime import datetime
+from latency_histogram import LatencyHistogram
+from probe_output import REPLY, TIMEOUT, ERROR, DUPLICATE, LATE, KIND_CODES, BufferedRecordWriter
+from constants import PROBE_LOG_SEGMENT_RECORDS, PROBE_LOG_CHUNK_RECORDS
+
+try:
+    import numpy
+except ImportError:  # Optional: scans fall back to struct.iter_unpack
+    numpy = None
+
+SEGMENT_MAGIC = b"PLOG"
+SEGMENT_VERSION = 1
+SEGMENT_HEADER = struct.Struct("<4sBB2xq")  # Magic, version, record size, creation time (wall clock ns)
+# Send time (wall clock ns; arrival time for duplicate and late replies), RTT (ns, -1 without a reply),
+# target id, sequence number, kind (probe_output.KIND_CODES), ICMP type and code of errors
+RECORD = struct.Struct("<qqHHBBBx")
+NUMPY_RECORD = None if numpy is None else numpy.dtype([
+    ("send_ns", "<i8"), ("rtt_ns", "<i8"), ("target", "<u2"), ("seq", "<u2"), ("kind", "u1"),
+    ("icmp_type", "u1"), ("icmp_code", "u1"), ("reserved", "u1"),
+])
+MAX_TARGETS = 1 << 16
+TARGETS_FILE = "targets"
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".plog"
+PROBE_KINDS = (KIND_CODES[REPLY], KIND_CODES[TIMEOUT], KIND_CODES[ERROR])  # One record per probe sent
+
+def _segment_number(name: str) -> int:
+    if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+        number = name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]
+        if number.isdigit():
+            return int(number)
+    return None
+
+def list_segments(directory: str) -> list:
+    """Returns the segment paths of a log directory, oldest first."""
+    numbered = [(_segment_number(name), name) for name in os.listdir(directory)]
+    return [os.path.join(directory, name) for number, name in sorted(item for item in numbered if item[0] is not None)]
+
+def read_targets(directory: str) -> list:
+    path = os.path.join(directory, TARGETS_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [line.rstrip("\n") for line in f]
+
+
+class ProbeLog:
+    """Appends probe records to DIRECTORY, starting a new segment every `segmentRecords` records.
+
+    Records are batched by a BufferedRecordWriter; a log that already exists is continued, keeping its target ids.
+    """
+    def __init__(self, directory: str, segmentRecords: int = PROBE_LOG_SEGMENT_RECORDS):
+        os.makedirs(directory, exist_ok=True)
+        self.__directory: str = directory
+        self.__segmentRecords: int = segmentRecords         # Records per segment file
+        self.__targetIds: dict = {address: index for index, address in enumerate(read_targets(directory))}
+        self.__targetsFile = open(os.path.join(directory, TARGETS_FILE), "a")
+        segments = list_segments(directory)
+        self.__segmentNumber: int = _segment_number(os.path.basename(segments[-1])) + 1 if segments else 0
+        self.__segment = None                               # Open segment file
+        self.__writer: BufferedRecordWriter = None          # Batches the records of the open segment
+        self.__recordsInSegment: int = 0
+        # Send times are taken on the monotonic clock; the log stores wall-clock times to query by date
+        self.__clockOffset: int = time.time_ns() - time.monotonic_ns()
+
+    # ############################################################
+    # Public Functions                                           #
+    # ############################################################
+    def record(self, kind: str, target: str, sequenceNumber: int, sentAt: int = None, rttNs: int = -1,
+               icmpType: int = 0, icmpCode: int = 0):
+        """Appends one record; `sentAt` is the monotonic send time in ns, None for now."""
+        target_id = self.__targetIds.get(target)
+        if target_id is None:
+            target_id = self.__add_target(target)
+        if self.__writer is None or self.__recordsInSegment >= self.__segmentRecords:
+            self.__open_segment()
+        send_ns = sentAt + self.__clockOffset if sentAt is not None else time.time_ns()
+        self.__writer.write(RECORD.pack(send_ns, rttNs, target_id, sequenceNumber, KIND_CODES[kind], icmpType,
+                                        icmpCode))
+        self.__recordsInSegment += 1
+
+    def next_flush(self) -> float:
+        return self.__writer.next_flush() if self.__writer is not None else None
+
+    def flush_if_due(self, now: float):
+        if self.__writer is not None:
+            self.__writer.flush_if_due(now)
+
+    def close(self):
+        self.__close_segment()
+        self.__targetsFile.close()
+
+    # ############################################################
+    # Private Functions                                          #
+    # ############################################################
+    def __add_target(self, target: str) -> int:
+        if len(self.__targetIds) >= MAX_TARGETS:
+            raise ValueError(f"A probe log holds at most {MAX_TARGETS} targets.")
+        target_id = len(self.__targetIds)
+        self.__targetIds[target] = target_id
+        # Written through at once: no record may refer to an id the targets file does not have yet
+        self.__targetsFile.write(target + "\n")
+        self.__targetsFile.flush()
+        return target_id
+
+    def __open_segment(self):
+        self.__close_segment()
+        path = os.path.join(self.__directory, f"{SEGMENT_PREFIX}{self.__segmentNumber:08d}{SEGMENT_SUFFIX}")
+        self.__segmentNumber += 1
+        self.__segment = open(path, "ab")
+        self.__writer = BufferedRecordWriter(self.__segment)
+        self.__writer.write(SEGMENT_HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION, RECORD.size, time.time_ns()))
+        self.__recordsInSegment = 0
+
+    def __close_segment(self):
+        if self.__writer is not None:
+            self.__writer.flush()
+            self.__segment.close()
+            self.__writer = None
+
+
+class RecordingOutput:
+    """Wraps a probe output and appends every probe it reports to a ProbeLog."""
+    def __init__(self, output, probeLog: ProbeLog):
+        self.__output = output
+        self.__probeLog: ProbeLog = probeLog
+        self.name = output.name
+        self.quiet = output.quiet
+
+    def reply(self, target: str, source: str, sequenceNumber: int, size: int, ttl: int, rtt: float,
+              valid: bool = True, sentAt: int = None):
+        self.__output.reply(target, source, sequenceNumber, size, ttl, rtt, valid, sentAt)
+        self.__probeLog.record(REPLY, target, sequenceNumber, sentAt, round(rtt * 1e6))
+
+    def timeout(self, target: str, sequenceNumber: int, sentAt: int = None):
+        self.__output.timeout(target, sequenceNumber, sentAt)
+        self.__probeLog.record(TIMEOUT, target, sequenceNumber, sentAt)
+
+    def error(self, target: str, sequenceNumber: int, source: str, icmpType: int, icmpCode: int, message: str,
+              sentAt: int = None):
+        self.__output.error(target, sequenceNumber, source, icmpType, icmpCode, message, sentAt)
+        self.__probeLog.record(ERROR, target, sequenceNumber, sentAt, -1, icmpType, icmpCode)
+
+    def duplicate(self, target: str, source: str, sequenceNumber: int, size: int, ttl: int):
+        self.__output.duplicate(target, source, sequenceNumber, size, ttl)
+        self.__probeLog.record(DUPLICATE, target, sequenceNumber)
+
+    def late(self, target: str, source: str, sequenceNumber: int, size: int, ttl: int):
+        self.__output.late(target, source, sequenceNumber, size, ttl)
+        self.__probeLog.record(LATE, target, sequenceNumber)
+
+    def message(self, text: str):
+        self.__output.message(text)
+
+    def summary(self, host: str, statistics, heading: str = None):
+        self.__output.summary(host, statistics, heading)
+
+    def next_flush(self) -> float:
+        deadlines = [d for d in (self.__output.next_flush(), self.__probeLog.next_flush()) if d is not None]
+        return min(deadlines) if deadlines else None
+
+    def flush_if_due(self, now: float):
+        self.__output.flush_if_due(now)
+        self.__probeLog.flush_if_due(now)
+
+    def close(self):
+        self.__output.close()
+        self.__probeLog.close()
+
+
+class LogSummary:
+    """Statistics of the records of one target (and time window) in a probe log."""
+    __slots__ = ("sent", "replies", "timeouts", "errors", "duplicates", "late", "rttCount", "rttMean", "rttM2",
+                 "rttMin", "rttMax", "histogram")
+
+    def __init__(self):
+        self.sent = self.replies = self.timeouts = self.errors = self.duplicates = self.late = 0
+        self.rttCount = 0
+        self.rttMean = 0.0               # ms
+        self.rttM2 = 0.0                 # Sum of squared deviations from the mean
+        self.rttMin = math.inf
+        self.rttMax = -math.inf
+        self.histogram = LatencyHistogram()
+
+    def add_record(self, kind: int, rttMs: float):
+        if kind == KIND_CODES[REPLY]:
+            self.sent += 1
+            self.replies += 1
+            self.add_rtts(1, rttMs, 0.0, rttMs, rttMs)
+            self.histogram.record(rttMs)
+        elif kind == KIND_CODES[TIMEOUT]:
+            self.sent += 1
+            self.timeouts += 1
+        elif kind == KIND_CODES[ERROR]:
+            self.sent += 1
+            self.errors += 1
+        elif kind == KIND_CODES[DUPLICATE]:
+            self.duplicates += 1
+        elif kind == KIND_CODES[LATE]:
+            self.late += 1
+
+    def add_rtts(self, count: int, mean: float, m2: float, minimum: float, maximum: float):
+        """Folds in the RTT summary of `count` more replies (Chan et al., as in Statistics.merge)."""
+        if count == 0:
+            return
+        total = self.rttCount + count
+        delta = mean - self.rttMean
+        self.rttM2 += m2 + delta * delta * self.rttCount * count / total
+        self.rttMean += delta * count / total
+        self.rttCount = total
+        self.rttMin = min(self.rttMin, minimum)
+        self.rttMax = max(self.rttMax, maximum)
+
+    def get_percentile(self, percentile: float) -> float:
+        """Returns an RTT percentile in ms, clamped to min/max as Statistics.get_percentile does."""
+        if self.rttCount == 0:
+            return 0.0
+        return min(max(self.histogram.get_percentile(percentile), self.rttMin), self.rttMax)
+
+    def get_summary(self) -> dict:
+        lost = self.timeouts + self.errors
+        return {
+            "transmitted": self.sent,
+            "received": self.replies,
+            "lost": lost,
+            "loss_percent": lost / self.sent * 100 if self.sent else 0.0,
+            "rtt_min": self.rttMin if self.rttCount else 0.0,
+            "rtt_avg": self.rttMean,
+            "rtt_max": self.rttMax if self.rttCount else 0.0,
+            "rtt_mdev": math.sqrt(self.rttM2 / self.rttCount) if self.rttCount else 0.0,
+            "rtt_p50": self.get_percentile(50),
+            "rtt_p95": self.get_percentile(95),
+            "rtt_p99": self.get_percentile(99),
+            "duplicates": self.duplicates,
+            "late": self.late,
+        }
+
+    def print_summary(self):
+        summary = self.get_summary()
+        print(f"{summary['transmitted']} packets transmitted, {summary['received']} packets received, "
+              f"{round(summary['loss_percent'], 2)}% packet loss ({self.timeouts} timed out, {self.errors} ICMP errors)")
+        if self.duplicates or self.late:
+            print(f"{self.duplicates} duplicates, {self.late} late replies")
+        if self.rttCount:
+            print(f"round-trip min/avg/max = {round(summary['rtt_min'], 3)} / {round(summary['rtt_avg'], 3)} / "
+                  f"{round(summary['rtt_max'], 3)} ms")
+            print(f"round-trip p50/p95/p99 = {round(summary['rtt_p50'], 3)} / {round(summary['rtt_p95'], 3)} / "
+                  f"{round(summary['rtt_p99'], 3)} ms")
+            print(f"mdev = {round(summary['rtt_mdev'], 3)} ms")
+        else:
+            print("No RTT records available.")
+
+
+class ProbeLogReader:
+    def __init__(self, directory: str, chunkRecords: int = PROBE_LOG_CHUNK_RECORDS):
+        if not os.path.isdir(directory):
+            raise FileNotFoundError(f"No probe log at {directory}")
+        self.__directory: str = directory
+        self.__chunkRecords: int = chunkRecords             # Records aggregated at a time
+        self.__targets: list = read_targets(directory)      # Target id -> address
+        self.__recordsScanned: int = 0
+
+    # ############################################################
+    # Getters                                                    #
+    # ############################################################
+    def get_targets(self) -> list:
+        return self.__targets
+
+    def get_records_scanned(self) -> int:
+        return self.__recordsScanned
+
+    # ############################################################
+    # Public Functions                                           #
+    # ############################################################
+    def scan(self, targets: list = None, sinceNs: int = None, untilNs: int = None, windowNs: int = None) -> dict:
+        """Aggregates the records sent in [sinceNs, untilNs) to any of `targets` (addresses; all when None).
+
+        Returns {(window start in ns, or None without `windowNs`, target address): LogSummary}.
+        """
+        target_ids = None
+        if targets is not None:
+            target_ids = [index for index, address in enumerate(self.__targets) if address in set(targets)]
+        groups = {}
+        self.__recordsScanned = 0
+        for path in list_segments(self.__directory):
+            with open(path, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                if size < SEGMENT_HEADER.size:
+                    continue  # Created, but nothing written yet
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    magic, version, record_size, _ = SEGMENT_HEADER.unpack_from(mapped)
+                    if magic != SEGMENT_MAGIC or version != SEGMENT_VERSION or record_size != RECORD.size:
+                        raise ValueError(f"{path} is not a version {SEGMENT_VERSION} probe log segment")
+                    count = (size - SEGMENT_HEADER.size) // RECORD.size
+                    for start in range(0, count, self.__chunkRecords):
+                        length = min(self.__chunkRecords, count - start)
+                        offset = SEGMENT_HEADER.size + start * RECORD.size
+                        if numpy is not None:
+                            self.__scan_chunk_numpy(mapped, offset, length, groups, target_ids, sinceNs, untilNs,
+                                                    windowNs)
+                        else:
+                            self.__scan_chunk(mapped, offset, length, groups, target_ids, sinceNs, untilNs,
+                                              windowNs)
+                        self.__recordsScanned += length
+        return {(window, self.__targets[target_id]): summary for (window, target_id), summary in groups.items()}
+
+    # ############################################################
+    # Private Functions                                          #
+    # ############################################################
+    def __scan_chunk(self, mapped, offset: int, length: int, groups: dict, targetIds: list, sinceNs: int,
+                     untilNs: int, windowNs: int):
+        wanted = set(targetIds) if targetIds is not None else None
+        for send_ns, rtt_ns, target_id, _, kind, _, _ in RECORD.iter_unpack(
+                mapped[offset:offset + length * RECORD.size]):
+            if (sinceNs is not None and send_ns < sinceNs) or (untilNs is not None and send_ns >= untilNs):
+                continue
+            if wanted is not None and target_id not in wanted:
+                continue
+            key = (send_ns - send_ns % windowNs if windowNs else None, target_id)
+            summary = groups.get(key)
+            if summary is None:
+                summary = groups[key] = LogSummary()
+            summary.add_record(kind, rtt_ns / 1e6)
+
+    def __scan_chunk_numpy(self, mapped, offset: int, length: int, groups: dict, targetIds: list, sinceNs: int,
+                           untilNs: int, windowNs: int):
+        records = numpy.frombuffer(mapped, dtype=NUMPY_RECORD, count=length, offset=offset)
+        mask = numpy.ones(length, dtype=bool)
+        if sinceNs is not None:
+            mask &= records["send_ns"] >= sinceNs
+        if untilNs is not None:
+            mask &= records["send_ns"] < untilNs
+        if targetIds is not None:
+            mask &= numpy.isin(records["target"], targetIds)
+        records = records[mask]
+        if len(records) == 0:
+            return
+
+        # One group per (window, target): window numbers are counted from the chunk's first window so that the
+        # combined key stays well inside int64, and target ids are below MAX_TARGETS
+        windows = records["send_ns"] // windowNs if windowNs else numpy.zeros(len(records), dtype=numpy.int64)
+        first_window = int(windows.min())
+        keys, inverse = numpy.unique((windows - first_window) * MAX_TARGETS + records["target"], return_inverse=True)
+        inverse = inverse.reshape(-1)
+        kinds = records["kind"]
+        counts = {kind: numpy.bincount(inverse[kinds == code], minlength=len(keys))
+                  for kind, code in KIND_CODES.items()}
+
+        is_reply = kinds == KIND_CODES[REPLY]
+        reply_groups = inverse[is_reply]
+        rtts = records["rtt_ns"][is_reply] / 1e6
+        reply_counts = counts[REPLY]
+        sums = numpy.bincount(reply_groups, weights=rtts, minlength=len(keys))
+        means = numpy.divide(sums, reply_counts, out=numpy.zeros(len(keys)), where=reply_counts > 0)
+        m2 = numpy.bincount(reply_groups, weights=(rtts - means[reply_groups]) ** 2, minlength=len(keys))
+        minimums = numpy.full(len(keys), numpy.inf)
+        maximums = numpy.full(len(keys), -numpy.inf)
+        numpy.minimum.at(minimums, reply_groups, rtts)
+        numpy.maximum.at(maximums, reply_groups, rtts)
+
+        summaries = []
+        for index, key in enumerate(keys.tolist()):
+            window, target_id = divmod(key, MAX_TARGETS)
+            group = ((first_window + window) * windowNs if windowNs else None, target_id)
+            summary = groups.get(group)
+            if summary is None:
+                summary = groups[group] = LogSummary()
+            summary.sent += int(counts[REPLY][index] + counts[TIMEOUT][index] + counts[ERROR][index])
+            summary.replies += int(counts[REPLY][index])
+            summary.timeouts += int(counts[TIMEOUT][index])
+            summary.errors += int(counts[ERROR][index])
+            summary.duplicates += int(counts[DUPLICATE][index])
+            summary.late += int(counts[LATE][index])
+            summary.add_rtts(int(reply_counts[index]), float(means[index]), float(m2[index]),
+                             float(minimums[index]), float(maximums[index]))
+            summaries.append(summary)
+
+        # Percentiles: the same log buckets as LatencyHistogram, counted per group
+        if len(rtts):
+            lowest, log_base, max_bucket = summaries[0].histogram.get_layout()
+            buckets = numpy.ceil(numpy.log(numpy.maximum(rtts, lowest) / lowest) / log_base)
+            buckets = numpy.clip(buckets, 0, max_bucket).astype(numpy.int64)
+            pairs, pair_counts = numpy.unique(reply_groups * (max_bucket + 1) + buckets, return_counts=True)
+            for pair, count in zip(pairs.tolist(), pair_counts.tolist()):
+                index, bucket = divmod(pair, max_bucket + 1)
+                summaries[index].histogram.record_bucket(bucket, count)
+
+
+def parse_time(text: str) -> int:
+    """Parses UNIX seconds or an ISO 8601 date/time (local time unless it has an offset) into wall-clock ns."""
+    try:
+        return round(float(text) * 1e9)
+    except ValueError:
+        return round(datetime.fromisoformat(text).timestamp() * 1e9)
+
+def format_time(ns: int) -> str:
+    return datetime.fromtimestamp(ns / 1e9).isoformat(sep=" ", timespec="seconds")
+
+def replay(directory: str, targets: list = None, since: str = None, until: str = None, window: float = None):
+    """Prints the statistics of a probe log, per target, or per target and time window with `window` seconds."""
+    reader = ProbeLogReader(directory)
+    started = time.perf_counter()
+    groups = reader.scan(targets, parse_time(since) if since else None, parse_time(until) if until else None,
+                         round(window * 1e9) if window else None)
+    elapsed = time.perf_counter() - started
+
+    if window:
+        print(f"{'window start':<20} {'target':<16} {'sent':>8} {'lost':>7} {'loss':>8} {'avg ms':>10} "
+              f"{'p99 ms':>10} {'max ms':>10}")
+        for (window_start, address), summary in sorted(groups.items()):
+            row = summary.get_summary()
+            print(f"{format_time(window_start):<20} {address:<16} {row['transmitted']:>8} {row['lost']:>7} "
+                  f"{row['loss_percent']:>7.2f}% {row['rtt_avg']:>10.3f} {row['rtt_p99']:>10.3f} "
+                  f"{row['rtt_max']:>10.3f}")
+    else:
+        for (_, address), summary in sorted(groups.items()):
+            print()
+            print(f"--- {address} probe log statistics ---")
+            summary.print_summary()
+    print()
+    print(f"{reader.get_records_scanned()} records scanned in {elapsed:.2f} s "
+          f"({'NumPy' if numpy is not None else 'struct, install NumPy for vectorized scans'})")
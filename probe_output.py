@@ -0,0 +1,362 @@
+# ############################################################################################################ #
+# Probe outputs report every probe and the final statistics of a run.                                          #
+# TextOutput prints the usual human-readable lines. JsonLinesOutput, CsvOutput and BinaryOutput encode one     #
+# record per probe and hand it to a BufferedRecordWriter, which writes whole batches when a size or time limit #
+# is reached, so the cost per probe stays flat as the rate goes up. QuietOutput keeps only the summary.        #
+# Diagnostics of the machine-readable outputs go to stderr, so stdout holds nothing but records.               #
+# `sentAt`, where given, is the probe's monotonic send time in ns (see probe_log.RecordingOutput).             #
+# ############################################################################################################ #
+
+import csv
+import io
+import json
+import math
+import select
+import socket
+import struct
+import sys
+import time
+from constants import OUTPUT_BUFFER_SIZE, OUTPUT_FLUSH_INTERVAL
+
+REPLY = "reply"
+TIMEOUT = "timeout"
+ERROR = "error"
+DUPLICATE = "duplicate"
+LATE = "late"
+SUMMARY = "summary"
+
+CSV_COLUMNS = ("type", "time", "target", "from", "seq", "bytes", "ttl", "rtt_ms", "icmp_type", "icmp_code", "valid")
+SUMMARY_FIELDS = ("transmitted", "received", "loss_percent", "rtt_count", "rtt_min", "rtt_avg", "rtt_max",
+                  "rtt_mdev", "rtt_p50", "rtt_p95", "rtt_p99", "jitter", "duplicates", "reordered", "late",
+                  "clock_source")
+
+# Binary format: FILE_HEADER, then records that each start with their kind byte
+FILE_MAGIC = b"PING"
+FILE_VERSION = 1
+FILE_HEADER = struct.Struct("!4sBB2x")         # Magic, version, size of a probe record
+# Kind, flags, reply TTL, ICMP type, ICMP code, sequence number, bytes, target, source, wall time, RTT (ms, NaN)
+PROBE_RECORD = struct.Struct("!BBBBBxHH4s4sdf2x")
+# Kind, length of the clock source, length of the host, then the host and clock source as UTF-8
+SUMMARY_RECORD = struct.Struct("!BBH6Q9d")
+KIND_CODES = {REPLY: 1, TIMEOUT: 2, ERROR: 3, DUPLICATE: 4, LATE: 5, SUMMARY: 255}
+FLAG_INVALID_PAYLOAD = 0x01
+NO_ADDRESS = bytes(4)
+
+class BufferedRecordWriter:
+    """Collects encoded records and writes them in batches of at most `maxBytes`, or after `maxDelay` seconds.
+
+    Every write call passes whole records, so several processes can share one pipe when `maxBytes` is at most
+    PIPE_BUF.
+    """
+    def __init__(self, stream=None, maxBytes: int = OUTPUT_BUFFER_SIZE, maxDelay: float = OUTPUT_FLUSH_INTERVAL):
+        self.__stream = stream if stream is not None else sys.stdout.buffer
+        self.__maxBytes: int = maxBytes            # Buffered bytes that trigger a write
+        self.__maxDelay: float = maxDelay          # Seconds the oldest buffered record may wait
+        self.__buffer = bytearray()
+        self.__oldest: float = None                # Monotonic time the oldest buffered record was added
+
+    def write(self, record: bytes):
+        if len(self.__buffer) + len(record) > self.__maxBytes:
+            self.flush()
+        if not self.__buffer:
+            self.__oldest = time.monotonic()
+        self.__buffer += record
+
+    def next_flush(self) -> float:
+        """Returns the monotonic time the buffer is due to be written, or None while it is empty."""
+        return self.__oldest + self.__maxDelay if self.__buffer else None
+
+    def flush_if_due(self, now: float):
+        """Writes the buffer if its oldest record has waited `maxDelay`; `now` is on the monotonic clock."""
+        if self.__buffer and now - self.__oldest >= self.__maxDelay:
+            self.flush()
+
+    def flush(self):
+        if self.__buffer:
+            self.__stream.write(self.__buffer)
+            self.__buffer.clear()
+        self.__stream.flush()
+
+
+class TextOutput:
+    """The human-readable lines ping has always printed."""
+    name = "text"
+    quiet = False
+
+    def reply(self, target: str, source: str, sequenceNumber: int, size: int, ttl: int, rtt: float,
+              valid: bool = True, sentAt: int = None):
+        print(f"{size} bytes from {source}: icmp_seq={sequenceNumber} ttl={ttl} time={rtt:.3f} ms")
+
+    def timeout(self, target: str, sequenceNumber: int, sentAt: int = None):
+        print(f"  *        *        *        *        *    Request timed out. {target} icmp_seq={sequenceNumber}")
+
+    def error(self, target: str, sequenceNumber: int, source: str, icmpType: int, icmpCode: int, message: str,
+              sentAt: int = None):
+        print(f"From {source}: icmp_type={icmpType} icmp_code={icmpCode} - {message}")
+
+    def duplicate(self, target: str, source: str, sequenceNumber: int, size: int, ttl: int):
+        print(f"{size} bytes from {source}: icmp_seq={sequenceNumber} ttl={ttl} (DUP!)")
+
+    def late(self, target: str, source: str, sequenceNumber: int, size: int, ttl: int):
+        print(f"{size} bytes from {source}: icmp_seq={sequenceNumber} ttl={ttl} (late, after timeout)")
+
+    def message(self, text: str):
+        print(text)
+
+    def summary(self, host: str, statistics, heading: str = None):
+        print()
+        print(heading or f"--- {host} ping statistics ---")
+        statistics.print_statistics()
+
+    def next_flush(self) -> float:
+        return None
+
+    def flush_if_due(self, now: float):
+        pass
+
+    def close(self):
+        sys.stdout.flush()
+
+
+class QuietOutput:
+    """Wraps another output and drops every per-probe report (-q); messages and summaries still go through."""
+    quiet = True
+
+    def __init__(self, output):
+        self.__output = output
+        self.name = output.name
+
+    def reply(self, *args, **kwargs):
+        pass
+
+    def timeout(self, *args, **kwargs):
+        pass
+
+    def error(self, *args, **kwargs):
+        pass
+
+    def duplicate(self, *args):
+        pass
+
+    def late(self, *args):
+        pass
+
+    def message(self, text: str):
+        self.__output.message(text)
+
+    def summary(self, host: str, statistics, heading: str = None):
+        self.__output.summary(host, statistics, heading)
+
+    def next_flush(self) -> float:
+        return self.__output.next_flush()
+
+    def flush_if_due(self, now: float):
+        self.__output.flush_if_due(now)
+
+    def close(self):
+        self.__output.close()
+
+
+class RecordOutput:
+    """Common part of the machine-readable outputs; subclasses encode probe and summary records."""
+    quiet = False
+
+    def __init__(self, writer: BufferedRecordWriter = None):
+        self.__writer = writer if writer is not None else BufferedRecordWriter()
+
+    def reply(self, target: str, source: str, sequenceNumber: int, size: int, ttl: int, rtt: float,
+              valid: bool = True, sentAt: int = None):
+        self.__writer.write(self.encode_probe(REPLY, time.time(), target, source, sequenceNumber, size, ttl, rtt,
+                                              0, 0, valid))
+
+    def timeout(self, target: str, sequenceNumber: int, sentAt: int = None):
+        self.__writer.write(self.encode_probe(TIMEOUT, time.time(), target, None, sequenceNumber, None, None, None,
+                                              None, None, None))
+
+    def error(self, target: str, sequenceNumber: int, source: str, icmpType: int, icmpCode: int, message: str,
+              sentAt: int = None):
+        self.__writer.write(self.encode_probe(ERROR, time.time(), target, source, sequenceNumber, None, None, None,
+                                              icmpType, icmpCode, None))
+
+    def duplicate(self, target: str, source: str, sequenceNumber: int, size: int, ttl: int):
+        self.__writer.write(self.encode_probe(DUPLICATE, time.time(), target, source, sequenceNumber, size, ttl,
+                                              None, 0, 0, None))
+
+    def late(self, target: str, source: str, sequenceNumber: int, size: int, ttl: int):
+        self.__writer.write(self.encode_probe(LATE, time.time(), target, source, sequenceNumber, size, ttl, None,
+                                              0, 0, None))
+
+    def message(self, text: str):
+        print(text, file=sys.stderr)
+
+    def write(self, record: bytes):
+        self.__writer.write(record)
+
+    def summary(self, host: str, statistics, heading: str = None):
+        self.__writer.write(self.encode_summary(host, statistics.get_summary()))
+
+    def next_flush(self) -> float:
+        return self.__writer.next_flush()
+
+    def flush_if_due(self, now: float):
+        self.__writer.flush_if_due(now)
+
+    def close(self):
+        self.__writer.flush()
+
+
+class JsonLinesOutput(RecordOutput):
+    """One JSON object per line; fields that do not apply to a record are left out."""
+    name = "jsonl"
+
+    def encode_probe(self, kind: str, timestamp: float, target: str, source: str, sequenceNumber: int, size: int,
+                     ttl: int, rtt: float, icmpType: int, icmpCode: int, valid: bool) -> bytes:
+        line = f'{{"type":"{kind}","time":{timestamp:.6f},"target":"{target}","seq":{sequenceNumber}'
+        if source is not None:
+            line += f',"from":"{source}"'
+        if size is not None:
+            line += f',"bytes":{size},"ttl":{ttl}'
+        if rtt is not None:
+            line += f',"rtt_ms":{rtt:.3f}'
+        if kind == ERROR:
+            line += f',"icmp_type":{icmpType},"icmp_code":{icmpCode}'
+        if valid is not None:
+            line += ',"valid":true}\n' if valid else ',"valid":false}\n'
+        else:
+            line += "}\n"
+        return line.encode()
+
+    def encode_summary(self, host: str, summary: dict) -> bytes:
+        record = {"type": SUMMARY, "time": round(time.time(), 6), "host": host}
+        record.update(summary)
+        return (json.dumps(record, separators=(",", ":")) + "\n").encode()
+
+
+class CsvOutput(RecordOutput):
+    """A header row, then one row per probe. The summaries follow as a second table after an empty line."""
+    name = "csv"
+
+    def __init__(self, writer: BufferedRecordWriter = None, header: bool = True):
+        super().__init__(writer)
+        self.__summaryHeaderWritten: bool = False
+        if header:
+            self.write((",".join(CSV_COLUMNS) + "\n").encode())
+
+    def encode_probe(self, kind: str, timestamp: float, target: str, source: str, sequenceNumber: int, size: int,
+                     ttl: int, rtt: float, icmpType: int, icmpCode: int, valid: bool) -> bytes:
+        if kind == REPLY:  # By far the most common record
+            return (f"reply,{timestamp:.6f},{target},{source},{sequenceNumber},{size},{ttl},{rtt:.3f},,,"
+                    f"{int(valid)}\n").encode()
+        return (f"{kind},{timestamp:.6f},{target},{'' if source is None else source},{sequenceNumber},"
+                f"{'' if size is None else size},{'' if ttl is None else ttl},"
+                f"{'' if rtt is None else format(rtt, '.3f')},"
+                f"{'' if kind != ERROR else icmpType},{'' if kind != ERROR else icmpCode},"
+                f"{'' if valid is None else int(valid)}\n").encode()
+
+    def encode_summary(self, host: str, summary: dict) -> bytes:
+        rows = io.StringIO()
+        writer = csv.writer(rows, lineterminator="\n")
+        if not self.__summaryHeaderWritten:
+            rows.write("\n")
+            writer.writerow(("type", "host") + SUMMARY_FIELDS)
+            self.__summaryHeaderWritten = True
+        writer.writerow((SUMMARY, "" if host is None else host) + tuple(summary[field] for field in SUMMARY_FIELDS))
+        return rows.getvalue().encode()
+
+
+class BinaryOutput(RecordOutput):
+    """Fixed-size 32-byte big-endian probe records (PROBE_RECORD) after a FILE_HEADER; see read_binary_records."""
+    name = "binary"
+
+    def __init__(self, writer: BufferedRecordWriter = None, header: bool = True):
+        super().__init__(writer)
+        if header:
+            self.write(FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, PROBE_RECORD.size))
+
+    def encode_probe(self, kind: str, timestamp: float, target: str, source: str, sequenceNumber: int, size: int,
+                     ttl: int, rtt: float, icmpType: int, icmpCode: int, valid: bool) -> bytes:
+        return PROBE_RECORD.pack(
+            KIND_CODES[kind], FLAG_INVALID_PAYLOAD if valid is False else 0, ttl or 0, icmpType or 0, icmpCode or 0,
+            sequenceNumber, size or 0, socket.inet_aton(target),
+            socket.inet_aton(source) if source is not None else NO_ADDRESS, timestamp,
+            rtt if rtt is not None else math.nan
+        )
+
+    def encode_summary(self, host: str, summary: dict) -> bytes:
+        host_bytes = (host or "").encode()
+        clock_bytes = summary["clock_source"].encode()
+        return SUMMARY_RECORD.pack(
+            KIND_CODES[SUMMARY], len(clock_bytes), len(host_bytes),
+            summary["transmitted"], summary["received"], summary["rtt_count"],
+            summary["duplicates"], summary["reordered"], summary["late"],
+            summary["loss_percent"], summary["rtt_min"], summary["rtt_avg"], summary["rtt_max"],
+            summary["rtt_mdev"], summary["rtt_p50"], summary["rtt_p95"], summary["rtt_p99"], summary["jitter"]
+        ) + host_bytes + clock_bytes
+
+
+DEFAULT_OUTPUT = TextOutput()
+FORMATS = (TextOutput.name, JsonLinesOutput.name, CsvOutput.name, BinaryOutput.name)
+
+def create_output(format: str = TextOutput.name, quiet: bool = False, shared: bool = False, header: bool = True):
+    """Returns the output for `format` (one of FORMATS).
+
+    `shared` keeps every write within PIPE_BUF so several processes can write records to one pipe without
+    interleaving them; `header` controls the CSV header row and binary file header.
+    """
+    if format == TextOutput.name:
+        output = DEFAULT_OUTPUT
+    else:
+        writer = BufferedRecordWriter(maxBytes=select.PIPE_BUF if shared else OUTPUT_BUFFER_SIZE)
+        if format == JsonLinesOutput.name:
+            output = JsonLinesOutput(writer)
+        elif format == CsvOutput.name:
+            output = CsvOutput(writer, header)
+        elif format == BinaryOutput.name:
+            output = BinaryOutput(writer, header)
+        else:
+            raise ValueError(f"Unknown output format: {format}")
+    return QuietOutput(output) if quiet else output
+
+def read_binary_records(data: bytes):
+    """Yields the records of a binary output stream as dicts, the same fields as the JSON lines."""
+    kinds = {code: kind for kind, code in KIND_CODES.items()}
+    offset = 0
+    while offset < len(data):
+        if data[offset:offset + len(FILE_MAGIC)] == FILE_MAGIC:
+            _, version, record_size = FILE_HEADER.unpack_from(data, offset)
+            if version != FILE_VERSION or record_size != PROBE_RECORD.size:
+                raise ValueError(f"Unsupported binary output: version {version}, record size {record_size}")
+            offset += FILE_HEADER.size
+            continue
+        kind = kinds.get(data[offset])
+        if kind is None:
+            raise ValueError(f"Unknown record kind {data[offset]} at offset {offset}")
+        if kind == SUMMARY:
+            fields = SUMMARY_RECORD.unpack_from(data, offset)
+            offset += SUMMARY_RECORD.size
+            host = data[offset:offset + fields[2]].decode()
+            offset += fields[2]
+            clock_source = data[offset:offset + fields[1]].decode()
+            offset += fields[1]
+            record = {"type": SUMMARY, "host": host or None}
+            record.update(zip(("transmitted", "received", "rtt_count", "duplicates", "reordered", "late",
+                               "loss_percent", "rtt_min", "rtt_avg", "rtt_max", "rtt_mdev", "rtt_p50", "rtt_p95",
+                               "rtt_p99", "jitter"), fields[3:]))
+            record["clock_source"] = clock_source
+        else:
+            _, flags, ttl, icmp_type, icmp_code, sequence_number, size, target, source, timestamp, rtt = (
+                PROBE_RECORD.unpack_from(data, offset)
+            )
+            offset += PROBE_RECORD.size
+            record = {"type": kind, "time": timestamp, "target": socket.inet_ntoa(target), "seq": sequence_number}
+            if source != NO_ADDRESS:
+                record["from"] = socket.inet_ntoa(source)
+            if kind in (REPLY, DUPLICATE, LATE):
+                record["bytes"], record["ttl"] = size, ttl
+            if not math.isnan(rtt):
+                record["rtt_ms"] = rtt
+            if kind == ERROR:
+                record["icmp_type"], record["icmp_code"] = icmp_type, icmp_code
+            if kind == REPLY:
+                record["valid"] = not flags & FLAG_INVALID_PAYLOAD
+        yield record
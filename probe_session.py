@@ -0,0 +1,393 @@
+# ############################################################################################################ #
+# ProbeSession owns one raw ICMP socket for a whole run.                                                       #
+# Echo requests are sent without waiting for replies; replies are matched back to the in-flight table.         #
+# With a batch size above 1, sends and receives go through sendmmsg/recvmmsg where the socket allows it.       #
+# ############################################################################################################ #
+
+import select
+import socket
+import time
+from statistics import Statistics
+from icmp_packet import IcmpPacket, get_icmp_message
+from in_flight import InFlightProbe, InFlightTable
+from packet_template import EchoRequestTemplate, DEFAULT_PATTERN, describe_payload_mismatch
+from reply_decoder import ReplyDecoder
+from timing import CLOCK_SOURCE_KERNEL, CLOCK_SOURCE_MONOTONIC, enable_kernel_timestamps
+from adaptive_timeout import AdaptiveTimeout
+from bpf import read_icmp_in_messages
+from batch_io import BATCHED_SYSCALLS, MessageBatch, slot_size_for
+from sequence_window import SequenceWindow, REORDERED, DUPLICATE
+from transport import DEFAULT_TRANSPORT
+from probe_output import DEFAULT_OUTPUT
+from stage_profiler import BUILD, SENDTO, WAIT, RECV, PARSE, VALIDATE, OUTPUT, STATS
+from constants import ICMPType, TIMEOUT, TTL, RTO_MIN, RTO_MAX, ICMP_HEADER_SIZE, TIMESTAMP_SIZE, DEFAULT_BATCH
+
+class ProbeSession:
+    def __init__(self, identifier: int, timeout: float = TIMEOUT, ttl: int = TTL, debug: bool = False,
+                 kernelTimestamps: bool = False, adaptiveTimeout: bool = False,
+                 minTimeout: float = RTO_MIN, maxTimeout: float = RTO_MAX, socketFilter: bool = True,
+                 transport=DEFAULT_TRANSPORT, output=DEFAULT_OUTPUT, payload: bytes = DEFAULT_PATTERN, profiler=None,
+                 batchSize: int = DEFAULT_BATCH):
+        self.__identifier: int = identifier        # ICMP identifier shared by every probe of the session
+        self.__timeout: float = timeout            # Seconds before an unanswered probe is declared lost
+        self.__adaptiveTimeout = adaptiveTimeout   # Derive each target's timeout from its RTTs (RFC 6298)
+        self.__minTimeout: float = minTimeout      # Floor of the adaptive timeout
+        self.__maxTimeout: float = maxTimeout      # Ceiling of the adaptive timeout
+        self.__timeouts: dict = {}                 # Target IP -> AdaptiveTimeout
+        self.__ttl: int = ttl                      # Time to live
+        self.__debug: bool = debug                 # Debug flag
+        self.__kernelTimestamps = kernelTimestamps # Take receive times from SO_TIMESTAMPNS
+        self.__clockSource = CLOCK_SOURCE_MONOTONIC
+        self.__socketFilter: bool = socketFilter   # Attach a BPF filter for our identifier
+        self.__filterAttached: bool = False
+        self.__icmpInMessagesAtOpen: int = None    # Host-wide Icmp InMsgs when the socket was opened
+        self.__packetsReceived: int = 0            # Packets the socket delivered to user space
+        self.__sendErrors: int = 0                 # Probes the socket refused to send
+        self.__transport = transport               # Opens the socket (raw, datagram or simulated)
+        self.__output = output                     # Reports every probe (text, records or nothing)
+        self.__socket = None                       # Long-lived socket
+        self.__inFlight = InFlightTable()          # Probes waiting for a reply
+        self.__windows: dict = {}                  # Target IP -> (SequenceWindow, Statistics)
+        self.__template = EchoRequestTemplate(identifier, payload, profiler)  # Constant parts of every echo request
+        self.__profiler = profiler                 # StageProfiler, None when not profiling
+        self.__decoder = None                      # Reusable receive buffer, created by open()
+        self.__batchSize: int = batchSize          # Datagrams per sendmmsg/recvmmsg call
+        self.__batch = None                        # MessageBatch, None when sending and receiving one at a time
+
+    def __enter__(self) -> 'ProbeSession':
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # ############################################################
+    # Getters                                                    #
+    # ############################################################
+    def get_identifier(self) -> int:
+        return self.__identifier
+
+    def get_clock_source(self) -> str:
+        """Returns the clock RTTs are measured with; only final once the session is open."""
+        return self.__clockSource
+
+    def get_timeout(self, targetIp: str) -> float:
+        """Returns the timeout the next probe to `targetIp` will get, in seconds."""
+        if not self.__adaptiveTimeout:
+            return self.__timeout
+        return self.__get_adaptive_timeout(targetIp).get_timeout()
+
+    def get_packets_received(self) -> int:
+        return self.__packetsReceived
+
+    def get_packets_filtered(self) -> int:
+        """Estimates how many ICMP packets the BPF filter kept in the kernel, or None when unknown."""
+        if not self.__filterAttached or self.__icmpInMessagesAtOpen is None:
+            return None
+        icmp_in_messages = read_icmp_in_messages()
+        if icmp_in_messages is None:
+            return None
+        return max(0, icmp_in_messages - self.__icmpInMessagesAtOpen - self.__packetsReceived)
+
+    def get_filter_report(self) -> str:
+        packets_filtered = self.get_packets_filtered()
+        if packets_filtered is None:
+            return f"socket filter: off, {self.__packetsReceived} ICMP packets delivered to user space"
+        return (f"socket filter: {packets_filtered} ICMP packets dropped in the kernel, "
+                f"{self.__packetsReceived} delivered to user space")
+
+    def get_send_errors(self) -> int:
+        return self.__sendErrors
+
+    def get_in_flight_count(self) -> int:
+        return len(self.__inFlight)
+
+    def is_batched(self) -> bool:
+        """Returns whether sends and receives go through sendmmsg/recvmmsg; only final once the session is open."""
+        return self.__batch is not None
+
+    def fileno(self) -> int:
+        return self.__socket.fileno()
+
+    # ############################################################
+    # Public Functions                                           #
+    # ############################################################
+    def open(self):
+        self.__socket = self.__transport.open(self.__ttl, identifier=self.__identifier)
+        self.__socket.setblocking(False)
+        if self.__socketFilter:
+            self.__icmpInMessagesAtOpen = read_icmp_in_messages()
+            self.__filterAttached = self.__transport.attach_filter(self.__socket, [self.__identifier])
+        if self.__kernelTimestamps and enable_kernel_timestamps(self.__socket):
+            self.__clockSource = CLOCK_SOURCE_KERNEL
+        self.__decoder = ReplyDecoder(
+            self.__template.get_payload(), kernelTimestamps=self.__clockSource == CLOCK_SOURCE_KERNEL
+        )
+        # recvmmsg carries no per-packet ancillary data here, and the simulated network has no file descriptor
+        if (self.__batchSize > 1 and BATCHED_SYSCALLS and isinstance(self.__socket, socket.socket)
+                and self.__clockSource != CLOCK_SOURCE_KERNEL):
+            self.__batch = MessageBatch(self.__batchSize, slot_size_for(self.__template.get_payload()))
+
+    def close(self):
+        if self.__socket is not None:
+            self.__socket.close()
+            self.__socket = None
+
+    def send_probe(self, targetIp: str, sequenceNumber: int, statistics: Statistics) -> IcmpPacket:
+        """Sends one echo request and registers it as in flight. Never waits for a reply.
+
+        `sequenceNumber` is taken modulo 65536, so the caller may simply count up.
+        """
+        profiler = self.__profiler
+        if profiler is not None:
+            profiler.start()
+        icmp_packet = self.__build_probe(targetIp, sequenceNumber, statistics)
+        if profiler is not None:
+            profiler.lap(BUILD)
+
+        sent_at = time.monotonic_ns()
+        try:
+            self.__socket.sendto(icmp_packet.get_packet(), (targetIp, 0))
+            if profiler is not None:
+                profiler.lap(SENDTO)
+        except OSError as e:
+            self.__send_failed(statistics, e)
+            return icmp_packet
+        self.__register_probe(targetIp, sequenceNumber, icmp_packet, statistics, sent_at)
+        return icmp_packet
+
+    def send_probes(self, probes: list) -> list:
+        """Sends every (target IP, sequence number, statistics) probe like send_probe() and returns their packets.
+
+        With batching on, each batch goes out in a single sendmmsg call and all its probes share one send time.
+        """
+        batch = self.__batch
+        if batch is None:
+            return [self.send_probe(targetIp, sequenceNumber, statistics)
+                    for targetIp, sequenceNumber, statistics in probes]
+        profiler = self.__profiler
+        if profiler is not None:
+            profiler.start()
+        packets = []
+        targets = []
+        icmp_packets = []
+        for targetIp, sequenceNumber, statistics in probes:
+            icmp_packet = self.__build_probe(targetIp, sequenceNumber, statistics)
+            icmp_packets.append(icmp_packet)
+            packets.append(icmp_packet.get_packet())
+            targets.append(targetIp)
+        if profiler is not None:
+            profiler.lap(BUILD)
+
+        sent_at = time.monotonic_ns()
+        fd = self.__socket.fileno()
+        failed = set()
+        offset = 0
+        while offset < len(packets):
+            try:
+                offset += batch.send(fd, packets, targets, offset)
+            except InterruptedError:
+                continue
+            except OSError as e:
+                # sendmmsg stopped at this probe; skip it and carry on with the rest
+                failed.add(offset)
+                self.__send_failed(probes[offset][2], e)
+                offset += 1
+        if profiler is not None:
+            profiler.lap(SENDTO)
+        for index, (targetIp, sequenceNumber, statistics) in enumerate(probes):
+            if index not in failed:
+                self.__register_probe(targetIp, sequenceNumber, icmp_packets[index], statistics, sent_at)
+        return icmp_packets
+
+    def wait_for_replies(self, timeout: float):
+        """Blocks for at most `timeout` seconds and handles every reply that arrived."""
+        profiler = self.__profiler
+        if profiler is not None:
+            profiler.start()
+        ready = select.select([self.__socket], [], [], timeout)
+        if profiler is not None:
+            profiler.lap(WAIT)
+        if ready[0]:
+            self.receive_pending()
+
+    def receive_pending(self):
+        """Drains the socket without blocking and hands each packet to its in-flight probe."""
+        if self.__batch is not None:
+            self.__receive_batches()
+            return
+        profiler = self.__profiler
+        while True:
+            if profiler is not None:
+                profiler.start()
+            try:
+                addr = self.__decoder.receive(self.__socket)
+            except (BlockingIOError, InterruptedError):
+                return
+            if profiler is not None:
+                profiler.lap(RECV)
+            self.__packetsReceived += 1
+            if addr is not None:
+                self.__handle_packet(addr)
+
+    def next_deadline(self) -> float:
+        return self.__inFlight.next_deadline()
+
+    def expire_probes(self, now: float):
+        """Declares every probe whose deadline has passed as lost."""
+        for probe in self.__inFlight.expire(now):
+            probe.statistics.increment_packet_errors()
+            if self.__adaptiveTimeout:
+                self.__get_adaptive_timeout(probe.targetIp).back_off()
+            self.__output.timeout(probe.targetIp, probe.sequenceNumber, probe.sentAt)
+
+    def abandon_probes(self):
+        """Counts every probe still in flight as lost, e.g. when the run is interrupted."""
+        for probe in self.__inFlight.drain():
+            probe.statistics.increment_packet_errors()
+
+    def forget_target(self, targetIp: str):
+        """Drops the timeout and reply window kept for `targetIp`, e.g. when it is no longer probed.
+
+        Its probes still in flight settle as usual; later replies from it are ignored.
+        """
+        self.__timeouts.pop(targetIp, None)
+        self.__windows.pop(targetIp, None)
+
+    # ############################################################
+    # Private Functions                                          #
+    # ############################################################
+    def __get_adaptive_timeout(self, targetIp: str) -> AdaptiveTimeout:
+        adaptive_timeout = self.__timeouts.get(targetIp)
+        if adaptive_timeout is None:
+            adaptive_timeout = AdaptiveTimeout(self.__minTimeout, self.__maxTimeout)
+            self.__timeouts[targetIp] = adaptive_timeout
+        return adaptive_timeout
+
+    def __build_probe(self, targetIp: str, sequenceNumber: int, statistics: Statistics) -> IcmpPacket:
+        window = self.__windows.get(targetIp)
+        if window is None or window[1] is not statistics:
+            # The caller may switch statistics mid-run (the daemon's time slots); the window is kept
+            self.__windows[targetIp] = (window[0] if window is not None else SequenceWindow(), statistics)
+        icmp_packet = IcmpPacket(statistics, self.__debug)
+        icmp_packet.build_echo_request_packet(self.__identifier, sequenceNumber & 0xFFFF, self.__template)
+        icmp_packet.set_icmp_target(targetIp)
+        statistics.increment_packets_sent()
+        return icmp_packet
+
+    def __send_failed(self, statistics: Statistics, error: OSError):
+        statistics.increment_packet_errors()
+        self.__sendErrors += 1
+        self.__output.message(f"Exception occurred: {error}")
+
+    def __register_probe(self, targetIp: str, sequenceNumber: int, icmpPacket: IcmpPacket, statistics: Statistics,
+                         sentAt: int):
+        displaced = self.__inFlight.add(InFlightProbe(
+            self.__identifier, sequenceNumber & 0xFFFF, targetIp, icmpPacket, statistics, sentAt,
+            sentAt / 1e9 + self.get_timeout(targetIp)
+        ))
+        if displaced is not None:
+            # 65536 probes later and still unanswered: its reply could no longer be told apart
+            displaced.statistics.increment_packet_errors()
+
+    def __receive_batches(self):
+        batch = self.__batch
+        decoder = self.__decoder
+        fd = self.__socket.fileno()
+        profiler = self.__profiler
+        while True:
+            if profiler is not None:
+                profiler.start()
+            try:
+                count = batch.receive(fd)
+            except (BlockingIOError, InterruptedError):
+                return
+            # One clock read per batch: every packet in it was already queued when recvmmsg returned
+            received_at = time.monotonic_ns()
+            if profiler is not None:
+                profiler.lap(RECV)
+            self.__packetsReceived += count
+            for index in range(count):
+                if profiler is not None and index:
+                    # A packet that was not ours returns without a lap; its time must not go to the next one
+                    profiler.start()
+                buffer, view, length, addr = batch.get_message(index)
+                if decoder.load(buffer, view, length, received_at):
+                    self.__handle_packet(addr)
+            if count < batch.get_size():
+                return
+
+    def __handle_packet(self, addr: tuple):
+        decoder = self.__decoder
+        icmp_type = decoder.get_icmp_type()
+
+        if icmp_type == ICMPType.ECHO_REPLY:
+            echo = decoder.decode_echo()
+            if echo is None:
+                return
+            target_ip = addr[0]
+            _, _, _, identifier, sequence_number, _ = echo
+        elif icmp_type in [ICMPType.DESTINATION_UNREACHABLE, ICMPType.TIME_EXCEEDED]:
+            # The error comes from a router and quotes the header of our original echo request
+            quoted = decoder.decode_quoted()
+            if quoted is None:
+                return
+            target_ip, identifier, sequence_number = quoted
+        else:
+            # Includes our own echo requests when pinging a local address
+            return
+
+        if identifier != self.__identifier:
+            return
+
+        ordering = None
+        if icmp_type == ICMPType.ECHO_REPLY and target_ip in self.__windows:
+            window, statistics = self.__windows[target_ip]
+            ordering = window.record(sequence_number)
+            if ordering == DUPLICATE:
+                statistics.increment_duplicate_replies()
+                self.__output.duplicate(target_ip, addr[0], sequence_number,
+                                        decoder.get_length() - decoder.get_ip_header_length(), decoder.get_ttl())
+                return
+
+        probe = self.__inFlight.pop(target_ip, identifier, sequence_number)
+        if probe is None:
+            if ordering is not None:
+                # Not a duplicate, so its probe was already declared lost
+                statistics.increment_late_replies()
+                self.__output.late(target_ip, addr[0], sequence_number,
+                                   decoder.get_length() - decoder.get_ip_header_length(), decoder.get_ttl())
+            elif self.__debug:
+                self.__output.message(f"Ignoring reply from {target_ip} icmp_seq={sequence_number}: not in flight.")
+            return
+        if ordering == REORDERED:
+            probe.statistics.increment_reordered_replies()
+
+        if icmp_type != ICMPType.ECHO_REPLY:
+            probe.statistics.increment_packet_errors()
+            icmp_code = decoder.get_icmp_code()
+            self.__output.error(target_ip, sequence_number, addr[0], icmp_type, icmp_code,
+                                get_icmp_message(icmp_type, icmp_code), probe.sentAt)
+            return
+
+        # Measured against our own monotonic send time, not the wall-clock timestamp echoed in the payload
+        rtt = (decoder.get_received_at() - probe.sentAt) / 1e6
+        profiler = self.__profiler
+        if profiler is not None:
+            profiler.lap(PARSE)
+        payload_is_valid = decoder.payload_is_valid()
+        if profiler is not None:
+            profiler.lap(VALIDATE)
+        self.__output.reply(target_ip, addr[0], sequence_number, decoder.get_length() - decoder.get_ip_header_length(),
+                            decoder.get_ttl(), rtt, payload_is_valid, probe.sentAt)
+        if not payload_is_valid:
+            received = bytes(decoder.get_view()[decoder.get_ip_header_length() + ICMP_HEADER_SIZE + TIMESTAMP_SIZE:])
+            self.__output.message(f"ICMP Raw Data invalid. "
+                                  f"{describe_payload_mismatch(received, self.__template.get_payload())}")
+        if profiler is not None:
+            profiler.lap(OUTPUT)
+        probe.statistics.update_rtt(rtt)
+        if self.__adaptiveTimeout:
+            self.__get_adaptive_timeout(probe.targetIp).update(rtt / 1000)
+        if profiler is not None:
+            profiler.lap(STATS)
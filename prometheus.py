@@ -0,0 +1,113 @@
+# ############################################################################################################ #
+# Renders the daemon's statistics in the Prometheus text exposition format (version 0.0.4).                    #
+# Counters and the RTT histogram cover each target's whole lifetime; gauges labelled with `window` cover the   #
+# rolling windows; with --profile, a summary per pipeline stage follows. Times are in seconds, as Prometheus   #
+# expects.                                                                                                     #
+# ############################################################################################################ #
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+RTT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # Seconds
+QUANTILES = (0.5, 0.95, 0.99)
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def format_window(seconds: float) -> str:
+    """Returns a window length as a label value, e.g. 60 -> "1m"."""
+    return f"{int(seconds // 60)}m" if seconds % 60 == 0 else f"{seconds:g}s"
+
+def lost_probes(summary: dict) -> int:
+    return summary["transmitted"] - summary["received"]
+
+def loss_ratio(summary: dict) -> float:
+    # Probes still in flight are neither answered nor lost yet, so they do not dilute the ratio
+    settled = summary["rtt_count"] + lost_probes(summary)
+    return lost_probes(summary) / settled if settled else 0.0
+
+def seconds(field: str):
+    return lambda summary: summary[field] / 1000
+
+# Name, help text, value taken from a Statistics summary
+COUNTERS = (
+    ("ping_probes_sent_total", "Echo requests sent.", lambda summary: summary["transmitted"]),
+    ("ping_replies_total", "Echo replies received in time.", lambda summary: summary["rtt_count"]),
+    ("ping_probes_lost_total", "Echo requests that timed out or were answered with an ICMP error.", lost_probes),
+    ("ping_duplicate_replies_total", "Replies for a sequence number that was already answered.",
+     lambda summary: summary["duplicates"]),
+    ("ping_reordered_replies_total", "Replies that arrived after the reply to a later probe.",
+     lambda summary: summary["reordered"]),
+    ("ping_late_replies_total", "Replies that arrived after their probe timed out.", lambda summary: summary["late"]),
+)
+WINDOW_GAUGES = (
+    ("ping_window_probes_sent", "Echo requests sent in the window.", lambda summary: summary["transmitted"]),
+    ("ping_window_loss_ratio", "Share of the window's answered or lost probes that were lost.", loss_ratio),
+    ("ping_window_rtt_min_seconds", "Lowest round-trip time in the window.", seconds("rtt_min")),
+    ("ping_window_rtt_avg_seconds", "Mean round-trip time in the window.", seconds("rtt_avg")),
+    ("ping_window_rtt_max_seconds", "Highest round-trip time in the window.", seconds("rtt_max")),
+    ("ping_window_rtt_stddev_seconds", "Standard deviation of the round-trip time in the window.",
+     seconds("rtt_mdev")),
+    ("ping_window_jitter_seconds", "RFC 3550 interarrival jitter in the window.", seconds("jitter")),
+)
+
+def render_profile(profiler) -> list:
+    """Returns the lines of a summary of the time spent in each stage of the probe pipeline (a StageProfiler)."""
+    lines = ["# HELP ping_stage_seconds Time spent in each stage of the probe pipeline.",
+             "# TYPE ping_stage_seconds summary"]
+    for stage, summary in profiler.get_summary().items():
+        histogram = profiler.get_histogram(stage)
+        for quantile in QUANTILES:
+            lines.append(f'ping_stage_seconds{{stage="{stage}",quantile="{quantile:g}"}} '
+                         f'{histogram.get_percentile(quantile * 100) / 1e9}')
+        lines.append(f'ping_stage_seconds_sum{{stage="{stage}"}} {summary["total_ns"] / 1e9}')
+        lines.append(f'ping_stage_seconds_count{{stage="{stage}"}} {summary["count"]}')
+    return lines
+
+def render_metrics(targets: dict, now: float, extra: list = (), profiler=None) -> str:
+    """Returns the exposition of `targets` (host -> RollingStatistics) at monotonic time `now`.
+
+    `extra` holds (name, type, help, value) of metrics without labels, e.g. the number of targets.
+    """
+    lines = []
+    for name, kind, help_text, value in extra:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", f"{name} {value}"]
+
+    totals = {}
+    windows = {}
+    for host, rolling in targets.items():
+        label = escape_label(host)
+        window_statistics, total = rolling.get_snapshot(now)
+        totals[label] = (total, total.get_summary())
+        windows[label] = [(format_window(seconds), statistics.get_summary())
+                          for seconds, statistics in window_statistics]
+
+    for name, help_text, value_of in COUNTERS:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+        for label, (_, summary) in totals.items():
+            lines.append(f'{name}{{target="{label}"}} {value_of(summary)}')
+
+    lines += ["# HELP ping_rtt_seconds Round-trip time of every echo reply.", "# TYPE ping_rtt_seconds histogram"]
+    for label, (total, summary) in totals.items():
+        counts = total.get_histogram().get_cumulative_counts(tuple(bound * 1000 for bound in RTT_BUCKETS))
+        for bound, count in zip(RTT_BUCKETS, counts):
+            lines.append(f'ping_rtt_seconds_bucket{{target="{label}",le="{bound:g}"}} {count}')
+        lines.append(f'ping_rtt_seconds_bucket{{target="{label}",le="+Inf"}} {summary["rtt_count"]}')
+        lines.append(f'ping_rtt_seconds_sum{{target="{label}"}} {summary["rtt_avg"] * summary["rtt_count"] / 1000}')
+        lines.append(f'ping_rtt_seconds_count{{target="{label}"}} {summary["rtt_count"]}')
+
+    for name, help_text, value_of in WINDOW_GAUGES:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+        for label, summaries in windows.items():
+            for window, summary in summaries:
+                lines.append(f'{name}{{target="{label}",window="{window}"}} {value_of(summary)}')
+
+    lines += ["# HELP ping_window_rtt_quantile_seconds Round-trip time quantiles in the window, to 1%.",
+              "# TYPE ping_window_rtt_quantile_seconds gauge"]
+    for label, summaries in windows.items():
+        for window, summary in summaries:
+            for quantile in QUANTILES:
+                value = summary[f"rtt_p{quantile * 100:g}"] / 1000
+                lines.append(f'ping_window_rtt_quantile_seconds{{target="{label}",window="{window}",'
+                             f'quantile="{quantile:g}"}} {value}')
+    if profiler is not None:
+        lines += render_profile(profiler)
+    return "\n".join(lines) + "\n"
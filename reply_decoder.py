@@ -0,0 +1,128 @@
+# ############################################################################################################ #
+# ReplyDecoder receives ICMP packets into a preallocated buffer and decodes them without copying.              #
+# The echo reply header and timestamp are pulled in a single precompiled struct call at the real IP header     #
+# length (IHL), and the payload is validated by comparing bytes.                                               #
+# ############################################################################################################ #
+
+import struct
+import time
+from socket import inet_ntoa
+from timing import TIMESTAMP_ANCILLARY_SIZE, kernel_timestamp_to_monotonic_ns
+from constants import ICMP_HEADER_SIZE, TIMESTAMP_SIZE, RAW_DATA
+
+ECHO = struct.Struct("!BBHHHd")         # type, code, checksum, identifier, sequence number, timestamp
+ICMP_ID_SEQ = struct.Struct("!HH")      # identifier, sequence number
+RECV_BUFFER_SIZE = 65535                # Largest possible IPv4 datagram
+
+def ip_header_length(packet, offset: int = 0) -> int:
+    """Returns the IPv4 header length in bytes from the IHL field of the header at `offset`."""
+    return (packet[offset] & 0x0F) * 4
+
+class ReplyDecoder:
+    def __init__(self, expectedPayload: bytes = RAW_DATA.encode("utf-8"), bufferSize: int = RECV_BUFFER_SIZE,
+                 kernelTimestamps: bool = False):
+        self.__expectedPayload: bytes = expectedPayload   # Data that must follow the timestamp
+        self.__kernelTimestamps: bool = kernelTimestamps  # Read SO_TIMESTAMPNS ancillary data with recvmsg
+        self.__buffers: list = [bytearray(bufferSize)]    # Scatter list for recvmsg_into, reused for every packet
+        self.__ownView = memoryview(self.__buffers[0])
+        self.__buffer = self.__buffers[0]                 # Holds the current packet, or a batch slot after load()
+        self.__view = self.__ownView                      # Zero-copy window onto that buffer
+        self.__length: int = 0                            # Bytes of the current packet
+        self.__ipHeaderLength: int = 0                    # IHL * 4 of the current packet
+        self.__receivedAt: int = 0                        # Monotonic ns when the current packet arrived
+
+    # ############################################################
+    # Getters                                                    #
+    # ############################################################
+    def get_view(self) -> memoryview:
+        """Returns the current packet. Only valid until the next receive()."""
+        return self.__view[:self.__length]
+
+    def get_length(self) -> int:
+        return self.__length
+
+    def get_ip_header_length(self) -> int:
+        return self.__ipHeaderLength
+
+    def get_received_at(self) -> int:
+        return self.__receivedAt
+
+    def get_ttl(self) -> int:
+        return self.__buffer[8]
+
+    def get_icmp_type(self) -> int:
+        return self.__buffer[self.__ipHeaderLength]
+
+    def get_icmp_code(self) -> int:
+        return self.__buffer[self.__ipHeaderLength + 1]
+
+    def get_next_hop_mtu(self) -> int:
+        """Returns the MTU a fragmentation-needed error reports (RFC 1191); 0 when the router left it out."""
+        offset = self.__ipHeaderLength + 6
+        return self.__buffer[offset] << 8 | self.__buffer[offset + 1]
+
+    # ############################################################
+    # Public Functions                                           #
+    # ############################################################
+    def receive(self, sock) -> tuple:
+        """Receives one packet into the shared buffer and returns the sender address.
+
+        Returns None when the packet is too short to carry an ICMP header.
+        Raises BlockingIOError when a non-blocking socket has nothing to read.
+        """
+        self.__buffer = self.__buffers[0]
+        self.__view = self.__ownView
+        if self.__kernelTimestamps:
+            self.__length, ancdata, _, addr = sock.recvmsg_into(self.__buffers, TIMESTAMP_ANCILLARY_SIZE)
+            self.__receivedAt = kernel_timestamp_to_monotonic_ns(ancdata)
+        else:
+            self.__length, addr = sock.recvfrom_into(self.__buffer)
+            self.__receivedAt = time.monotonic_ns()
+        if self.__length < 20:
+            return None
+        self.__ipHeaderLength = ip_header_length(self.__buffer)
+        if self.__length < self.__ipHeaderLength + ICMP_HEADER_SIZE:
+            return None
+        return addr
+
+    def load(self, buffer: bytearray, view: memoryview, length: int, receivedAt: int) -> bool:
+        """Makes a packet received elsewhere (a recvmmsg slot) the current one, without copying it.
+
+        Returns False when the packet is too short to carry an ICMP header.
+        """
+        self.__buffer = buffer
+        self.__view = view
+        self.__length = length
+        self.__receivedAt = receivedAt
+        if length < 20:
+            return False
+        self.__ipHeaderLength = ip_header_length(buffer)
+        return length >= self.__ipHeaderLength + ICMP_HEADER_SIZE
+
+    def decode_echo(self) -> tuple:
+        """Returns (type, code, checksum, identifier, sequence number, timestamp) of an echo message.
+
+        Returns None when the packet is too short to carry the timestamp.
+        """
+        if self.__length < self.__ipHeaderLength + ICMP_HEADER_SIZE + TIMESTAMP_SIZE:
+            return None
+        return ECHO.unpack_from(self.__buffer, self.__ipHeaderLength)
+
+    def decode_quoted(self) -> tuple:
+        """Returns (destination address, identifier, sequence number) of the echo request quoted in an ICMP error.
+
+        Returns None when the error does not quote enough of the original datagram.
+        """
+        quoted_ip_offset = self.__ipHeaderLength + ICMP_HEADER_SIZE
+        if self.__length < quoted_ip_offset + 20:
+            return None
+        quoted_icmp_offset = quoted_ip_offset + ip_header_length(self.__buffer, quoted_ip_offset)
+        if self.__length < quoted_icmp_offset + ICMP_HEADER_SIZE:
+            return None
+        destination = inet_ntoa(self.__view[quoted_ip_offset + 16:quoted_ip_offset + 20])
+        identifier, sequence_number = ICMP_ID_SEQ.unpack_from(self.__buffer, quoted_icmp_offset + 4)
+        return destination, identifier, sequence_number
+
+    def payload_is_valid(self) -> bool:
+        start = self.__ipHeaderLength + ICMP_HEADER_SIZE + TIMESTAMP_SIZE
+        return self.__view[start:self.__length] == self.__expectedPayload
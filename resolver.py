@@ -0,0 +1,116 @@
+# ############################################################################################################ #
+# Resolver keeps DNS lookups off the probe hot path.                                                           #
+# Each host is resolved once and cached with a TTL in a bounded LRU. Stale entries keep being served while a   #
+# background thread refreshes them, and large host lists are resolved concurrently on a thread pool.           #
+# ############################################################################################################ #
+
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from socket import getaddrinfo, gaierror, AF_INET, SOCK_RAW
+from constants import DNS_TTL, DNS_CACHE_SIZE, DNS_WORKERS, LOCALHOST
+
+class Resolver:
+    def __init__(self, ttl: float = DNS_TTL, maxEntries: int = DNS_CACHE_SIZE, workers: int = DNS_WORKERS):
+        self.__ttl: float = ttl                          # Seconds an answer is considered fresh
+        self.__maxEntries: int = maxEntries              # Least recently used hosts are evicted beyond this
+        self.__cache: OrderedDict = OrderedDict()        # Host -> (IP address, monotonic expiry)
+        self.__refreshing: set = set()                   # Hosts with a background lookup in progress
+        self.__lock = threading.Lock()
+        self.__executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="resolver")
+
+    # ############################################################
+    # Public Functions                                           #
+    # ############################################################
+    def resolve(self, host: str) -> str:
+        """Returns the IPv4 address of `host`, blocking only when it has never been resolved.
+
+        Raises socket.gaierror when the host can not be resolved.
+        """
+        host = host.strip()
+        if not host:
+            return LOCALHOST
+        address = self.get_cached(host)
+        if address is None:
+            address = self.__lookup(host)
+            self.__store(host, address)
+        return address
+
+    def get_cached(self, host: str) -> str:
+        """Returns the cached address of `host` without ever blocking, or None when it is not cached.
+
+        A stale answer is still returned and refreshed in the background.
+        """
+        with self.__lock:
+            entry = self.__cache.get(host)
+            if entry is None:
+                return None
+            self.__cache.move_to_end(host)
+            address, expires_at = entry
+            stale = expires_at <= time.monotonic() and host not in self.__refreshing
+            if stale:
+                self.__refreshing.add(host)
+        if stale:
+            self.__executor.submit(self.__refresh, host)
+        return address
+
+    def resolve_many(self, hosts: list) -> dict:
+        """Resolves `hosts` concurrently. Returns host -> address, with None for hosts that do not resolve."""
+        hosts = list(dict.fromkeys(hosts))
+        return dict(zip(hosts, self.__executor.map(self.__resolve_or_none, hosts)))
+
+    async def resolve_many_async(self, hosts: list) -> dict:
+        """Asyncio version of resolve_many(); the lookups run on the resolver's thread pool."""
+        loop = asyncio.get_running_loop()
+        hosts = list(dict.fromkeys(hosts))
+        addresses = await asyncio.gather(
+            *(loop.run_in_executor(self.__executor, self.__resolve_or_none, host) for host in hosts)
+        )
+        return dict(zip(hosts, addresses))
+
+    def close(self):
+        self.__executor.shutdown(wait=False, cancel_futures=True)
+
+    # ############################################################
+    # Private Functions                                          #
+    # ############################################################
+    def __lookup(self, host: str) -> str:
+        # SOCK_RAW keeps getaddrinfo from returning one entry per socket type
+        return getaddrinfo(host, None, AF_INET, SOCK_RAW)[0][4][0]
+
+    def __store(self, host: str, address: str):
+        with self.__lock:
+            self.__cache[host] = (address, time.monotonic() + self.__ttl)
+            self.__cache.move_to_end(host)
+            while len(self.__cache) > self.__maxEntries:
+                self.__cache.popitem(last=False)
+
+    def __refresh(self, host: str):
+        try:
+            self.__store(host, self.__lookup(host))
+        except (gaierror, UnicodeError):
+            pass  # Keep serving the last known address until a lookup succeeds
+        finally:
+            with self.__lock:
+                self.__refreshing.discard(host)
+
+    def __resolve_or_none(self, host: str) -> str:
+        try:
+            return self.resolve(host)
+        except (gaierror, UnicodeError):
+            return None
+
+
+_default_resolver = None
+_default_resolver_pid = None
+
+def get_default_resolver() -> Resolver:
+    """Returns the resolver shared by the whole process (recreated after a fork, whose threads do not survive)."""
+    global _default_resolver, _default_resolver_pid
+    if _default_resolver is None or _default_resolver_pid != os.getpid():
+        _default_resolver = Resolver()
+        _default_resolver_pid = os.getpid()
+    return _default_resolver
@@ -0,0 +1,88 @@
+# ############################################################################################################ #
+# RollingStatistics keeps one target's statistics over sliding windows (e.g. the last 1, 5 and 15 minutes).    #
+# Probes are recorded into fixed-length time slots held in a ring; a window is the merge of its most recent    #
+# slots, and slots that fall off the ring are folded into the lifetime totals, so memory stays constant        #
+# however long the daemon runs. A probe's outcome (reply, loss, duplicate...) is recorded in the slot current  #
+# when it settles, not the one it was sent in; otherwise the newest slots would show the replies but not yet   #
+# the losses, which only surface after the timeout.                                                            #
+# ############################################################################################################ #
+
+import math
+import time
+from statistics import Statistics
+from constants import DAEMON_SLOT, DAEMON_WINDOWS
+
+class RollingStatistics:
+    def __init__(self, slotSeconds: float = DAEMON_SLOT, windows: tuple = DAEMON_WINDOWS):
+        self.__slotSeconds: float = slotSeconds                     # Time covered by one slot
+        self.__windows: tuple = windows                             # Window lengths in seconds
+        self.__slotCount: int = math.ceil(max(windows) / slotSeconds)  # Enough slots for the longest window
+        self.__slots: list = [Statistics() for _ in range(self.__slotCount)]
+        self.__currentSlot: int = None                              # Number of the newest slot (monotonic time // slot)
+        self.__lifetime: Statistics = Statistics()                  # Every slot that has left the ring
+
+    # ############################################################
+    # Getters                                                    #
+    # ############################################################
+    def get_windows(self) -> tuple:
+        return self.__windows
+
+    def get_current(self, now: float) -> Statistics:
+        """Returns the slot of `now` (monotonic seconds), where probes sent or settled then are recorded."""
+        slot = int(now // self.__slotSeconds)
+        if self.__currentSlot is None:
+            self.__currentSlot = slot
+        elif slot > self.__currentSlot:
+            # Recycle every slot skipped since the last probe; each one leaves the ring exactly once
+            for number in range(self.__currentSlot + 1, min(slot, self.__currentSlot + self.__slotCount) + 1):
+                index = number % self.__slotCount
+                self.__lifetime.merge(self.__slots[index])
+                self.__slots[index] = Statistics()
+            self.__currentSlot = slot
+        return self.__slots[self.__currentSlot % self.__slotCount]
+
+    def get_window(self, seconds: float, now: float) -> Statistics:
+        """Returns the probes sent within the last `seconds` (rounded up to whole slots) merged into one summary."""
+        self.get_current(now)
+        window = Statistics()
+        for age in range(min(math.ceil(seconds / self.__slotSeconds), self.__slotCount)):
+            window.merge(self.__slots[(self.__currentSlot - age) % self.__slotCount])
+        return window
+
+    def get_snapshot(self, now: float) -> tuple:
+        """Returns ([(window seconds, Statistics)], lifetime Statistics) in one pass over the ring."""
+        self.get_current(now)
+        boundaries = {min(math.ceil(seconds / self.__slotSeconds), self.__slotCount): seconds
+                      for seconds in self.__windows}
+        running = Statistics()
+        windows = []
+        for age in range(self.__slotCount):
+            running.merge(self.__slots[(self.__currentSlot - age) % self.__slotCount])
+            if age + 1 in boundaries:
+                window = Statistics()
+                window.merge(running)
+                windows.append((boundaries[age + 1], window))
+        running.merge(self.__lifetime)
+        return windows, running
+
+    # ############################################################
+    # Public Functions                                           #
+    # ############################################################
+    # The recording side of Statistics, so a probe session can be handed this object for a target
+    def increment_packets_sent(self):
+        self.get_current(time.monotonic()).increment_packets_sent()
+
+    def increment_packet_errors(self):
+        self.get_current(time.monotonic()).increment_packet_errors()
+
+    def increment_duplicate_replies(self):
+        self.get_current(time.monotonic()).increment_duplicate_replies()
+
+    def increment_reordered_replies(self):
+        self.get_current(time.monotonic()).increment_reordered_replies()
+
+    def increment_late_replies(self):
+        self.get_current(time.monotonic()).increment_late_replies()
+
+    def update_rtt(self, currentRTT: float):
+        self.get_current(time.monotonic()).update_rtt(currentRTT)
@@ -0,0 +1,52 @@
+# ############################################################################################################ #
+# SequenceWindow classifies the replies of one target by their 16-bit sequence number.                         #
+# The last WINDOW_SIZE sequence numbers are kept as a bitmap in a single int, so each reply costs O(1) and     #
+# memory stays constant however long the run. Sequence numbers wrap at 65536 and are compared with serial      #
+# number arithmetic (RFC 1982).                                                                                #
+# ############################################################################################################ #
+
+SEQUENCE_MODULO = 1 << 16
+WINDOW_SIZE = 1024                       # Sequence numbers remembered behind the highest one seen
+
+FRESH = "fresh"                          # First reply for this sequence number, in order
+REORDERED = "reordered"                  # First reply, but a later sequence number was answered before it
+DUPLICATE = "duplicate"                  # This sequence number has already been answered
+TOO_OLD = "too old"                      # Behind the window; can not tell a duplicate from a late reply
+
+def next_sequence_number(sequenceNumber: int) -> int:
+    return (sequenceNumber + 1) % SEQUENCE_MODULO
+
+def sequence_distance(sequenceNumber: int, reference: int) -> int:
+    """Returns how far `sequenceNumber` is ahead of `reference` (negative when behind), in -32768..32767."""
+    return (sequenceNumber - reference + SEQUENCE_MODULO // 2) % SEQUENCE_MODULO - SEQUENCE_MODULO // 2
+
+class SequenceWindow:
+    __slots__ = ("__highest", "__seen", "__size", "__mask")
+
+    def __init__(self, size: int = WINDOW_SIZE):
+        self.__highest: int = None           # Highest sequence number answered so far
+        self.__seen: int = 0                 # Bit n set: highest - n has been answered
+        self.__size: int = size
+        self.__mask: int = (1 << size) - 1
+
+    def record(self, sequenceNumber: int) -> str:
+        """Marks `sequenceNumber` as answered and returns FRESH, REORDERED, DUPLICATE or TOO_OLD."""
+        if self.__highest is None:
+            self.__highest, self.__seen = sequenceNumber, 1
+            return FRESH
+
+        distance = sequence_distance(sequenceNumber, self.__highest)
+        if distance > 0:
+            # Slide the window forward; anything shifted out is forgotten
+            self.__seen = ((self.__seen << distance) | 1) & self.__mask if distance < self.__size else 1
+            self.__highest = sequenceNumber
+            return FRESH
+
+        offset = -distance
+        if offset >= self.__size:
+            return TOO_OLD
+        bit = 1 << offset
+        if self.__seen & bit:
+            return DUPLICATE
+        self.__seen |= bit
+        return REORDERED
@@ -0,0 +1,323 @@
+# ############################################################################################################ #
+# SimulatedNetwork is an in-process transport that answers echo requests without root or a network.            #
+# Replies are well-formed IPv4 datagrams (the echo reply checksum is patched incrementally, RFC 1624), so the  #
+# whole receive path runs unchanged. Latency follows a configurable distribution, and loss, duplication,       #
+# reordering, ICMP errors, a hop count (time exceeded below it) and a path MTU (fragmentation needed above it, #
+# or silent drops behind a black hole) can be injected. All randomness comes from one seeded generator, so a   #
+# run can be reproduced.                                                                                       #
+# ############################################################################################################ #
+
+import errno
+import heapq
+import os
+import random
+import socket
+import struct
+import threading
+import time
+from collections import deque
+from checksum import update_checksum, internet_checksum
+from constants import ICMPType, ICMPCodeDestUnreach, ICMPCodeTimeExceeded, IP_HEADER_SIZE, ICMP_HEADER_SIZE, TTL, TIMEOUT
+
+IP_HEADER = struct.Struct("!BBHHHBBH4s4s")   # version/IHL, TOS, length, id, fragment, TTL, protocol, checksum, src, dst
+ICMP_TYPE_CODE = struct.Struct("!BBH")       # type, code, checksum
+ICMP_ERROR_HEADER = struct.Struct("!BBHI")   # type, code, checksum, unused
+TTL_OPTION = struct.Struct("I")
+ANY_ADDRESS = socket.inet_aton("0.0.0.0")
+ROUTER_PREFIX = "192.0.2."                   # TEST-NET-1; hop N answers from 192.0.2.N
+ERROR_ROUTER = ROUTER_PREFIX + "254"         # Source of injected destination-unreachable errors
+REORDER_WINDOW = 5.0                         # Largest extra delay of a reordered reply, in ms
+TIMER_SLACK = 0.0005                         # Delayed replies due within this many seconds are released together
+
+class LatencyDistribution:
+    """Round-trip latency in ms, parsed from "MS", "fixed:MS", "uniform:LOW:HIGH", "normal:MEAN:STDDEV" or
+    "exponential:MEAN". Negative draws are clamped to 0.
+    """
+    __slots__ = ("spec", "kind", "values")
+    ARITY = {"fixed": 1, "uniform": 2, "normal": 2, "exponential": 1}
+
+    def __init__(self, spec: str):
+        kind, _, arguments = spec.partition(":")
+        if not arguments:
+            kind, arguments = "fixed", kind
+        try:
+            values = [float(argument) for argument in arguments.split(":")]
+        except ValueError:
+            values = None
+        if values is None or len(values) != self.ARITY.get(kind) or min(values) < 0:
+            raise ValueError(f"Invalid latency distribution: {spec}")
+        self.spec: str = spec
+        self.kind: str = kind
+        self.values: list = values
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "fixed":
+            return self.values[0]
+        if self.kind == "uniform":
+            return rng.uniform(self.values[0], self.values[1])
+        if self.kind == "normal":
+            return max(0.0, rng.gauss(self.values[0], self.values[1]))
+        return rng.expovariate(1 / self.values[0]) if self.values[0] > 0 else 0.0
+
+
+class SimulatedNetwork:
+    name = "simulated"
+
+    def __init__(self, latency: str = "0", loss: float = 0.0, duplicate: float = 0.0, reorder: float = 0.0,
+                 error: float = 0.0, hops: int = None, seed: int = 0, replyTtl: int = TTL, mtu: int = None,
+                 blackhole: bool = False):
+        self.__latency = LatencyDistribution(latency)
+        self.__loss: float = loss                  # Probability that a request goes unanswered
+        self.__duplicate: float = duplicate        # Probability that a reply arrives twice
+        self.__reorder: float = reorder            # Probability that a reply is held back behind later ones
+        self.__error: float = error                # Probability of a destination-unreachable error instead
+        self.__hops: int = hops                    # Routers before every target; None disables TTL expiry
+        self.__mtu: int = mtu                      # Largest datagram the path carries unfragmented; None: any
+        self.__blackhole: bool = blackhole         # Drop datagrams over the MTU with DF set without an error
+        self.__replyTtl: int = replyTtl            # TTL field of replies from the target
+        self.__random = random.Random(seed)        # Every random decision, for reproducible runs
+        self.__addresses: dict = {}                # Dotted address -> packed address
+
+    @classmethod
+    def from_spec(cls, spec: str) -> 'SimulatedNetwork':
+        """Builds a network from "key=value,..." with keys latency, loss, duplicate, reorder, error, hops, seed, mtu
+        and blackhole, e.g. "latency=normal:20:5,loss=0.01,reorder=0.05" or "mtu=1400,blackhole=1".
+        """
+        options = {}
+        for item in filter(None, (item.strip() for item in spec.split(","))):
+            key, _, value = item.partition("=")
+            if key == "latency":
+                options[key] = value
+            elif key in ("loss", "duplicate", "reorder", "error"):
+                options[key] = float(value)
+                if not 0.0 <= options[key] <= 1.0:
+                    raise ValueError(f"{key} must be a probability between 0 and 1: {value}")
+            elif key in ("hops", "seed", "mtu"):
+                options[key] = int(value)
+            elif key == "blackhole":
+                options[key] = value not in ("0", "false", "no")
+            else:
+                raise ValueError(f"Unknown simulation option: {key}")
+        return cls(**options)
+
+    def __str__(self) -> str:
+        return (f"simulated network (latency={self.__latency.spec} ms, loss={self.__loss}, "
+                f"duplicate={self.__duplicate}, reorder={self.__reorder}, error={self.__error}, hops={self.__hops}, "
+                f"mtu={self.__mtu}{', black hole' if self.__blackhole else ''})")
+
+    # ############################################################
+    # Public Functions                                           #
+    # ############################################################
+    def open(self, ttl: int = TTL, timeout: float = TIMEOUT, identifier: int = None) -> 'SimulatedEndpoint':
+        return SimulatedEndpoint(self, ttl)
+
+    def attach_filter(self, endpoint, identifiers) -> bool:
+        return False  # Only our own replies are ever generated
+
+    def set_dont_fragment(self, endpoint) -> bool:
+        endpoint.set_dont_fragment(True)
+        return True
+
+    def respond(self, packet: bytes, targetIp: str, ttl: int, dontFragment: bool = False) -> list:
+        """Returns the answers to one echo request as (delay in seconds, datagram, source address) tuples."""
+        if packet[0] != ICMPType.ECHO_REQUEST:
+            return []
+        rng = self.__random
+        if self.__loss and rng.random() < self.__loss:
+            return []
+        delay = self.__latency.sample(rng) / 1000
+
+        if self.__hops is not None and ttl <= self.__hops:
+            # Routers on the way answer from closer by, so in a fraction of the full latency
+            router = ROUTER_PREFIX + str(ttl)
+            error = self.__error_datagram(ICMPType.TIME_EXCEEDED, ICMPCodeTimeExceeded.TTL_EXCEEDED_TRANSIT,
+                                          packet, router, targetIp)
+            return [(delay * ttl / (self.__hops + 1), error, router)]
+        if self.__mtu is not None and dontFragment and IP_HEADER_SIZE + len(packet) > self.__mtu:
+            # The bottleneck is the last router before the target; without DF it would have fragmented
+            if self.__blackhole:
+                return []
+            error = self.__error_datagram(ICMPType.DESTINATION_UNREACHABLE, ICMPCodeDestUnreach.FRAG_NEEDED,
+                                          packet, ERROR_ROUTER, targetIp, self.__mtu)
+            return [(delay, error, ERROR_ROUTER)]
+        if self.__error and rng.random() < self.__error:
+            error = self.__error_datagram(ICMPType.DESTINATION_UNREACHABLE, ICMPCodeDestUnreach.HOST_UNREACH,
+                                          packet, ERROR_ROUTER, targetIp)
+            return [(delay, error, ERROR_ROUTER)]
+
+        reply = self.__echo_reply(packet, targetIp)
+        if self.__reorder and rng.random() < self.__reorder:
+            delay += rng.uniform(0.0, REORDER_WINDOW) / 1000
+        answers = [(delay, reply, targetIp)]
+        if self.__duplicate and rng.random() < self.__duplicate:
+            answers.append((delay + rng.uniform(0.0, REORDER_WINDOW) / 1000, reply, targetIp))
+        return answers
+
+    # ############################################################
+    # Private Functions                                          #
+    # ############################################################
+    def __echo_reply(self, packet: bytes, targetIp: str) -> bytes:
+        # Only the type changes, so the checksum is patched rather than recomputed
+        _, code, checksum = ICMP_TYPE_CODE.unpack_from(packet)
+        checksum = update_checksum(checksum, ICMPType.ECHO_REQUEST << 8 | code, ICMPType.ECHO_REPLY << 8 | code)
+        ip_header = IP_HEADER.pack(
+            0x45, 0, IP_HEADER_SIZE + len(packet), 0, 0, self.__replyTtl, socket.IPPROTO_ICMP, 0,
+            self.__packed_address(targetIp), ANY_ADDRESS
+        )
+        return ip_header + ICMP_TYPE_CODE.pack(ICMPType.ECHO_REPLY, code, checksum) + packet[ICMP_TYPE_CODE.size:]
+
+    def __error_datagram(self, icmpType: int, icmpCode: int, packet: bytes, source: str, targetIp: str,
+                         nextHopMtu: int = 0) -> bytes:
+        # Quotes the original IP header and the first 8 bytes of the echo request (RFC 792);
+        # fragmentation-needed errors carry the next-hop MTU in the low half of the unused field (RFC 1191)
+        quoted = IP_HEADER.pack(
+            0x45, 0, IP_HEADER_SIZE + len(packet), 0, 0, 1, socket.IPPROTO_ICMP, 0,
+            ANY_ADDRESS, self.__packed_address(targetIp)
+        ) + packet[:ICMP_HEADER_SIZE]
+        message = ICMP_ERROR_HEADER.pack(icmpType, icmpCode, 0, nextHopMtu) + quoted
+        message = ICMP_ERROR_HEADER.pack(icmpType, icmpCode, internet_checksum(message), nextHopMtu) + quoted
+        ip_header = IP_HEADER.pack(
+            0x45, 0, IP_HEADER_SIZE + len(message), 0, 0, self.__replyTtl, socket.IPPROTO_ICMP, 0,
+            self.__packed_address(source), ANY_ADDRESS
+        )
+        return ip_header + message
+
+    def __packed_address(self, address: str) -> bytes:
+        packed = self.__addresses.get(address)
+        if packed is None:
+            packed = self.__addresses[address] = socket.inet_aton(address)
+        return packed
+
+
+class SimulatedEndpoint:
+    """Socket stand-in on a SimulatedNetwork.
+
+    Its descriptor (a pipe) is readable exactly while a reply is ready, so select() and event loops work as usual.
+    Delayed replies are released by a timer thread that only runs while some are pending.
+    """
+    def __init__(self, network: SimulatedNetwork, ttl: int = TTL):
+        self.__network: SimulatedNetwork = network
+        self.__ttl: int = ttl                      # Set with setsockopt(IPPROTO_IP, IP_TTL)
+        self.__dontFragment: bool = False          # Set with set_dont_fragment()
+        self.__ready = deque()                     # (datagram, addr) that can be received now
+        self.__pending: list = []                  # Heap of (due, order, datagram, addr) still in transit
+        self.__order: int = 0                      # Tie-breaker keeping equal due times in send order
+        self.__lock = threading.Lock()             # Guards both queues
+        self.__dueChanged = threading.Condition(self.__lock)  # Wakes the timer when the earliest due changes
+        self.__timer = None                        # Started on the first delayed reply
+        self.__closed: bool = False
+        self.__readFd, self.__writeFd = os.pipe()
+        self.__signalled: bool = False             # A byte is in the pipe
+
+    def __enter__(self) -> 'SimulatedEndpoint':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # ############################################################
+    # Public Functions                                           #
+    # ############################################################
+    def fileno(self) -> int:
+        return self.__readFd
+
+    def sendto(self, packet: bytes, addr: tuple) -> int:
+        answers = self.__network.respond(packet, addr[0], self.__ttl, self.__dontFragment)
+        if not answers:
+            return len(packet)
+        with self.__lock:
+            for delay, datagram, source in answers:
+                if delay <= 0:
+                    self.__ready.append((datagram, (source, 0)))
+                    continue
+                due = time.monotonic() + delay
+                if not self.__pending or due < self.__pending[0][0]:
+                    self.__dueChanged.notify()
+                heapq.heappush(self.__pending, (due, self.__order, datagram, (source, 0)))
+                self.__order += 1
+                if self.__timer is None:
+                    self.__timer = threading.Thread(target=self.__release_pending, daemon=True)
+                    self.__timer.start()
+            if self.__ready and not self.__signalled:
+                self.__signal(True)
+        return len(packet)
+
+    def recvfrom_into(self, buffer) -> tuple:
+        datagram, addr = self.__pop()
+        length = min(len(datagram), len(buffer))
+        buffer[:length] = datagram[:length]
+        return length, addr
+
+    def recvfrom(self, bufferSize: int) -> tuple:
+        datagram, addr = self.__pop()
+        return datagram[:bufferSize], addr
+
+    def setsockopt(self, level: int, option: int, value):
+        if level == socket.IPPROTO_IP and option == socket.IP_TTL:
+            self.__ttl = value if isinstance(value, int) else TTL_OPTION.unpack(value)[0]
+            return
+        # Kernel features such as receive timestamps or socket filters do not exist here
+        raise OSError(errno.ENOPROTOOPT, "Option not supported by the simulated network")
+
+    def set_dont_fragment(self, flag: bool):
+        self.__dontFragment = flag
+
+    def setblocking(self, flag: bool):
+        pass
+
+    def settimeout(self, value: float):
+        pass
+
+    def bind(self, address: tuple):
+        pass
+
+    def close(self):
+        with self.__lock:
+            if self.__closed:
+                return
+            self.__closed = True
+            self.__dueChanged.notify()
+        os.close(self.__readFd)
+        os.close(self.__writeFd)
+
+    # ############################################################
+    # Private Functions                                          #
+    # ############################################################
+    def __pop(self) -> tuple:
+        with self.__lock:
+            if self.__pending and self.__pending[0][0] <= time.monotonic():
+                self.__release_due(time.monotonic())
+            if not self.__ready:
+                raise BlockingIOError(errno.EAGAIN, "No simulated reply is ready")
+            reply = self.__ready.popleft()
+            if not self.__ready:
+                self.__signal(False)
+            return reply
+
+    def __release_due(self, now: float):
+        # Caller holds the lock
+        while self.__pending and self.__pending[0][0] <= now:
+            _, _, datagram, addr = heapq.heappop(self.__pending)
+            self.__ready.append((datagram, addr))
+        if self.__ready and not self.__signalled:
+            self.__signal(True)
+
+    def __release_pending(self):
+        with self.__lock:
+            while not self.__closed:
+                if not self.__pending:
+                    self.__dueChanged.wait()
+                    continue
+                delay = self.__pending[0][0] - time.monotonic()
+                if delay > TIMER_SLACK:
+                    self.__dueChanged.wait(delay)
+                    continue
+                self.__release_due(time.monotonic() + TIMER_SLACK)
+
+    def __signal(self, readable: bool):
+        # Caller holds the lock
+        if readable:
+            os.write(self.__writeFd, b"\0")
+        else:
+            os.read(self.__readFd, 1)
+        self.__signalled = readable
@@ -0,0 +1,94 @@
+# ############################################################################################################ #
+# StageProfiler splits the time spent on each probe into the stages of the pipeline (socket, build, checksum,  #
+# sendto, wait, recv, parse, validate, output, stats) and keeps a log-bucketed histogram of each, in ns.       #
+# Stages follow each other, so one mark is moved forward with lap(); the checksum is timed inside the build    #
+# and not counted twice. Instrumented code holds None instead of a profiler when profiling is off, so the only #
+# cost left on the hot path is an `is not None` test per stage.                                                #
+# ############################################################################################################ #
+
+import time
+from latency_histogram import LatencyHistogram
+
+SOCKET = "socket"
+BUILD = "build"
+CHECKSUM = "checksum"
+SENDTO = "sendto"
+WAIT = "wait"
+RECV = "recv"
+PARSE = "parse"
+VALIDATE = "validate"
+OUTPUT = "output"
+STATS = "stats"
+STAGES = (SOCKET, BUILD, CHECKSUM, SENDTO, WAIT, RECV, PARSE, VALIDATE, OUTPUT, STATS)
+LOWEST_NS = 1.0             # Histogram range, in ns
+HIGHEST_NS = 3600 * 1e9
+
+class StageProfiler:
+    def __init__(self):
+        self.__histograms: dict = {stage: LatencyHistogram(lowest=LOWEST_NS, highest=HIGHEST_NS) for stage in STAGES}
+        self.__totals: dict = dict.fromkeys(STAGES, 0)  # Stage -> ns spent in it
+        self.__mark: int = 0                            # perf_counter_ns() where the current stage began
+        self.__nested: int = 0                          # ns of nested stages recorded since the mark
+
+    # ############################################################
+    # Getters                                                    #
+    # ############################################################
+    def get_histogram(self, stage: str) -> LatencyHistogram:
+        return self.__histograms[stage]
+
+    def get_total(self, stage: str) -> int:
+        return self.__totals[stage]
+
+    def get_summary(self) -> dict:
+        """Returns stage -> {count, total_ns, mean_ns, p50_ns, p99_ns} for every stage that was timed."""
+        summary = {}
+        for stage in STAGES:
+            histogram = self.__histograms[stage]
+            count = histogram.get_total_count()
+            if count:
+                summary[stage] = {"count": count, "total_ns": self.__totals[stage],
+                                  "mean_ns": round(self.__totals[stage] / count, 1),
+                                  "p50_ns": round(histogram.get_percentile(50), 1),
+                                  "p99_ns": round(histogram.get_percentile(99), 1)}
+        return summary
+
+    def get_report(self) -> str:
+        summary = self.get_summary()
+        # Waiting is network (and idle) time; the share column is of our own time only
+        own = sum(stage["total_ns"] for name, stage in summary.items() if name != WAIT) or 1
+        lines = ["profile (us per call, share of the time spent outside wait):",
+                 f"  {'stage':<9} {'calls':>9} {'mean':>10} {'p50':>10} {'p99':>10} {'share':>7}"]
+        for name, stage in summary.items():
+            share = "-" if name == WAIT else f"{stage['total_ns'] / own * 100:.1f}%"
+            lines.append(f"  {name:<9} {stage['count']:>9} {stage['mean_ns'] / 1000:>10.3f} "
+                         f"{stage['p50_ns'] / 1000:>10.3f} {stage['p99_ns'] / 1000:>10.3f} {share:>7}")
+        return "\n".join(lines)
+
+    # ############################################################
+    # Public Functions                                           #
+    # ############################################################
+    def start(self):
+        """Marks the beginning of the first stage."""
+        self.__mark = time.perf_counter_ns()
+        self.__nested = 0
+
+    def lap(self, stage: str):
+        """Ends `stage` now and begins the next one."""
+        now = time.perf_counter_ns()
+        self.record(stage, now - self.__mark - self.__nested)
+        self.__mark = now
+        self.__nested = 0
+
+    def record(self, stage: str, elapsedNs: int):
+        self.__histograms[stage].record(elapsedNs)
+        self.__totals[stage] += elapsedNs
+
+    def record_nested(self, stage: str, elapsedNs: int):
+        """Records a stage timed inside the current one, which is then that much shorter."""
+        self.record(stage, elapsedNs)
+        self.__nested += elapsedNs
+
+    def merge(self, other: 'StageProfiler'):
+        for stage in STAGES:
+            self.__histograms[stage].merge(other.__histograms[stage])
+            self.__totals[stage] += other.__totals[stage]
@@ -1,3 +1,7 @@
+import math
+from latency_histogram import LatencyHistogram
+from timing import CLOCK_SOURCE_MONOTONIC
+
 class Statistics:
     def __init__(self):
         self.__minRTT = -1
@@ -6,6 +10,19 @@ class Statistics:
         self.__totalRTTtime = 0.0
         self.__packetsSent = 0
         self.__packetErrors = 0
+        self.__duplicateReplies = 0                 # Replies for a sequence number that was already answered
+        self.__reorderedReplies = 0                 # Replies that arrived after a later probe's reply
+        self.__lateReplies = 0                      # Replies that arrived after their probe timed out
+        # Streaming summary: constant memory and constant cost per update, however long the run
+        self.__meanRTT = 0.0                        # Welford running mean
+        self.__sumSquaredDeviations = 0.0           # Welford M2
+        self.__jitter = 0.0                         # RFC 3550 interarrival jitter estimate
+        self.__lastRTT = None                       # Previous RTT, for the jitter difference
+        self.__histogram = LatencyHistogram()       # Log-bucketed RTT distribution for percentiles
+        self.__clockSource = CLOCK_SOURCE_MONOTONIC # How the RTTs were measured
+
+    def set_clock_source(self, clockSource: str):
+        self.__clockSource = clockSource
 
     def increment_packets_sent(self):
         self.__packetsSent += 1
@@ -13,6 +30,15 @@ class Statistics:
     def increment_packet_errors(self):
         self.__packetErrors += 1
 
+    def increment_duplicate_replies(self):
+        self.__duplicateReplies += 1
+
+    def increment_reordered_replies(self):
+        self.__reorderedReplies += 1
+
+    def increment_late_replies(self):
+        self.__lateReplies += 1
+
     def update_rtt(self, currentRTT: float):
         """Updates RTT records based on the current RTT."""
         if self.__minRTT == -1:
@@ -28,16 +54,107 @@ class Statistics:
         self.__totalRTTtime += currentRTT
         self.__numberOfRTTs += 1
 
+        # Welford's online mean/variance
+        delta = currentRTT - self.__meanRTT
+        self.__meanRTT += delta / self.__numberOfRTTs
+        self.__sumSquaredDeviations += delta * (currentRTT - self.__meanRTT)
+
+        # RFC 3550 section 6.4.1: J += (|D| - J) / 16, with D the change in transit time
+        if self.__lastRTT is not None:
+            self.__jitter += (abs(currentRTT - self.__lastRTT) - self.__jitter) / 16
+        self.__lastRTT = currentRTT
+
+        self.__histogram.record(currentRTT)
+
+    def merge(self, other: 'Statistics'):
+        """Folds another summary (e.g. from another target or worker) into this one."""
+        if other.__numberOfRTTs:
+            if self.__numberOfRTTs == 0:
+                self.__minRTT = other.__minRTT
+                self.__maxRTT = other.__maxRTT
+                self.__clockSource = other.__clockSource
+            else:
+                self.__minRTT = min(self.__minRTT, other.__minRTT)
+                self.__maxRTT = max(self.__maxRTT, other.__maxRTT)
+                if other.__clockSource != self.__clockSource:
+                    self.__clockSource = "mixed"
+
+            # Chan et al. parallel combination of Welford summaries
+            count = self.__numberOfRTTs + other.__numberOfRTTs
+            delta = other.__meanRTT - self.__meanRTT
+            self.__sumSquaredDeviations += (
+                other.__sumSquaredDeviations + delta * delta * self.__numberOfRTTs * other.__numberOfRTTs / count
+            )
+            self.__meanRTT += delta * other.__numberOfRTTs / count
+            # Jitter is a per-stream estimate; the merged value is the sample-weighted average
+            self.__jitter = (self.__jitter * self.__numberOfRTTs + other.__jitter * other.__numberOfRTTs) / count
+            if self.__lastRTT is None:
+                self.__lastRTT = other.__lastRTT
+
+            self.__totalRTTtime += other.__totalRTTtime
+            self.__numberOfRTTs = count
+            self.__histogram.merge(other.__histogram)
+
+        self.__packetsSent += other.__packetsSent
+        self.__packetErrors += other.__packetErrors
+        self.__duplicateReplies += other.__duplicateReplies
+        self.__reorderedReplies += other.__reorderedReplies
+        self.__lateReplies += other.__lateReplies
+
     def __get_avg_rtt(self) -> float:
         return self.__totalRTTtime / self.__numberOfRTTs if self.__numberOfRTTs > 0 else 0.0
 
+    def get_stddev(self) -> float:
+        """Population standard deviation of the RTTs (ping's mdev)."""
+        return math.sqrt(self.__sumSquaredDeviations / self.__numberOfRTTs) if self.__numberOfRTTs > 0 else 0.0
+
+    def get_histogram(self) -> LatencyHistogram:
+        return self.__histogram
+
+    def get_jitter(self) -> float:
+        return self.__jitter
+
+    def get_percentile(self, percentile: float) -> float:
+        """Returns an RTT percentile in ms, accurate to the histogram precision and clamped to min/max."""
+        if self.__numberOfRTTs == 0:
+            return 0.0
+        return min(max(self.__histogram.get_percentile(percentile), self.__minRTT), self.__maxRTT)
+
+    def get_summary(self) -> dict:
+        """Returns a snapshot of the current statistics; safe to call while the run is in progress."""
+        packetsReceived = self.__packetsSent - self.__packetErrors
+        return {
+            "transmitted": self.__packetsSent,
+            "received": packetsReceived,
+            "loss_percent": (self.__packetErrors / self.__packetsSent) * 100 if self.__packetsSent else 0.0,
+            "rtt_count": self.__numberOfRTTs,
+            "rtt_min": self.__minRTT if self.__numberOfRTTs else 0.0,
+            "rtt_avg": self.__get_avg_rtt(),
+            "rtt_max": self.__maxRTT if self.__numberOfRTTs else 0.0,
+            "rtt_mdev": self.get_stddev(),
+            "rtt_p50": self.get_percentile(50),
+            "rtt_p95": self.get_percentile(95),
+            "rtt_p99": self.get_percentile(99),
+            "jitter": self.__jitter,
+            "duplicates": self.__duplicateReplies,
+            "reordered": self.__reorderedReplies,
+            "late": self.__lateReplies,
+            "clock_source": self.__clockSource,
+        }
+
     def print_statistics(self):
         packetsReceived = self.__packetsSent - self.__packetErrors
         percentLost = (self.__packetErrors / self.__packetsSent) * 100 if self.__packetsSent else 0
         percentSuccess = 100 - percentLost
 
         print(f"{self.__packetsSent} packets transmitted, {packetsReceived} packets received, {round(percentLost, 2)}% packet loss")
+        if self.__duplicateReplies or self.__reorderedReplies or self.__lateReplies:
+            print(f"{self.__duplicateReplies} duplicates, {self.__reorderedReplies} reordered, "
+                  f"{self.__lateReplies} late replies")
         if self.__numberOfRTTs > 0:
             print(f"round-trip min/avg/max = {round(self.__minRTT, 3)} / {round(self.__get_avg_rtt(), 3)} / {round(self.__maxRTT, 3)} ms")
+            print(f"round-trip p50/p95/p99 = {round(self.get_percentile(50), 3)} / {round(self.get_percentile(95), 3)} / {round(self.get_percentile(99), 3)} ms")
+            print(f"mdev = {round(self.get_stddev(), 3)} ms, jitter = {round(self.__jitter, 3)} ms")
+            print(f"RTT clock: {self.__clockSource}")
         else:
             print("No RTT records available.")
\ No newline at end of file
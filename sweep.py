@@ -0,0 +1,95 @@
+# ############################################################################################################ #
+# Sweep shards a large target list across a pool of worker processes.                                          #
+# Every worker runs its own MultiPing with its own raw socket and a distinct ICMP identifier, so replies are   #
+# never counted by the wrong worker, and sends its per-target Statistics back to be merged by the parent.      #
+# Workers write their probe records straight to the shared stdout, in whole records of at most PIPE_BUF bytes; #
+# the parent writes the header and the summaries.                                                              #
+# ############################################################################################################ #
+
+import asyncio
+import os
+import signal
+from concurrent.futures import ProcessPoolExecutor
+from statistics import Statistics
+from multi_ping import MultiPing
+from probe_output import DEFAULT_OUTPUT, create_output
+
+def shard_targets(targets: list, workers: int) -> list:
+    """Splits `targets` round-robin into at most `workers` non-empty shards."""
+    targets = list(dict.fromkeys(targets))
+    workers = max(1, min(workers, len(targets)))
+    return [targets[i::workers] for i in range(workers)]
+
+def _run_shard(targets: list, identifier: int, options: dict, outputFormat: str, quiet: bool) -> dict:
+    output = create_output(outputFormat, quiet, shared=True, header=False)
+    multi_ping = MultiPing(targets, identifier=identifier, output=output, **options)
+    try:
+        return asyncio.run(multi_ping.run())
+    finally:
+        output.close()
+
+class Sweep:
+    def __init__(self, targets: list, workers: int, output=DEFAULT_OUTPUT, **options):
+        self.__targets: list = list(dict.fromkeys(targets))    # Host names in the order given
+        self.__shards: list = shard_targets(targets, workers)  # One target list per worker
+        self.__options: dict = options                          # Passed on to every worker's MultiPing
+        self.__output = output                                  # Header and summaries; workers open their own
+        self.__statistics: dict = {}                            # Host name -> Statistics, merged from workers
+
+    # ############################################################
+    # Getters                                                    #
+    # ############################################################
+    def get_statistics(self) -> dict:
+        return self.__statistics
+
+    def get_global_statistics(self) -> Statistics:
+        """Returns every target's statistics merged into one summary."""
+        total = Statistics()
+        for statistics in self.__statistics.values():
+            total.merge(statistics)
+        return total
+
+    # ############################################################
+    # Public Functions                                           #
+    # ############################################################
+    def run(self) -> dict:
+        """Runs every shard to completion and returns host -> Statistics."""
+        base_identifier = os.getpid() & 0xFFFF
+        # Workers stop themselves on SIGINT and still report; the parent just waits for them
+        previous_handler = signal.signal(signal.SIGINT, signal.SIG_IGN)
+        self.__output.close()  # Whatever the parent buffered, e.g. the header, goes out before any worker's records
+        try:
+            with ProcessPoolExecutor(max_workers=len(self.__shards)) as executor:
+                futures = [
+                    executor.submit(_run_shard, shard, (base_identifier + index) & 0xFFFF, self.__shard_options(shard),
+                                    self.__output.name, self.__output.quiet)
+                    for index, shard in enumerate(self.__shards)
+                ]
+                merged = {}
+                for future in futures:
+                    for host, statistics in future.result().items():
+                        merged.setdefault(host, Statistics()).merge(statistics)
+        finally:
+            signal.signal(signal.SIGINT, previous_handler)
+        # Report in the order the targets were given, not the order the workers finished
+        self.__statistics = {host: merged[host] for host in self.__targets if host in merged}
+        return self.__statistics
+
+    def print_statistics(self):
+        for host, statistics in self.__statistics.items():
+            self.__output.summary(host, statistics)
+        self.__output.summary(
+            None, self.get_global_statistics(),
+            f"--- global ping statistics ({len(self.__statistics)} targets, {len(self.__shards)} workers) ---"
+        )
+        self.__output.close()
+
+    # ############################################################
+    # Private Functions                                          #
+    # ############################################################
+    def __shard_options(self, shard: list) -> dict:
+        options = dict(self.__options)
+        if options.get("rate"):
+            # A total rate is shared out by the number of targets each worker probes
+            options["rate"] = options["rate"] * len(shard) / len(self.__targets)
+        return options
@@ -0,0 +1,95 @@
+# ############################################################################################################ #
+# TimerWheel is a hashed timing wheel for probe deadlines.                                                     #
+# Cancelling is O(1) and expiring visits only the slots whose tick has passed, so thousands of outstanding     #
+# deadlines cost little whatever their order. The earliest deadline is also kept in a min-heap whose stale     #
+# entries are dropped lazily, which makes scheduling and asking for the next deadline O(log n) amortized.      #
+# ############################################################################################################ #
+
+import heapq
+import itertools
+import math
+
+DEFAULT_TICK = 0.01          # Seconds per slot
+DEFAULT_SLOTS = 512          # One rotation covers 5.12 s; longer deadlines wait for later rotations
+
+class TimerWheel:
+    def __init__(self, start: float, tick: float = DEFAULT_TICK, slots: int = DEFAULT_SLOTS):
+        self.__tick: float = tick
+        self.__slots: list = [{} for _ in range(slots)]    # Slot -> {key: (deadline, item)}
+        self.__slotOf: dict = {}                           # Key -> slot index, for O(1) cancel
+        self.__currentTick: int = math.floor(start / tick) # Next tick to be processed
+        self.__deadlines: list = []                        # Min-heap of (deadline, order, key), stale ones included
+        self.__order = itertools.count()                   # Breaks deadline ties, so keys are never compared
+
+    def __len__(self) -> int:
+        return len(self.__slotOf)
+
+    # ############################################################
+    # Public Functions                                           #
+    # ############################################################
+    def schedule(self, key, deadline: float, item):
+        """Arms (or re-arms) the timer `key` to fire `item` at `deadline`. Returns the item it replaced, if any."""
+        replaced = self.cancel(key)
+        # A deadline that is already due goes into the next slot to be processed
+        tick = max(math.floor(deadline / self.__tick), self.__currentTick)
+        slot = tick % len(self.__slots)
+        self.__slots[slot][key] = (deadline, item)
+        self.__slotOf[key] = slot
+        if len(self.__deadlines) > 2 * len(self.__slotOf) + len(self.__slots):
+            # Mostly cancelled or expired entries: rebuild from the armed timers to bound the heap
+            self.__deadlines = [(deadline, next(self.__order), key) for slot in self.__slots
+                                for key, (deadline, _) in slot.items()]
+            heapq.heapify(self.__deadlines)
+        else:
+            heapq.heappush(self.__deadlines, (deadline, next(self.__order), key))
+        return replaced
+
+    def cancel(self, key):
+        """Disarms the timer `key` and returns its item, or None if it was not armed."""
+        slot = self.__slotOf.pop(key, None)
+        if slot is None:
+            return None
+        return self.__slots[slot].pop(key)[1]
+
+    def expire(self, now: float) -> list:
+        """Removes and returns the items of every timer whose deadline is at or before `now`."""
+        expired = []
+        if not self.__slotOf:
+            self.__currentTick = max(self.__currentTick, math.floor(now / self.__tick))
+            return expired
+
+        last_tick = math.floor(now / self.__tick)
+        # Beyond one rotation every slot has been visited once, so there is nothing more to find
+        first_tick = max(self.__currentTick, last_tick - len(self.__slots) + 1)
+        for tick in range(first_tick, last_tick + 1):
+            slot = self.__slots[tick % len(self.__slots)]
+            if not slot:
+                continue
+            due = [key for key, (deadline, _) in slot.items() if deadline <= now]
+            for key in due:
+                expired.append(slot.pop(key)[1])
+                del self.__slotOf[key]
+        # The current tick may still receive deadlines later in the same tick
+        self.__currentTick = last_tick
+        return expired
+
+    def clear(self) -> list:
+        """Disarms every timer and returns their items."""
+        items = [item for slot in self.__slots for _, item in slot.values()]
+        for slot in self.__slots:
+            slot.clear()
+        self.__slotOf.clear()
+        self.__deadlines.clear()
+        return items
+
+    def next_deadline(self) -> float:
+        """Returns the earliest armed deadline, or None when nothing is armed."""
+        deadlines = self.__deadlines
+        while deadlines:
+            deadline, _, key = deadlines[0]
+            slot = self.__slotOf.get(key)
+            # Cancelled, expired or re-armed timers leave their entry behind until it surfaces here
+            if slot is not None and self.__slots[slot][key][0] == deadline:
+                return deadline
+            heapq.heappop(deadlines)
+        return None
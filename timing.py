@@ -0,0 +1,49 @@
+# ############################################################################################################ #
+# Clock sources for RTT measurement.                                                                           #
+# Send times come from the monotonic clock. Receive times come either from the kernel (SO_TIMESTAMPNS          #
+# ancillary data via recvmsg), which excludes scheduler and interpreter delay, or from the monotonic clock     #
+# right after the packet was read.                                                                             #
+# ############################################################################################################ #
+
+import socket
+import struct
+import sys
+import time
+
+# Not every Python build exposes the constant; the value is fixed by the Linux ABI
+SO_TIMESTAMPNS = getattr(socket, "SO_TIMESTAMPNS", 35 if sys.platform.startswith("linux") else None)
+TIMESPEC = struct.Struct("@ll")
+TIMESTAMP_ANCILLARY_SIZE = socket.CMSG_SPACE(TIMESPEC.size) if hasattr(socket, "CMSG_SPACE") else 0
+
+CLOCK_SOURCE_MONOTONIC = "monotonic clock (user space)"
+CLOCK_SOURCE_KERNEL = "kernel receive timestamps (SO_TIMESTAMPNS), monotonic send clock"
+
+def enable_kernel_timestamps(sock: socket.socket) -> bool:
+    """Asks the kernel to attach a receive timestamp to every packet. Returns False when unsupported."""
+    if SO_TIMESTAMPNS is None or not TIMESTAMP_ANCILLARY_SIZE:
+        return False
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+    except OSError:
+        return False
+    return True
+
+def kernel_timestamp_to_monotonic_ns(ancdata: list) -> int:
+    """Converts the SO_TIMESTAMPNS ancillary data of a packet to the monotonic clock, in nanoseconds.
+
+    The kernel stamps packets with CLOCK_REALTIME. Only the short delay between the stamp and now is taken
+    from the wall clock, so a wall-clock step can not corrupt the RTT unless it lands inside that window.
+    Falls back to the current monotonic time when no timestamp was attached.
+    """
+    now_monotonic = time.monotonic_ns()
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == SO_TIMESTAMPNS and len(data) >= TIMESPEC.size:
+            seconds, nanoseconds = TIMESPEC.unpack_from(data)
+            delay = time.time_ns() - (seconds * 1_000_000_000 + nanoseconds)
+            return now_monotonic - max(0, delay)
+    return now_monotonic
+
+def receive_with_timestamp(sock: socket.socket, bufferSize: int) -> tuple:
+    """recvfrom() that also returns the kernel receive time on the monotonic clock: (packet, addr, ns)."""
+    packet, ancdata, _, addr = sock.recvmsg(bufferSize, TIMESTAMP_ANCILLARY_SIZE)
+    return packet, addr, kernel_timestamp_to_monotonic_ns(ancdata)
@@ -0,0 +1,249 @@
+# ############################################################################################################ #
+# Traceroute maps the path to one or more destinations with every TTL probed at once.                          #
+# Echo requests for TTL 1..N are sent back to back on a single raw socket. Routers answer with time-exceeded   #
+# errors that quote our original ICMP header, so each answer is matched to its probe by (destination,          #
+# identifier, sequence number) and the sequence number tells the TTL. A path is mapped in about one RTT, plus  #
+# the timeout of hops that never answer.                                                                       #
+# ############################################################################################################ #
+
+import os
+import select
+import struct
+import time
+from socket import IPPROTO_IP, IP_TTL
+from statistics import Statistics
+from icmp_packet import get_icmp_message
+from in_flight import InFlightProbe, InFlightTable
+from packet_template import EchoRequestTemplate
+from reply_decoder import ReplyDecoder
+from resolver import get_default_resolver
+from transport import DEFAULT_TRANSPORT
+from timing import CLOCK_SOURCE_KERNEL, enable_kernel_timestamps
+from constants import ICMPType, TRACEROUTE_MAX_HOPS, TRACEROUTE_PROBES, TRACEROUTE_TIMEOUT
+
+class Hop:
+    __slots__ = ("ttl", "addresses", "statistics", "message")
+
+    def __init__(self, ttl: int):
+        self.ttl: int = ttl
+        self.addresses: dict = {}               # Responding address -> answers, in order of first answer
+        self.statistics = Statistics()          # RTT distribution of the probes sent with this TTL
+        self.message: str = None                # ICMP error that ended the path here, if any
+
+
+class Traceroute:
+    def __init__(self, targets: list, maxHops: int = TRACEROUTE_MAX_HOPS, probesPerHop: int = TRACEROUTE_PROBES,
+                 timeout: float = TRACEROUTE_TIMEOUT, identifier: int = None, debug: bool = False,
+                 socketFilter: bool = True, transport=DEFAULT_TRANSPORT):
+        self.__targets: list = list(dict.fromkeys(targets)) # Host names in the order given
+        self.__maxHops: int = maxHops                        # Highest TTL probed
+        self.__probesPerHop: int = probesPerHop              # Probes sent with each TTL
+        self.__timeout: float = timeout                      # Seconds before a probe is declared unanswered
+        self.__identifier: int = os.getpid() & 0xFFFF if identifier is None else identifier
+        self.__debug: bool = debug                           # Debug flag
+        self.__socketFilter: bool = socketFilter             # Attach a BPF filter for our identifier
+        self.__transport = transport                         # Opens the socket (raw, datagram or simulated)
+        self.__template = EchoRequestTemplate(self.__identifier)
+        self.__decoder = None                                # Reusable receive buffer, created by run()
+        self.__inFlight = InFlightTable()                    # Probes waiting for an answer
+        self.__hosts: dict = {}                              # Destination IP -> host name
+        self.__paths: dict = {}                              # Destination IP -> [Hop for TTL 1..maxHops]
+        self.__outstanding: dict = {}                        # Destination IP -> [in-flight probes per TTL]
+        self.__reachedAt: dict = {}                          # Destination IP -> lowest TTL that reached it
+        self.__elapsed: float = 0.0                          # Seconds from the first send to the last answer
+
+    # ############################################################
+    # Getters                                                    #
+    # ############################################################
+    def get_paths(self) -> dict:
+        """Returns host name -> list of Hop, up to the destination (or the last hop that answered)."""
+        return {self.__hosts[target_ip]: self.__get_path(target_ip) for target_ip in self.__paths}
+
+    def get_elapsed(self) -> float:
+        return self.__elapsed
+
+    # ############################################################
+    # Public Functions                                           #
+    # ############################################################
+    def run(self) -> dict:
+        """Probes every TTL of every destination at once and waits for the answers. Returns get_paths()."""
+        self.__resolve_targets()
+        if not self.__paths:
+            return {}
+
+        with self.__transport.open(1, self.__timeout, self.__identifier) as s:
+            s.setblocking(False)
+            if self.__socketFilter:
+                self.__transport.attach_filter(s, [self.__identifier])
+            # Answers pile up while the probes are still being sent; kernel receive
+            # timestamps keep the send loop out of the RTTs of the first hops.
+            kernel_timestamps = enable_kernel_timestamps(s)
+            self.__decoder = ReplyDecoder(self.__template.get_payload(), kernelTimestamps=kernel_timestamps)
+            if kernel_timestamps:
+                for path in self.__paths.values():
+                    for hop in path:
+                        hop.statistics.set_clock_source(CLOCK_SOURCE_KERNEL)
+            started = time.monotonic()
+            self.__send_probes(s)
+            while not self.__is_complete():
+                next_deadline = self.__inFlight.next_deadline()
+                if next_deadline is None:
+                    break
+                ready = select.select([s], [], [], max(0.0, next_deadline - time.monotonic()))
+                if ready[0]:
+                    self.__receive_pending(s)
+                self.__expire_probes(time.monotonic())
+            self.__elapsed = time.monotonic() - started
+            # Probes past the destination only produce duplicate replies; they are not losses
+            self.__inFlight.drain()
+        return self.get_paths()
+
+    def print_results(self):
+        for target_ip, path in self.__paths.items():
+            host = self.__hosts[target_ip]
+            print(f"\ntraceroute to {host} ({target_ip}), {self.__maxHops} hops max, "
+                  f"{self.__probesPerHop} probes per hop")
+            for hop in self.__get_path(target_ip):
+                self.__print_hop(hop)
+            if target_ip not in self.__reachedAt:
+                print(f"    {host} not reached within {self.__maxHops} hops")
+        print(f"\n--- {len(self.__paths)} paths mapped in {round(self.__elapsed * 1000, 3)} ms ---")
+
+    # ############################################################
+    # Private Functions                                          #
+    # ############################################################
+    def __resolve_targets(self):
+        addresses_by_host = get_default_resolver().resolve_many(self.__targets)
+        for host in self.__targets:
+            target_ip = addresses_by_host[host]
+            if target_ip is None:
+                print(f" [traceroute] Unknown host {host}. Skipping...")
+                continue
+            # Answers are matched on the quoted destination, so each address may only be traced once
+            if target_ip in self.__paths:
+                print(f" [traceroute] {host} ({target_ip}) is already a target. Skipping...")
+                continue
+            self.__hosts[target_ip] = host
+            self.__paths[target_ip] = [Hop(ttl) for ttl in range(1, self.__maxHops + 1)]
+            self.__outstanding[target_ip] = [0] * self.__maxHops
+
+    def __send_probes(self, s):
+        # Rounds go out one after another so that each router sees its probes spread out,
+        # and the TTL only has to be changed once per TTL and round.
+        for round_number in range(self.__probesPerHop):
+            for ttl in range(1, self.__maxHops + 1):
+                s.setsockopt(IPPROTO_IP, IP_TTL, struct.pack("I", ttl))
+                # The sequence number encodes the TTL, so an answer needs no other lookup
+                sequence_number = (ttl - 1) * self.__probesPerHop + round_number
+                for target_ip, path in self.__paths.items():
+                    self.__send_probe(s, target_ip, path[ttl - 1], sequence_number)
+
+    def __send_probe(self, s, targetIp: str, hop: Hop, sequenceNumber: int):
+        packet = self.__template.build(sequenceNumber, time.time())
+        hop.statistics.increment_packets_sent()
+        sent_at = time.monotonic_ns()
+        try:
+            s.sendto(packet, (targetIp, 0))
+        except BlockingIOError:
+            # The send buffer is full; wait for room once rather than dropping the probe
+            select.select([], [s], [], self.__timeout)
+            sent_at = time.monotonic_ns()
+            try:
+                s.sendto(packet, (targetIp, 0))
+            except OSError as e:
+                hop.statistics.increment_packet_errors()
+                print(f"Exception occurred: {e}")
+                return
+        except OSError as e:
+            hop.statistics.increment_packet_errors()
+            print(f"Exception occurred: {e}")
+            return
+
+        self.__inFlight.add(InFlightProbe(
+            self.__identifier, sequenceNumber, targetIp, None, hop.statistics, sent_at,
+            sent_at / 1e9 + self.__timeout
+        ))
+        self.__outstanding[targetIp][hop.ttl - 1] += 1
+
+    def __receive_pending(self, s):
+        while True:
+            try:
+                addr = self.__decoder.receive(s)
+            except (BlockingIOError, InterruptedError):
+                return
+            if addr is not None:
+                self.__handle_packet(addr)
+
+    def __handle_packet(self, addr: tuple):
+        decoder = self.__decoder
+        icmp_type = decoder.get_icmp_type()
+
+        if icmp_type == ICMPType.ECHO_REPLY:
+            echo = decoder.decode_echo()
+            if echo is None:
+                return
+            target_ip = addr[0]
+            _, _, _, identifier, sequence_number, _ = echo
+        elif icmp_type in [ICMPType.DESTINATION_UNREACHABLE, ICMPType.TIME_EXCEEDED]:
+            # The quoted header is the echo request the router dropped
+            quoted = decoder.decode_quoted()
+            if quoted is None:
+                return
+            target_ip, identifier, sequence_number = quoted
+        else:
+            return
+
+        if identifier != self.__identifier:
+            return
+        probe = self.__inFlight.pop(target_ip, identifier, sequence_number)
+        if probe is None:
+            if self.__debug:
+                print(f"Ignoring answer from {addr[0]} for {target_ip} icmp_seq={sequence_number}: not in flight.")
+            return
+
+        ttl = sequence_number // self.__probesPerHop + 1
+        hop = self.__paths[target_ip][ttl - 1]
+        self.__outstanding[target_ip][ttl - 1] -= 1
+        hop.addresses[addr[0]] = hop.addresses.get(addr[0], 0) + 1
+        hop.statistics.update_rtt((decoder.get_received_at() - probe.sentAt) / 1e6)
+
+        if icmp_type == ICMPType.TIME_EXCEEDED:
+            return
+        # An echo reply, or an error that ends the path, means no higher TTL gets any further
+        if icmp_type == ICMPType.DESTINATION_UNREACHABLE:
+            hop.message = get_icmp_message(icmp_type, decoder.get_icmp_code())
+        if ttl < self.__reachedAt.get(target_ip, self.__maxHops + 1):
+            self.__reachedAt[target_ip] = ttl
+
+    def __expire_probes(self, now: float):
+        for probe in self.__inFlight.expire(now):
+            probe.statistics.increment_packet_errors()
+            self.__outstanding[probe.targetIp][probe.sequenceNumber // self.__probesPerHop] -= 1
+
+    def __is_complete(self) -> bool:
+        """True once every destination has either been reached with all lower TTLs settled, or has no probes left."""
+        for target_ip, outstanding in self.__outstanding.items():
+            last_ttl = self.__reachedAt.get(target_ip, self.__maxHops)
+            if any(outstanding[:last_ttl]):
+                return False
+        return True
+
+    def __get_path(self, targetIp: str) -> list:
+        path = self.__paths[targetIp]
+        if targetIp in self.__reachedAt:
+            return path[:self.__reachedAt[targetIp]]
+        answered = [hop.ttl for hop in path if hop.addresses]
+        return path[:answered[-1]] if answered else []
+
+    def __print_hop(self, hop: Hop):
+        summary = hop.statistics.get_summary()
+        answered = f"{summary['received']}/{summary['transmitted']} answered"
+        if not hop.addresses:
+            print(f"{hop.ttl:>2}  *  {answered}")
+            return
+        addresses = ", ".join(hop.addresses)
+        print(f"{hop.ttl:>2}  {addresses}  "
+              f"min/avg/max/mdev = {round(summary['rtt_min'], 3)}/{round(summary['rtt_avg'], 3)}/"
+              f"{round(summary['rtt_max'], 3)}/{round(summary['rtt_mdev'], 3)} ms  {answered}")
+        if hop.message is not None:
+            print(f"    From {addresses}: {hop.message}")
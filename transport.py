@@ -0,0 +1,188 @@
+# ############################################################################################################ #
+# Transports open the endpoint probes are sent and received on.                                                #
+# RawTransport uses a raw ICMP socket (root), DatagramTransport an unprivileged ICMP datagram socket (Linux    #
+# "ping socket", allowed by net.ipv4.ping_group_range), and SimulatedNetwork (simulated_network.py) an         #
+# in-process network. Every endpoint behaves like a raw ICMP socket: received datagrams start with an IPv4     #
+# header, so the decoders work unchanged on all of them.                                                       #
+# ############################################################################################################ #
+
+import errno
+import socket
+import struct
+import sys
+from bpf import attach_filter
+from simulated_network import SimulatedNetwork
+from constants import IP_HEADER_SIZE, TTL, TIMEOUT
+
+IP_RECVTTL = getattr(socket, "IP_RECVTTL", 12 if sys.platform.startswith("linux") else None)
+IP_MTU_DISCOVER = getattr(socket, "IP_MTU_DISCOVER", 10 if sys.platform.startswith("linux") else None)
+IP_PMTUDISC_DO = getattr(socket, "IP_PMTUDISC_DO", 2)  # Always set DF, never fragment locally
+TTL_ANCILLARY_SIZE = socket.CMSG_SPACE(4) if hasattr(socket, "CMSG_SPACE") else 0
+INT = struct.Struct("@i")
+SYNTHETIC_IP_HEADER = struct.Struct("!BBHHHBBH4s4s")
+ANY_ADDRESS = socket.inet_aton("0.0.0.0")
+
+class IdentifierInUseError(OSError):
+    """Another ICMP datagram socket already holds the identifier, as its local port."""
+
+
+def create_icmp_socket(ttl: int = TTL, ipTimeout: float = TIMEOUT, identifiers=None) -> socket.socket:
+    """Opens a raw ICMP socket bound to any interface with the given IP TTL.
+
+    With `identifiers`, a BPF filter keeps every ICMP message that is not a reply to one of them in the kernel.
+    """
+    s = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+    s.settimeout(ipTimeout)
+    s.bind(("", 0)) # Bind to any available interface
+    s.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, struct.pack("I", ttl))
+    if identifiers:
+        attach_filter(s, identifiers)
+    return s
+
+def set_dont_fragment(s) -> bool:
+    """Sets the don't-fragment bit on every datagram sent on `s`. A datagram larger than the MTU known for its
+    route is then refused with EMSGSIZE instead of being fragmented. Returns False where this is not supported.
+    """
+    if IP_MTU_DISCOVER is None:
+        return False
+    try:
+        s.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_DO)
+    except OSError:
+        return False
+    return True
+
+class RawTransport:
+    """Raw ICMP socket; needs root (or CAP_NET_RAW) and sees every ICMP message, including errors."""
+    name = "raw"
+
+    def open(self, ttl: int = TTL, timeout: float = TIMEOUT, identifier: int = None):
+        return create_icmp_socket(ttl, timeout)
+
+    def attach_filter(self, endpoint, identifiers) -> bool:
+        return attach_filter(endpoint, identifiers)
+
+    def set_dont_fragment(self, endpoint) -> bool:
+        return set_dont_fragment(endpoint)
+
+
+class DatagramTransport:
+    """ICMP datagram socket; needs no privileges where net.ipv4.ping_group_range allows it.
+
+    The kernel sets the echo identifier to the socket's port and only delivers echo replies to it;
+    ICMP errors (unreachable, time exceeded) are not delivered, so those probes time out instead.
+    """
+    name = "datagram"
+
+    def open(self, ttl: int = TTL, timeout: float = TIMEOUT, identifier: int = None):
+        return DatagramIcmpSocket(ttl, timeout, identifier)
+
+    def attach_filter(self, endpoint, identifiers) -> bool:
+        return False  # The kernel already filters by identifier, and the program expects an IP header
+
+    def set_dont_fragment(self, endpoint) -> bool:
+        return set_dont_fragment(endpoint)
+
+
+class DatagramIcmpSocket:
+    def __init__(self, ttl: int, timeout: float, identifier: int = None):
+        self.__socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+        self.__socket.settimeout(timeout)
+        # The port is the identifier of every echo request sent on this socket
+        try:
+            self.__socket.bind(("", identifier or 0))
+        except OSError as e:
+            self.__socket.close()
+            if e.errno != errno.EADDRINUSE:
+                raise
+            raise IdentifierInUseError(
+                e.errno, f"ICMP identifier {identifier} is already in use by another datagram socket "
+                         "(another run in this process, or a process with the same identifier)"
+            ) from None
+        self.__socket.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, ttl)
+        # There is no IP header to read the reply TTL from, so ask for it as ancillary data
+        if IP_RECVTTL is not None and TTL_ANCILLARY_SIZE:
+            try:
+                self.__socket.setsockopt(socket.IPPROTO_IP, IP_RECVTTL, 1)
+            except OSError:
+                pass
+
+    def __enter__(self) -> 'DatagramIcmpSocket':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # ############################################################
+    # Public Functions                                           #
+    # ############################################################
+    def fileno(self) -> int:
+        return self.__socket.fileno()
+
+    def get_identifier(self) -> int:
+        return self.__socket.getsockname()[1]
+
+    def sendto(self, packet: bytes, addr: tuple) -> int:
+        return self.__socket.sendto(packet, addr)
+
+    def recvmsg_into(self, buffers: list, ancillarySize: int = 0) -> tuple:
+        """Receives the ICMP message after room for an IPv4 header, then fills the header in."""
+        view = memoryview(buffers[0])
+        length, ancdata, flags, addr = self.__socket.recvmsg_into(
+            [view[IP_HEADER_SIZE:]], ancillarySize + TTL_ANCILLARY_SIZE
+        )
+        view[:IP_HEADER_SIZE] = self.__ip_header(length, ancdata, addr)
+        return IP_HEADER_SIZE + length, ancdata, flags, addr
+
+    def recvmsg(self, bufferSize: int, ancillarySize: int = 0) -> tuple:
+        data, ancdata, flags, addr = self.__socket.recvmsg(bufferSize, ancillarySize + TTL_ANCILLARY_SIZE)
+        return self.__ip_header(len(data), ancdata, addr) + data, ancdata, flags, addr
+
+    def recvfrom_into(self, buffer) -> tuple:
+        length, _, _, addr = self.recvmsg_into([buffer])
+        return length, addr
+
+    def recvfrom(self, bufferSize: int) -> tuple:
+        data, _, _, addr = self.recvmsg(bufferSize)
+        return data, addr
+
+    def setsockopt(self, *args):
+        self.__socket.setsockopt(*args)
+
+    def setblocking(self, flag: bool):
+        self.__socket.setblocking(flag)
+
+    def settimeout(self, value: float):
+        self.__socket.settimeout(value)
+
+    def close(self):
+        self.__socket.close()
+
+    # ############################################################
+    # Private Functions                                          #
+    # ############################################################
+    def __ip_header(self, length: int, ancdata: list, addr: tuple) -> bytes:
+        ttl = 0
+        for level, kind, data in ancdata:
+            if level == socket.IPPROTO_IP and kind == socket.IP_TTL and len(data) >= INT.size:
+                ttl = INT.unpack_from(data)[0]
+        return SYNTHETIC_IP_HEADER.pack(
+            0x45, 0, IP_HEADER_SIZE + length, 0, 0, ttl, socket.IPPROTO_ICMP, 0,
+            socket.inet_aton(addr[0]), ANY_ADDRESS
+        )
+
+
+DEFAULT_TRANSPORT = RawTransport()
+TRANSPORTS = (RawTransport.name, DatagramTransport.name, SimulatedNetwork.name)
+
+def get_transport(name: str, simulation: str = None):
+    """Returns the transport called `name` (one of TRANSPORTS); `simulation` configures the simulated network.
+
+    Raises ValueError for an unknown name or an invalid simulation spec.
+    """
+    if name == RawTransport.name:
+        return DEFAULT_TRANSPORT
+    if name == DatagramTransport.name:
+        return DatagramTransport()
+    if name == SimulatedNetwork.name:
+        return SimulatedNetwork.from_spec(simulation or "")
+    raise ValueError(f"Unknown transport: {name}")